@@ -0,0 +1,283 @@
+"""Adaptive concurrency limits, request deadlines and retries for upstream calls.
+
+Each upstream (OpenAI embeddings, Upstash, OpenAI chat) gets an
+``AdaptiveLimiter`` that caps its in-flight calls with an AIMD limit: a call
+that succeeds while the limiter is saturated raises the limit by ``1 / limit``,
+and an overload signal (HTTP 429/503, timeouts) multiplies it by ``backoff``, at
+most once per observed round trip so one burst of 429s counts once. Callers
+beyond the limit wait in a bounded FIFO queue. Instead of queueing, a caller is
+shed with ``LimiterRejected`` when the queue is full or when its expected wait
+would not fit the request's remaining deadline, so the API answers 503 with
+``Retry-After`` right away rather than timing out later.
+
+The deadline is a context variable set once per request by
+``start_request_deadline``; tasks started from the request inherit it. Without a
+deadline (batch jobs, CLI), callers queue until a slot frees up.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, TypeVar
+
+import httpx
+import openai
+
+from .metrics import UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_RETRIES, UPSTREAM_SHED
+
+T = TypeVar("T")
+
+_LATENCY_SMOOTHING = 0.2
+# Lower bound on the time between two limit decreases while no latency has been observed yet.
+_MIN_DECREASE_INTERVAL = 0.1
+_MAX_RETRY_AFTER_SECONDS = 30
+_OVERLOAD_STATUS_CODES = frozenset({429, 503})
+_RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+_request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+def start_request_deadline(seconds: float) -> None:
+    """Give the current request ``seconds`` to finish; 0 or less means no deadline."""
+
+    _request_deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+
+def remaining_time() -> float | None:
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _status_code(exc: BaseException) -> int | None:
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    return None
+
+
+def is_overload(exc: BaseException) -> bool:
+    """Whether the upstream signalled that it has more work than it can take."""
+
+    if _status_code(exc) in _OVERLOAD_STATUS_CODES:
+        return True
+    return isinstance(exc, (httpx.TimeoutException, openai.APITimeoutError))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status_code = _status_code(exc)
+    if status_code is not None:
+        return status_code in _RETRYABLE_STATUS_CODES
+    return isinstance(exc, (httpx.TransportError, openai.APIConnectionError))
+
+
+def _retry_after_hint(exc: BaseException) -> float:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if isinstance(response, httpx.Response) else None
+    try:
+        return max(float(value), 0.0) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+class LimiterRejected(Exception):
+    """Raised instead of queueing a call that would not get a slot in time."""
+
+    def __init__(self, upstream: str, reason: str, retry_after: int) -> None:
+        super().__init__(f"{upstream} is over its concurrency limit ({reason})")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        upstream: str,
+        *,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int,
+        max_queue: int,
+        backoff: float = 0.7,
+        max_retries: int = 2,
+        retry_base_delay: float = 0.2,
+        retry_max_delay: float = 2.0,
+        enabled: bool = True,
+    ) -> None:
+        self.upstream = upstream
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.max_queue = max(0, max_queue)
+        self.backoff = min(max(backoff, 0.1), 1.0)
+        self.max_retries = max(0, max_retries)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.enabled = enabled
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future[None]] = deque()
+        self._latency: float | None = None
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.overloads = 0
+        self.retries = 0
+        UPSTREAM_CONCURRENCY_LIMIT.set(self.limit, upstream=upstream)
+
+    async def call(self, factory: Callable[[], Awaitable[T]]) -> T:
+        """Run ``factory`` under the limit, retrying transient failures with jittered backoff.
+
+        A retry only happens when its delay plus a typical call still fits the
+        request deadline; otherwise the last error is raised.
+        """
+
+        attempt = 0
+        while True:
+            try:
+                async with self.acquire():
+                    return await factory()
+            except LimiterRejected:
+                raise
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                # Full jitter spreads the retries of callers that failed together.
+                backoff = random.uniform(0.0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt))
+                delay = max(backoff, _retry_after_hint(exc))
+                budget = remaining_time()
+                if budget is not None and delay + self._expected_latency() >= budget:
+                    raise
+                attempt += 1
+                self.retries += 1
+                UPSTREAM_RETRIES.inc(upstream=self.upstream)
+                await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """Hold one slot for the body; the body's outcome feeds the limit."""
+
+        if not self.enabled:
+            yield
+            return
+
+        saturated = await self._admit()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as exc:
+            self._release(started, "overload" if is_overload(exc) else "error", saturated)
+            raise
+        except BaseException:
+            self._release(started, "cancelled", saturated)
+            raise
+        self._release(started, "ok", saturated)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is expected to drain, for ``Retry-After``."""
+
+        wait = self._expected_wait(len(self._waiters) + 1) + self._expected_latency()
+        return min(max(1, math.ceil(wait)), _MAX_RETRY_AFTER_SECONDS)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "latency_ms": round(self._latency * 1000, 1) if self._latency is not None else None,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "overloads": self.overloads,
+            "retries": self.retries,
+        }
+
+    def _slots(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def _admit(self) -> bool:
+        """Take a slot, queueing if needed; returns whether the limiter was saturated."""
+
+        if self._in_flight < self._slots() and not self._waiters:
+            self._in_flight += 1
+            self.admitted += 1
+            return self._in_flight >= self._slots()
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+        budget = remaining_time()
+        if budget is not None:
+            # The call itself has to fit into the deadline too.
+            budget -= self._expected_latency()
+            if budget <= self._expected_wait(len(self._waiters) + 1):
+                self._reject("deadline")
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, budget)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._reject("deadline")
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away; pass it on.
+                self._in_flight -= 1
+                self._grant()
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def _release(self, started: float, outcome: str, saturated: bool) -> None:
+        self._in_flight -= 1
+        now = time.monotonic()
+        if outcome == "overload":
+            self.overloads += 1
+            # Calls already in flight were sent under the old limit; decrease once per round trip.
+            if now - self._last_decrease >= max(self._expected_latency(), _MIN_DECREASE_INTERVAL):
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._last_decrease = now
+                UPSTREAM_CONCURRENCY_LIMIT.set(self.limit, upstream=self.upstream)
+        elif outcome == "ok":
+            elapsed = now - started
+            self._latency = (
+                elapsed
+                if self._latency is None
+                else self._latency + (elapsed - self._latency) * _LATENCY_SMOOTHING
+            )
+            if saturated and self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                UPSTREAM_CONCURRENCY_LIMIT.set(self.limit, upstream=self.upstream)
+        self._grant()
+
+    def _grant(self) -> None:
+        while self._waiters and self._in_flight < self._slots():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            self._in_flight += 1
+
+    def _discard(self, waiter: asyncio.Future[None]) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _reject(self, reason: str) -> None:
+        self.shed += 1
+        UPSTREAM_SHED.inc(upstream=self.upstream, reason=reason)
+        raise LimiterRejected(self.upstream, reason, self.retry_after())
+
+    def _expected_latency(self) -> float:
+        return self._latency or 0.0
+
+    def _expected_wait(self, position: int) -> float:
+        return position * self._expected_latency() / self._slots()
@@ -0,0 +1,155 @@
+"""Batch chat: replay many questions through the RAG pipeline in one call.
+
+Input is JSONL, one question per line. ``message`` is read first, then ``query``,
+``body`` and ``title``, so a backlog file such as ``requests.jsonl`` can be fed in
+as-is; ``id`` (or ``request_id``) and ``history`` are optional. Every query that
+needs an embedding is embedded up front with batched embeddings requests; the
+rest of each pipeline runs under a concurrency limit and results are emitted as
+JSONL in completion order::
+
+    python -m app.batch_chat ../requests.jsonl --out results.jsonl --concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from . import services
+from .models import ChatMessage
+
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "10000"))
+_MESSAGE_FIELDS = ("message", "query", "body", "title")
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    index: int
+    id: str
+    message: str
+    history: List[ChatMessage]
+
+
+def parse_batch_lines(lines: Iterable[str]) -> Tuple[List[BatchItem], List[Dict[str, Any]]]:
+    """Split JSONL lines into runnable items and error records for lines that cannot run."""
+
+    items: List[BatchItem] = []
+    rejected: List[Dict[str, Any]] = []
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("line is not a JSON object")
+            message = next((record[key] for key in _MESSAGE_FIELDS if isinstance(record.get(key), str)), "")
+            if not message.strip():
+                raise ValueError(f"line has none of {', '.join(_MESSAGE_FIELDS)}")
+            history = [ChatMessage.model_validate(entry) for entry in record.get("history") or []]
+        except (ValueError, ValidationError) as exc:
+            rejected.append(_error_record(index, None, 400, f"Invalid batch line: {exc}"))
+            continue
+        item_id = record.get("id", record.get("request_id"))
+        item_id = str(item_id) if item_id is not None else str(index)
+        items.append(BatchItem(index=index, id=item_id, message=message, history=history))
+    return items, rejected
+
+
+def _error_record(index: int, item_id: str | None, status_code: int, detail: Any) -> Dict[str, Any]:
+    return {"index": index, "id": item_id, "error": {"status_code": status_code, "detail": detail}}
+
+
+async def run_batch(
+    items: List[BatchItem],
+    *,
+    concurrency: int = CHAT_BATCH_CONCURRENCY,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield one result record per item as it completes.
+
+    Embedding happens before the first record, so a failed embeddings request is
+    raised to the caller instead of being reported once per item.
+    """
+
+    embeddings: Dict[int, List[float]] = {}
+    if not services.USE_FAKE_RAG:
+        texts = {item.index: services.embedding_text_for(item.message) for item in items}
+        pending = [(index, text) for index, text in texts.items() if text is not None]
+        if pending:
+            vectors = await services.create_query_embeddings([text for _, text in pending])
+            embeddings = {index: vector for (index, _), vector in zip(pending, vectors)}
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(item: BatchItem) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                response = await services.chat(
+                    item.message, item.history, embedding=embeddings.get(item.index), endpoint="batch"
+                )
+            except HTTPException as exc:
+                return _error_record(item.index, item.id, exc.status_code, exc.detail)
+            except Exception as exc:
+                return _error_record(item.index, item.id, 500, f"Failed to generate answer: {exc}")
+        return {
+            "index": item.index,
+            "id": item.id,
+            "answer": response.answer,
+            "meta": response.meta.model_dump(mode="json", by_alias=True),
+        }
+
+    tasks = [asyncio.ensure_future(_run(item)) for item in items]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # The consumer may stop early (client disconnect); do not leave work running.
+        for task in tasks:
+            task.cancel()
+
+
+def encode_record(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+async def _main(args: argparse.Namespace) -> int:
+    with open(args.input, "r", encoding="utf-8") as f:
+        items, rejected = parse_batch_lines(f)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    await services.start_http_clients()
+    failures = len(rejected)
+    try:
+        for record in rejected:
+            out.write(encode_record(record))
+        async for record in run_batch(items, concurrency=args.concurrency):
+            failures += "error" in record
+            out.write(encode_record(record))
+            out.flush()
+    finally:
+        await services.close_http_clients()
+        if out is not sys.stdout:
+            out.close()
+    print(f"items={len(items) + len(rejected)} failed={failures}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the chat pipeline")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("--out", help="write JSONL results here instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=CHAT_BATCH_CONCURRENCY)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""Compact binary card master data that workers memory-map instead of parsing data.json.
+
+``python -m app.card_pack build`` compiles ``data/data.json`` into one file:
+
+* an interned string table (every distinct string, including field names, stored once)
+* a field table: one ``(key, tag, value)`` row per card field, grouped by card, where
+  ``value`` is a string id, an integer, float bits or a slice of the list table
+* per-card columns: id, field range, precomputed ``CardSummary`` JSON and a content digest
+* the ``LexicalIndex`` tables: normalized texts, gram statistics and BM25 postings
+
+All sections are views over a read-only ``mmap``, so uvicorn workers share the
+pages through the OS page cache. A worker maps the file, restores the lexical
+index from its tables (the postings stay in the mapping) and builds the
+attribute index from the few fields it reads; nothing is parsed or scored at
+load. A card is decoded into a dict on its first lookup and then served from an
+LRU (``CARD_PACK_CACHE_SIZE``). Point ``CARD_DATA_PATH`` at the compiled file to
+use it; the hot-reload watcher picks up a rebuilt pack because it is replaced
+atomically.
+
+    python -m app.card_pack build --data ../data/data.json --out ../data/cards.pack
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Sequence, Tuple
+
+import numpy as np
+from pydantic import ValidationError
+
+from .cards import build_card_summary, serialize_card_summary
+from .lexical_index import LexicalIndex, LexicalTables
+from .models import CardSummary
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GCCARDS\x00"
+# Bump when the layout changes, and when LexicalIndex scoring or normalization changes (packs store its tables).
+FORMAT_VERSION = 2
+_NO_STRING = 0xFFFFFFFF
+
+# Field value tags.
+_TAG_NULL, _TAG_FALSE, _TAG_TRUE, _TAG_INT, _TAG_FLOAT, _TAG_STR, _TAG_STR_LIST, _TAG_JSON = range(8)
+
+_FIELD_DTYPE = np.dtype([("key", "<u4"), ("tag", "<u4"), ("value", "<i8")])
+_FIELD_STRUCT = struct.Struct("<IIq")
+_SECTIONS: Tuple[Tuple[str, np.dtype], ...] = (
+    ("string_offsets", np.dtype("<u8")),
+    ("string_data", np.dtype("u1")),
+    ("ids", np.dtype("<u4")),
+    ("field_starts", np.dtype("<u4")),
+    ("fields", _FIELD_DTYPE),
+    ("lists", np.dtype("<u4")),
+    ("summaries", np.dtype("<u4")),
+    ("digests", np.dtype("<u8")),
+    # LexicalTables: per-row normalized texts, per-field gram statistics and the postings.
+    ("lexical_names", np.dtype("<u4")),
+    ("lexical_effect_texts", np.dtype("<u4")),
+    ("lexical_df_starts", np.dtype("<u8")),
+    ("lexical_df_grams", np.dtype("<u4")),
+    ("lexical_df_counts", np.dtype("<u4")),
+    ("lexical_total_lengths", np.dtype("<u8")),
+    ("lexical_grams", np.dtype("<u4")),
+    ("lexical_posting_starts", np.dtype("<u8")),
+    ("lexical_rows", np.dtype("<i4")),
+    ("lexical_weights", np.dtype("<f4")),
+)
+_HEADER = struct.Struct("<8sII" + "QQ" * len(_SECTIONS))
+_ALIGNMENT = 8
+_INT64_RANGE = (-(2**63), 2**63 - 1)
+
+
+def card_digest(card: dict) -> int:
+    """64-bit content hash of one card, independent of key order and formatting."""
+
+    canonical = json.dumps(card, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def is_card_pack(path: str | os.PathLike[str]) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.encoded: List[bytes] = []
+
+    def intern(self, value: str) -> int:
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.encoded)
+            self.encoded.append(value.encode("utf-8"))
+        return string_id
+
+
+def compile_cards(cards: Sequence[dict], out_path: str | os.PathLike[str]) -> Dict[str, int]:
+    """Write ``cards`` (data.json items with an ``id``) as a card pack; returns size statistics."""
+
+    strings = _StringTable()
+    fields: List[Tuple[int, int, int]] = []
+    lists: List[int] = []
+    ids: List[int] = []
+    field_starts: List[int] = [0]
+    summaries: List[int] = []
+    digests: List[int] = []
+    unique: Dict[str, dict] = {}
+    for card in cards:
+        if not isinstance(card, dict) or "id" not in card:
+            continue
+        card_id = str(card["id"])
+        if card_id in unique:
+            # Later duplicates win in data.json loading; keep that behaviour.
+            logger.warning("Duplicate card id %s in card data; keeping the last one", card_id)
+        unique[card_id] = card
+
+    for card_id, card in unique.items():
+        ids.append(strings.intern(card_id))
+        for key, value in card.items():
+            fields.append((strings.intern(key), *_encode_value(value, strings, lists)))
+        field_starts.append(len(fields))
+        try:
+            summary = build_card_summary(card_id, card)
+        except ValidationError as e:
+            logger.warning(f"Skipping card summary for {card_id}: {e}")
+            summaries.append(_NO_STRING)
+        else:
+            summaries.append(strings.intern(serialize_card_summary(summary).decode("utf-8")))
+        digests.append(card_digest(card))
+
+    lexical = _lexical_sections(LexicalIndex(unique).tables(), strings)
+    string_offsets = np.zeros(len(strings.encoded) + 1, dtype="<u8")
+    np.cumsum([len(encoded) for encoded in strings.encoded], out=string_offsets[1:])
+    sections = {
+        "string_offsets": string_offsets,
+        "string_data": np.frombuffer(b"".join(strings.encoded), dtype="u1"),
+        "ids": np.asarray(ids, dtype="<u4"),
+        "field_starts": np.asarray(field_starts, dtype="<u4"),
+        "fields": np.asarray(fields, dtype=_FIELD_DTYPE) if fields else np.zeros(0, dtype=_FIELD_DTYPE),
+        "lists": np.asarray(lists, dtype="<u4"),
+        "summaries": np.asarray(summaries, dtype="<u4"),
+        "digests": np.asarray(digests, dtype="<u8"),
+        **lexical,
+    }
+
+    target = Path(out_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Replace atomically: workers keep mapping the old inode until they reload.
+    tmp_path = target.with_name(f".{target.name}.tmp")
+    layout: List[int] = []
+    offset = _HEADER.size
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        for name, dtype in _SECTIONS:
+            offset += -offset % _ALIGNMENT
+            f.seek(offset)
+            data = sections[name].astype(dtype, copy=False).tobytes()
+            f.write(data)
+            layout.extend((offset, len(data)))
+            offset += len(data)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(ids), *layout))
+    os.replace(tmp_path, target)
+    return {"cards": len(ids), "strings": len(strings.encoded), "fields": len(fields), "bytes": offset}
+
+
+def _lexical_sections(tables: LexicalTables, strings: _StringTable) -> Dict[str, np.ndarray]:
+    postings = list(tables.postings.items())
+    return {
+        "lexical_names": np.asarray([strings.intern(text) for text in tables.names], dtype="<u4"),
+        "lexical_effect_texts": np.asarray([strings.intern(text) for text in tables.effect_texts], dtype="<u4"),
+        "lexical_df_starts": np.cumsum([0, *map(len, tables.document_frequencies)], dtype="<u8"),
+        "lexical_df_grams": np.asarray(
+            [strings.intern(gram) for frequencies in tables.document_frequencies for gram in frequencies], dtype="<u4"
+        ),
+        "lexical_df_counts": np.asarray(
+            [count for frequencies in tables.document_frequencies for count in frequencies.values()], dtype="<u4"
+        ),
+        "lexical_total_lengths": np.asarray(tables.total_lengths, dtype="<u8"),
+        "lexical_grams": np.asarray([strings.intern(gram) for gram, _ in postings], dtype="<u4"),
+        "lexical_posting_starts": np.cumsum([0, *(len(rows) for _, (rows, _) in postings)], dtype="<u8"),
+        "lexical_rows": np.concatenate([rows for _, (rows, _) in postings] or [np.empty(0)]).astype("<i4"),
+        "lexical_weights": np.concatenate([weights for _, (_, weights) in postings] or [np.empty(0)]).astype("<f4"),
+    }
+
+
+def _encode_value(value: object, strings: _StringTable, lists: List[int]) -> Tuple[int, int]:
+    if value is None:
+        return _TAG_NULL, 0
+    if value is True or value is False:
+        return (_TAG_TRUE if value else _TAG_FALSE), 0
+    if isinstance(value, int) and _INT64_RANGE[0] <= value <= _INT64_RANGE[1]:
+        return _TAG_INT, value
+    if isinstance(value, float):
+        return _TAG_FLOAT, struct.unpack("<q", struct.pack("<d", value))[0]
+    if isinstance(value, str):
+        return _TAG_STR, strings.intern(value)
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        start = len(lists)
+        lists.extend(strings.intern(item) for item in value)
+        return _TAG_STR_LIST, (start << 32) | len(value)
+    return _TAG_JSON, strings.intern(json.dumps(value, ensure_ascii=False))
+
+
+class CardPack(Mapping[str, dict]):
+    """Read-only ``card_id -> card dict`` view over a memory-mapped card pack.
+
+    Decoded cards are kept in an LRU of ``cache_size`` entries, so repeated
+    lookups of the same card return the same dict, as with data.json. Index
+    builds go through ``project`` and ``lexical_tables`` instead of decoding
+    whole cards.
+
+    The file must be replaced (``os.replace``), never rewritten in place: touching
+    a mapping whose file was truncated kills the process with SIGBUS. Reads do not
+    check for that; ``stale`` tells, and ``CardStore`` checks it once per reload,
+    which the changed mtime triggers.
+    """
+
+    def __init__(self, path: str | os.PathLike[str], *, cache_size: int = 1024) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._identity = (stat.st_size, stat.st_mtime_ns)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{self.path} is not a card pack")
+        magic, version, card_count, *layout = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a card pack")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has card pack format {version}, expected {FORMAT_VERSION}; rebuild it")
+        if sys.byteorder != "little":
+            raise ValueError("Card packs are little-endian and can only be mapped on little-endian hosts")
+
+        # Plain memoryview casts: scalar reads are much cheaper than on numpy views.
+        view = memoryview(self._mmap)
+        sections: Dict[str, memoryview] = {}
+        for index, (name, dtype) in enumerate(_SECTIONS):
+            offset, length = layout[2 * index], layout[2 * index + 1]
+            section = view[offset : offset + length]
+            sections[name] = section if dtype.names else section.cast(dtype.char)
+        self._sections = sections
+        self._string_offsets = sections["string_offsets"]
+        self._string_data = sections["string_data"]
+        self._ids = sections["ids"]
+        self._field_starts = sections["field_starts"]
+        self._fields = sections["fields"]
+        self._lists = sections["lists"]
+        self._summaries = sections["summaries"]
+        self._digests = sections["digests"]
+        row_counts = {
+            len(self._ids),
+            len(self._summaries),
+            len(self._digests),
+            len(self._field_starts) - 1,
+            len(sections["lexical_names"]),
+            len(sections["lexical_effect_texts"]),
+        }
+        if row_counts != {card_count}:
+            raise ValueError(f"{self.path} is truncated or corrupt")
+
+        # compile_cards writes each id once, so rows are also the lexical index rows.
+        self._rows: Dict[str, int] = {self._string(string_id): row for row, string_id in enumerate(self._ids)}
+        # Field names repeat on every card; decode each once.
+        self._keys: Dict[int, str] = {}
+        self.cache_size = max(0, cache_size)
+        self._decoded: "OrderedDict[str, dict]" = OrderedDict()
+
+    @property
+    def stale(self) -> bool:
+        """True when the mapped file was modified in place after it was opened."""
+
+        stat = os.fstat(self._file.fileno())
+        return (stat.st_size, stat.st_mtime_ns) != self._identity
+
+    def _string(self, string_id: int) -> str:
+        return str(self._string_data[self._string_offsets[string_id] : self._string_offsets[string_id + 1]], "utf-8")
+
+    def __getitem__(self, card_id: str) -> dict:
+        card = self.get(card_id)
+        if card is None:
+            raise KeyError(card_id)
+        return card
+
+    def get(self, card_id: str, default: dict | None = None) -> dict | None:  # type: ignore[override]
+        card = self._decoded.get(card_id)
+        if card is not None:
+            self._decoded.move_to_end(card_id)
+            return card
+        row = self._rows.get(card_id)
+        if row is None:
+            return default
+        card = self._decode(row)
+        if self.cache_size:
+            self._decoded[card_id] = card
+            if len(self._decoded) > self.cache_size:
+                self._decoded.popitem(last=False)
+        return card
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, card_id: object) -> bool:
+        return card_id in self._rows
+
+    def project(self, keys: Iterable[str]) -> "PackProjection":
+        """View whose cards hold only ``keys``; decoded on every access and not cached."""
+
+        wanted = set(keys)
+        key_ids = np.unique(np.frombuffer(self._fields, dtype=_FIELD_DTYPE)["key"])
+        return PackProjection(self, frozenset(int(key_id) for key_id in key_ids if self._key(int(key_id)) in wanted))
+
+    def _key(self, key_id: int) -> str:
+        key = self._keys.get(key_id)
+        if key is None:
+            key = self._keys[key_id] = self._string(key_id)
+        return key
+
+    def _decode(self, row: int, key_ids: FrozenSet[int] | None = None) -> dict:
+        size = _FIELD_STRUCT.size
+        fields = self._fields[self._field_starts[row] * size : self._field_starts[row + 1] * size]
+        keys = self._keys
+        card: dict = {}
+        for key_id, tag, value in _FIELD_STRUCT.iter_unpack(fields):
+            if key_ids is not None and key_id not in key_ids:
+                continue
+            key = keys[key_id] if key_id in keys else self._key(key_id)
+            # Strings and integers are most fields; skip the dispatch for them.
+            if tag == _TAG_STR:
+                card[key] = self._string(value)
+            elif tag == _TAG_INT:
+                card[key] = value
+            else:
+                card[key] = self._decode_value(tag, value)
+        return card
+
+    def _decode_value(self, tag: int, value: int) -> object:
+        if tag == _TAG_STR:
+            return self._string(value)
+        if tag == _TAG_INT:
+            return value
+        if tag == _TAG_STR_LIST:
+            start, count = value >> 32, value & 0xFFFFFFFF
+            return [self._string(string_id) for string_id in self._lists[start : start + count]]
+        if tag == _TAG_NULL:
+            return None
+        if tag == _TAG_FALSE or tag == _TAG_TRUE:
+            return tag == _TAG_TRUE
+        if tag == _TAG_FLOAT:
+            return struct.unpack("<d", struct.pack("<q", value))[0]
+        return json.loads(self._string(value))
+
+    def digest(self, card_id: str) -> int:
+        return self._digests[self._rows[card_id]]
+
+    def summarized_ids(self) -> List[str]:
+        """Ids of the cards that have a summary, in pack order."""
+
+        summaries = self._summaries
+        return [card_id for card_id, row in self._rows.items() if summaries[row] != _NO_STRING]
+
+    def summary_json(self, card_id: str) -> bytes | None:
+        row = self._rows.get(card_id)
+        if row is None or self._summaries[row] == _NO_STRING:
+            return None
+        string_id = self._summaries[row]
+        return bytes(self._string_data[self._string_offsets[string_id] : self._string_offsets[string_id + 1]])
+
+    def lexical_tables(self) -> LexicalTables:
+        """The ``LexicalIndex`` compiled into the pack; posting arrays are views of the mapping."""
+
+        sections = self._sections
+        string = self._string
+        df_starts, df_counts = sections["lexical_df_starts"], sections["lexical_df_counts"]
+        df_grams = sections["lexical_df_grams"]
+        document_frequencies = tuple(
+            {string(df_grams[index]): df_counts[index] for index in range(df_starts[field], df_starts[field + 1])}
+            for field in range(2)
+        )
+        rows = np.frombuffer(sections["lexical_rows"], dtype="<i4")
+        weights = np.frombuffer(sections["lexical_weights"], dtype="<f4")
+        starts = sections["lexical_posting_starts"]
+        postings = {
+            string(gram): (rows[starts[index] : starts[index + 1]], weights[starts[index] : starts[index + 1]])
+            for index, gram in enumerate(sections["lexical_grams"])
+        }
+        return LexicalTables(
+            card_ids=list(self._rows),
+            names=[string(string_id) for string_id in sections["lexical_names"]],
+            effect_texts=[string(string_id) for string_id in sections["lexical_effect_texts"]],
+            document_frequencies=document_frequencies,  # type: ignore[arg-type]
+            total_lengths=tuple(sections["lexical_total_lengths"]),  # type: ignore[arg-type]
+            postings=postings,
+        )
+
+
+class PackProjection(Mapping[str, dict]):
+    """``card_id -> card dict`` with only some fields of each packed card decoded (see ``CardPack.project``)."""
+
+    def __init__(self, pack: CardPack, key_ids: FrozenSet[int]) -> None:
+        self._pack = pack
+        self._key_ids = key_ids
+
+    def __getitem__(self, card_id: str) -> dict:
+        return self._pack._decode(self._pack._rows[card_id], self._key_ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._pack)
+
+    def __len__(self) -> int:
+        return len(self._pack)
+
+
+class PackSummaryJson(Mapping[str, bytes]):
+    """``card_id -> CardSummary JSON`` read straight from the pack."""
+
+    def __init__(self, pack: CardPack) -> None:
+        self._pack = pack
+        self._card_ids = pack.summarized_ids()
+
+    def __getitem__(self, card_id: str) -> bytes:
+        encoded = self._pack.summary_json(card_id)
+        if encoded is None:
+            raise KeyError(card_id)
+        return encoded
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._card_ids)
+
+    def __len__(self) -> int:
+        return len(self._card_ids)
+
+
+class PackSummaries(Mapping[str, CardSummary]):
+    """``card_id -> CardSummary`` validated from the pack's JSON on first use and then kept."""
+
+    def __init__(self, summary_json: PackSummaryJson) -> None:
+        self._summary_json = summary_json
+        self._validated: Dict[str, CardSummary] = {}
+
+    def __getitem__(self, card_id: str) -> CardSummary:
+        summary = self._validated.get(card_id)
+        if summary is None:
+            summary = self._validated[card_id] = CardSummary.model_validate_json(self._summary_json[card_id])
+        return summary
+
+    def get(self, card_id: str, default: CardSummary | None = None) -> CardSummary | None:  # type: ignore[override]
+        summary = self._validated.get(card_id)
+        if summary is not None:
+            return summary
+        return self[card_id] if card_id in self._summary_json else default
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._summary_json)
+
+    def __len__(self) -> int:
+        return len(self._summary_json)
+
+
+def main() -> None:
+    base_dir = Path(__file__).resolve().parent.parent.parent
+    parser = argparse.ArgumentParser(description="Card pack tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="Compile data.json into a memory-mappable card pack")
+    build.add_argument("--data", default=str(base_dir / "data" / "data.json"))
+    build.add_argument("--out", default=str(base_dir / "data" / "cards.pack"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.data, "r", encoding="utf-8") as f:
+        cards = json.load(f)
+    stats = compile_cards(cards, args.out)
+    print(" ".join(f"{key}={value}" for key, value in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""Structured card-attribute queries answered from an in-memory columnar index.
+
+Questions such as ``コスト2のフォロワー`` or ``エルフの疾走カード`` are filters over the
+master data rather than semantic searches. ``CardAttributeIndex.parse`` recognises
+those filters and ``CardAttributeIndex.filter`` evaluates them with vectorized
+comparisons and keyword bitmaps, so the embedding call can be skipped entirely.
+"""
+
+from __future__ import annotations
+
+import copy
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+_MISSING = -1
+_NUMERIC_COLUMNS = ("cost", "attack", "hp")
+# The master-data fields a CardAttributeIndex reads.
+INDEXED_FIELDS = (*_NUMERIC_COLUMNS, "class", "rarity", "keywords")
+
+_NUMERIC_FIELDS = {
+    "コスト": "cost",
+    "攻撃力": "attack",
+    "攻撃": "attack",
+    "アタック": "attack",
+    "体力": "hp",
+    "ヒットポイント": "hp",
+    "hp": "hp",
+    "cost": "cost",
+    "attack": "attack",
+}
+_NUMERIC_FIELD_ALTERNATION = "|".join(sorted(map(re.escape, _NUMERIC_FIELDS), key=len, reverse=True))
+_SYMBOL_OPERATORS = {">=": ">=", "≥": ">=", "<=": "<=", "≤": "<=", ">": ">", "<": "<", "=": "=="}
+_WORD_OPERATORS = {
+    "以上": ">=",
+    "以下": "<=",
+    "未満": "<",
+    "より大きい": ">",
+    "より上": ">",
+    "超": ">",
+    "より小さい": "<",
+    "より下": "<",
+}
+# e.g. "コスト2", "攻撃力が3以上", "HP>=4"
+_FIELD_FIRST_PATTERN = re.compile(
+    rf"(?P<field>{_NUMERIC_FIELD_ALTERNATION})\s*(?:が|は|:)?\s*"
+    rf"(?P<symbol>>=|<=|≥|≤|>|<|=)?\s*(?P<value>\d+)\s*"
+    rf"(?P<word>{'|'.join(map(re.escape, _WORD_OPERATORS))})?",
+    re.IGNORECASE,
+)
+# e.g. "2コスト"
+_VALUE_FIRST_PATTERN = re.compile(
+    rf"(?P<value>\d+)\s*(?P<field>コスト)\s*(?P<word>{'|'.join(map(re.escape, _WORD_OPERATORS))})?"
+)
+_FOLLOWER_PATTERN = re.compile("フォロワー")
+_FILLER_WORDS = (
+    "教えてください",
+    "教えて",
+    "探してください",
+    "探して",
+    "見せてください",
+    "見せて",
+    "知りたい",
+    "一覧",
+    "全部",
+    "すべて",
+    "全て",
+    "カード",
+    "クラス",
+    "レアリティ",
+    "キーワード",
+    "能力",
+    "を持つ",
+    "持ち",
+    "持つ",
+    "もの",
+    "ある",
+    "いる",
+    "どれ",
+    "何",
+    "は",
+    "の",
+    "を",
+    "が",
+    "で",
+    "と",
+    "や",
+    "か",
+)
+_FILLER_PATTERN = re.compile("|".join(map(re.escape, _FILLER_WORDS)))
+_RESIDUAL_STRIP_PATTERN = re.compile(r"[\s\W_]+")
+
+
+def _as_int(value: object) -> int:
+    try:
+        return int(value)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return _MISSING
+
+
+@dataclass(frozen=True)
+class StructuredQuery:
+    numeric: Tuple[Tuple[str, str, int], ...] = ()
+    classes: Tuple[str, ...] = ()
+    rarities: Tuple[str, ...] = ()
+    keywords: Tuple[str, ...] = ()
+    followers_only: bool = False
+    residual: str = ""
+
+    @property
+    def has_filters(self) -> bool:
+        return bool(self.numeric or self.classes or self.rarities or self.keywords or self.followers_only)
+
+    @property
+    def fully_structured(self) -> bool:
+        """True when every meaningful part of the question was turned into a filter."""
+
+        return self.has_filters and not self.residual
+
+    def describe(self) -> List[str]:
+        parts = [f"{field}{op}{value}" for field, op, value in self.numeric]
+        parts += [f"class={value}" for value in self.classes]
+        parts += [f"rarity={value}" for value in self.rarities]
+        parts += [f"keyword={value}" for value in self.keywords]
+        if self.followers_only:
+            parts.append("type=follower")
+        return parts
+
+
+class CardAttributeIndex:
+    """Column arrays over the master data: one row per card, in master-data order.
+
+    ``with_changes`` returns an updated copy: changed cards are rewritten in place
+    in the copied columns, new cards are appended and removed cards are masked out
+    through ``live``.
+    """
+
+    def __init__(self, cards: Mapping[str, dict]) -> None:
+        self.card_ids: List[str] = list(cards)
+        self._rows: Dict[str, int] = {card_id: row for row, card_id in enumerate(self.card_ids)}
+        self.live = np.ones(len(self.card_ids), dtype=bool)
+        masters = [cards[card_id] for card_id in self.card_ids]
+
+        self.columns: Dict[str, np.ndarray] = {
+            field: np.fromiter((_as_int(master.get(field)) for master in masters), dtype=np.int32, count=len(masters))
+            for field in _NUMERIC_COLUMNS
+        }
+        self.class_vocab, self.class_codes = self._encode([master.get("class") for master in masters])
+        self.rarity_vocab, self.rarity_codes = self._encode([master.get("rarity") for master in masters])
+
+        self.keyword_bitmaps: Dict[str, np.ndarray] = {}
+        for row, master in enumerate(masters):
+            for keyword in master.get("keywords") or []:
+                if not isinstance(keyword, str) or not keyword:
+                    continue
+                bitmap = self.keyword_bitmaps.get(keyword)
+                if bitmap is None:
+                    bitmap = self.keyword_bitmaps[keyword] = np.zeros(len(masters), dtype=bool)
+                bitmap[row] = True
+
+        self._build_patterns()
+
+    def _build_patterns(self) -> None:
+        self._class_pattern = self._vocabulary_pattern(self.class_vocab)
+        self._rarity_pattern = self._vocabulary_pattern(self.rarity_vocab)
+        self._keyword_pattern = self._vocabulary_pattern(self.keyword_bitmaps)
+
+    def __len__(self) -> int:
+        return int(self.live.sum())
+
+    @property
+    def dead_rows(self) -> int:
+        return len(self.card_ids) - len(self)
+
+    def with_changes(
+        self, cards: Mapping[str, dict], changed: Iterable[str], removed: Iterable[str]
+    ) -> "CardAttributeIndex":
+        """Copy of this index with ``changed`` cards re-read from ``cards`` and ``removed`` cards masked out.
+
+        Every array is copied, so filters running against ``self`` are unaffected.
+        """
+
+        changed = list(changed)
+        index = copy.copy(self)
+        index.card_ids = list(self.card_ids)
+        index._rows = dict(self._rows)
+        for card_id in changed:
+            if card_id not in index._rows:
+                index._rows[card_id] = len(index.card_ids)
+                index.card_ids.append(card_id)
+        grow = len(index.card_ids) - len(self.card_ids)
+
+        def _extend(array: np.ndarray, fill: object) -> np.ndarray:
+            return np.concatenate([array, np.full(grow, fill, dtype=array.dtype)])
+
+        index.columns = {field: _extend(column, _MISSING) for field, column in self.columns.items()}
+        index.class_vocab = dict(self.class_vocab)
+        index.class_codes = _extend(self.class_codes, _MISSING)
+        index.rarity_vocab = dict(self.rarity_vocab)
+        index.rarity_codes = _extend(self.rarity_codes, _MISSING)
+        index.keyword_bitmaps = {keyword: _extend(bitmap, False) for keyword, bitmap in self.keyword_bitmaps.items()}
+        index.live = _extend(self.live, False)
+
+        for card_id in removed:
+            row = index._rows.get(card_id)
+            if row is not None:
+                index.live[row] = False
+        for card_id in changed:
+            index._write_row(index._rows[card_id], cards[card_id])
+        index._build_patterns()
+        return index
+
+    def _write_row(self, row: int, master: dict) -> None:
+        for field, column in self.columns.items():
+            column[row] = _as_int(master.get(field))
+        for vocab, codes, value in (
+            (self.class_vocab, self.class_codes, master.get("class")),
+            (self.rarity_vocab, self.rarity_codes, master.get("rarity")),
+        ):
+            present = isinstance(value, str) and value and value != "-"
+            codes[row] = vocab.setdefault(value, len(vocab)) if present else _MISSING
+        for bitmap in self.keyword_bitmaps.values():
+            bitmap[row] = False
+        for keyword in master.get("keywords") or []:
+            if not isinstance(keyword, str) or not keyword:
+                continue
+            bitmap = self.keyword_bitmaps.get(keyword)
+            if bitmap is None:
+                bitmap = self.keyword_bitmaps[keyword] = np.zeros(len(self.card_ids), dtype=bool)
+            bitmap[row] = True
+        self.live[row] = True
+
+    @staticmethod
+    def _encode(values: Sequence[object]) -> Tuple[Dict[str, int], np.ndarray]:
+        vocab: Dict[str, int] = {}
+        codes = np.full(len(values), _MISSING, dtype=np.int16)
+        for row, value in enumerate(values):
+            if isinstance(value, str) and value and value != "-":
+                codes[row] = vocab.setdefault(value, len(vocab))
+        return vocab, codes
+
+    @staticmethod
+    def _vocabulary_pattern(vocabulary: Mapping[str, object]) -> Tuple[re.Pattern[str], Dict[str, str]] | None:
+        # Queries are matched after NFKC normalization, so map normalized terms back to master values.
+        lookup = {unicodedata.normalize("NFKC", term): term for term in vocabulary}
+        if not lookup:
+            return None
+        pattern = re.compile("|".join(map(re.escape, sorted(lookup, key=len, reverse=True))))
+        return pattern, lookup
+
+    def parse(self, text: str) -> StructuredQuery:
+        normalized = unicodedata.normalize("NFKC", text)
+        remaining = normalized
+        numeric: List[Tuple[str, str, int]] = []
+
+        def _take_numeric(match: re.Match[str]) -> str:
+            field = _NUMERIC_FIELDS[match.group("field").lower()]
+            symbol = match.groupdict().get("symbol")
+            word = match.group("word")
+            op = _SYMBOL_OPERATORS.get(symbol or "") or _WORD_OPERATORS.get(word or "") or "=="
+            numeric.append((field, op, int(match.group("value"))))
+            return " "
+
+        remaining = _FIELD_FIRST_PATTERN.sub(_take_numeric, remaining)
+        remaining = _VALUE_FIRST_PATTERN.sub(_take_numeric, remaining)
+
+        def _take_terms(vocabulary: Tuple[re.Pattern[str], Dict[str, str]] | None, found: List[str]) -> None:
+            nonlocal remaining
+            if vocabulary is None:
+                return
+            pattern, lookup = vocabulary
+
+            def _collect(match: re.Match[str]) -> str:
+                term = lookup[match.group(0)]
+                if term not in found:
+                    found.append(term)
+                return " "
+
+            remaining = pattern.sub(_collect, remaining)
+
+        classes: List[str] = []
+        rarities: List[str] = []
+        keywords: List[str] = []
+        _take_terms(self._class_pattern, classes)
+        _take_terms(self._rarity_pattern, rarities)
+        _take_terms(self._keyword_pattern, keywords)
+
+        followers_only = bool(_FOLLOWER_PATTERN.search(remaining))
+        remaining = _FOLLOWER_PATTERN.sub(" ", remaining)
+
+        residual = _RESIDUAL_STRIP_PATTERN.sub("", _FILLER_PATTERN.sub(" ", remaining))
+        return StructuredQuery(
+            numeric=tuple(numeric),
+            classes=tuple(classes),
+            rarities=tuple(rarities),
+            keywords=tuple(keywords),
+            followers_only=followers_only,
+            residual=residual,
+        )
+
+    def filter(self, query: StructuredQuery) -> List[str]:
+        """Return matching card ids ordered by cost, then master-data order."""
+
+        mask = self.live.copy()
+        for field, op, value in query.numeric:
+            column = self.columns[field]
+            present = column != _MISSING
+            if op == ">=":
+                mask &= present & (column >= value)
+            elif op == "<=":
+                mask &= present & (column <= value)
+            elif op == ">":
+                mask &= present & (column > value)
+            elif op == "<":
+                mask &= present & (column < value)
+            else:
+                mask &= column == value
+
+        if query.classes:
+            codes = [self.class_vocab[value] for value in query.classes if value in self.class_vocab]
+            mask &= np.isin(self.class_codes, codes)
+        if query.rarities:
+            codes = [self.rarity_vocab[value] for value in query.rarities if value in self.rarity_vocab]
+            mask &= np.isin(self.rarity_codes, codes)
+        for keyword in query.keywords:
+            bitmap = self.keyword_bitmaps.get(keyword)
+            if bitmap is None:
+                return []
+            mask &= bitmap
+        if query.followers_only:
+            mask &= self.columns["hp"] > 0
+
+        rows = np.flatnonzero(mask)
+        costs = self.columns["cost"][rows]
+        sort_keys = np.where(costs == _MISSING, np.iinfo(np.int32).max, costs)
+        rows = rows[np.argsort(sort_keys, kind="stable")]
+        return [self.card_ids[row] for row in rows]
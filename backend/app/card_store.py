@@ -0,0 +1,278 @@
+"""Card master data snapshots with hot reload.
+
+Everything derived from ``data/data.json`` (the raw cards, pre-validated
+summaries and their JSON, the attribute and lexical indexes) lives in one
+immutable ``CardSnapshot``. ``CardStore.reload`` parses the file in a worker
+thread, diffs it against the current snapshot, rebuilds summaries and index rows
+for the changed cards only and then swaps ``CardStore.snapshot`` in a single
+assignment. A request reads ``store.snapshot`` once and uses that object
+throughout, so a reload never mixes old and new card data within one answer.
+
+The data file may also be a compiled card pack (see ``app.card_pack``): cards
+are then decoded from the memory-mapped file on access, summaries and the
+lexical index come precompiled, the attribute index decodes only the fields it
+reads and reload diffs compare stored digests.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Mapping, Tuple
+
+from pydantic import ValidationError
+
+from .card_pack import CardPack, PackSummaries, PackSummaryJson, card_digest, is_card_pack
+from .card_query import INDEXED_FIELDS, CardAttributeIndex
+from .cards import build_card_summary, serialize_card_summary
+from .lexical_index import LexicalIndex
+from .metrics import CARD_DATA_RELOADS, CARD_DATA_VERSION
+from .models import CardSummary
+
+logger = logging.getLogger(__name__)
+
+# Assuming backend/app/card_store.py is the location, data is in ../../data/data.json
+DEFAULT_CARD_DATA_PATH = Path(__file__).resolve().parent.parent.parent / "data" / "data.json"
+
+SourceSignature = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class CardDiff:
+    added: Tuple[str, ...] = ()
+    changed: Tuple[str, ...] = ()
+    removed: Tuple[str, ...] = ()
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    @property
+    def upserted(self) -> Tuple[str, ...]:
+        return self.added + self.changed
+
+    def describe(self) -> Dict[str, int]:
+        return {"added": len(self.added), "changed": len(self.changed), "removed": len(self.removed)}
+
+
+@dataclass(frozen=True)
+class CardSnapshot:
+    version: int = 0
+    cards: Mapping[str, dict] = field(default_factory=dict)
+    summaries: Mapping[str, CardSummary] = field(default_factory=dict)
+    summary_json: Mapping[str, bytes] = field(default_factory=dict)
+    attribute_index: CardAttributeIndex | None = None
+    lexical_index: LexicalIndex | None = None
+    source: SourceSignature | None = None
+    loaded_at: float = 0.0
+
+    def get_card_master(self, card_id: str) -> dict | None:
+        return self.cards.get(str(card_id))
+
+    def get_card_summary(self, card_id: str) -> CardSummary | None:
+        return self.summaries.get(str(card_id))
+
+
+def read_card_file(path: Path, *, pack_cache_size: int = 1024) -> Mapping[str, dict]:
+    """Cards from ``data.json``, or a lazy view when ``path`` is a compiled card pack."""
+
+    if is_card_pack(path):
+        return CardPack(path, cache_size=pack_cache_size)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError(f"{path} must contain a JSON array of cards")
+    return {str(item["id"]): item for item in data if isinstance(item, dict) and "id" in item}
+
+
+def _digest(cards: Mapping[str, dict], card_id: str) -> int:
+    return cards.digest(card_id) if isinstance(cards, CardPack) else card_digest(cards[card_id])
+
+
+def diff_cards(old: Mapping[str, dict], new: Mapping[str, dict]) -> CardDiff:
+    common = [card_id for card_id in new if card_id in old]
+    if isinstance(old, CardPack) and old.stale:
+        # The old mapping can no longer be read safely; treat every card as changed.
+        changed = tuple(common)
+    elif isinstance(old, CardPack) or isinstance(new, CardPack):
+        # Compare content digests (stored in packs) instead of decoding every packed card.
+        changed = tuple(card_id for card_id in common if _digest(old, card_id) != _digest(new, card_id))
+    else:
+        changed = tuple(card_id for card_id in common if old[card_id] != new[card_id])
+    return CardDiff(
+        added=tuple(card_id for card_id in new if card_id not in old),
+        changed=changed,
+        removed=tuple(card_id for card_id in old if card_id not in new),
+    )
+
+
+class CardStore:
+    """Holds the current ``CardSnapshot`` and replaces it when the data file changes.
+
+    Diffs touching more than ``rebuild_ratio`` of the cards (or indexes carrying
+    that share of removed rows) rebuild everything instead of patching.
+    """
+
+    def __init__(
+        self,
+        path: Path | str = DEFAULT_CARD_DATA_PATH,
+        *,
+        attribute_index: bool = True,
+        lexical_index: bool = True,
+        lexical_min_coverage: float = 0.6,
+        rebuild_ratio: float = 0.2,
+        pack_cache_size: int = 1024,
+    ) -> None:
+        self.path = Path(path)
+        self.attribute_index_enabled = attribute_index
+        self.lexical_index_enabled = lexical_index
+        self.lexical_min_coverage = lexical_min_coverage
+        self.rebuild_ratio = rebuild_ratio
+        self.pack_cache_size = pack_cache_size
+        self.snapshot = CardSnapshot()
+        self.last_reload: Dict[str, Any] | None = None
+        self._reload_lock = asyncio.Lock()
+        self._failed_source: SourceSignature | None = None
+
+    def _source_signature(self) -> SourceSignature | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> CardSnapshot:
+        """Initial, blocking load; a missing or broken file leaves the store empty."""
+
+        if not self.path.exists():
+            logger.warning(f"Card master data not found at {self.path}")
+            return self.snapshot
+        try:
+            self.snapshot, _ = self._next_snapshot(self.snapshot)
+        except Exception as e:
+            logger.error(f"Failed to load card master data: {e}")
+            return self.snapshot
+        logger.info(f"Loaded {len(self.snapshot.cards)} cards from master data.")
+        CARD_DATA_VERSION.set(self.snapshot.version)
+        return self.snapshot
+
+    async def reload(self) -> Dict[str, Any]:
+        """Re-read the data file off the event loop and swap in the new snapshot if anything changed."""
+
+        async with self._reload_lock:
+            current = self.snapshot
+            started = time.perf_counter()
+            try:
+                snapshot, diff = await asyncio.to_thread(self._next_snapshot, current)
+            except Exception:
+                self._failed_source = self._source_signature()
+                CARD_DATA_RELOADS.inc(result="failed")
+                raise
+            self._failed_source = None
+            self.snapshot = snapshot
+            result = "applied" if diff else "unchanged"
+            CARD_DATA_RELOADS.inc(result=result)
+            CARD_DATA_VERSION.set(snapshot.version)
+            self.last_reload = {
+                "result": result,
+                "version": snapshot.version,
+                "card_count": len(snapshot.cards),
+                **diff.describe(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            logger.info("Card data reload %s", self.last_reload)
+            return self.last_reload
+
+    async def wait_for_change(self, interval: float) -> None:
+        """Poll the data file's mtime and size every ``interval`` seconds until it differs from the snapshot.
+
+        A file that already failed to load is not reported again until it changes.
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            source = self._source_signature()
+            if source is not None and source != self.snapshot.source and source != self._failed_source:
+                return
+
+    def _next_snapshot(self, current: CardSnapshot) -> Tuple[CardSnapshot, CardDiff]:
+        source = self._source_signature()
+        cards = read_card_file(self.path, pack_cache_size=self.pack_cache_size)
+        diff = diff_cards(current.cards, cards)
+        if not diff:
+            return dataclasses.replace(current, source=source), diff
+
+        full = not current.cards or len(diff) > self.rebuild_ratio * max(len(cards), 1)
+        summaries, summary_json = self._summaries(cards, current, diff, full)
+        return (
+            CardSnapshot(
+                version=current.version + 1,
+                cards=cards,
+                summaries=summaries,
+                summary_json=summary_json,
+                attribute_index=self._attribute_index(cards, current.attribute_index, diff, full),
+                lexical_index=self._lexical_index(cards, current.lexical_index, diff, full),
+                source=source,
+                loaded_at=time.time(),
+            ),
+            diff,
+        )
+
+    @staticmethod
+    def _summaries(
+        cards: Mapping[str, dict], current: CardSnapshot, diff: CardDiff, full: bool
+    ) -> Tuple[Mapping[str, CardSummary], Mapping[str, bytes]]:
+        if isinstance(cards, CardPack):
+            # Summaries were serialized when the pack was compiled.
+            pack_json = PackSummaryJson(cards)
+            return PackSummaries(pack_json), pack_json
+
+        if full or not isinstance(current.summaries, dict):
+            summaries: Dict[str, CardSummary] = {}
+            summary_json: Dict[str, bytes] = {}
+            targets: Tuple[str, ...] = tuple(cards)
+        else:
+            summaries = dict(current.summaries)
+            summary_json = dict(current.summary_json)
+            for card_id in diff.removed + diff.changed:
+                summaries.pop(card_id, None)
+                summary_json.pop(card_id, None)
+            targets = diff.upserted
+
+        for card_id in targets:
+            try:
+                summary = build_card_summary(card_id, cards[card_id])
+            except ValidationError as e:
+                logger.warning(f"Skipping card summary for {card_id}: {e}")
+                continue
+            summaries[card_id] = summary
+            summary_json[card_id] = serialize_card_summary(summary)
+        return summaries, summary_json
+
+    def _attribute_index(
+        self, cards: Mapping[str, dict], previous: CardAttributeIndex | None, diff: CardDiff, full: bool
+    ) -> CardAttributeIndex | None:
+        if not self.attribute_index_enabled or not cards:
+            return None
+        if isinstance(cards, CardPack):
+            cards = cards.project(INDEXED_FIELDS)
+        if full or previous is None or previous.dead_rows + len(diff.removed) > self.rebuild_ratio * len(cards):
+            return CardAttributeIndex(cards)
+        return previous.with_changes(cards, diff.upserted, diff.removed)
+
+    def _lexical_index(
+        self, cards: Mapping[str, dict], previous: LexicalIndex | None, diff: CardDiff, full: bool
+    ) -> LexicalIndex | None:
+        if not self.lexical_index_enabled or not cards:
+            return None
+        if isinstance(cards, CardPack):
+            # Scored when the pack was compiled; restoring it is exact and cheaper than patching.
+            return LexicalIndex.from_tables(cards.lexical_tables(), min_coverage=self.lexical_min_coverage)
+        if full or previous is None or previous.dead_rows + len(diff.removed) > self.rebuild_ratio * len(cards):
+            return LexicalIndex(cards, min_coverage=self.lexical_min_coverage)
+        return previous.with_changes(cards, diff.upserted, diff.removed)
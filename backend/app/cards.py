@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Iterator, List, Tuple
+
+from .models import CardSummary
+
+
+def sorted_effects(card: dict) -> List[Tuple[int, str]]:
+    """Return the card's non-empty ``effect_N`` fields as ``(N, text)`` pairs ordered by N."""
+
+    effects: List[Tuple[int, str]] = []
+    for key, value in card.items():
+        if key.startswith("effect_") and value:
+            try:
+                effects.append((int(key.split("_")[1]), value))
+            except ValueError:
+                pass
+    effects.sort(key=lambda item: item[0])
+    return effects
+
+
+def card_documents(card: dict) -> Iterator[Tuple[str | None, dict]]:
+    """Split one master-data card into the default document and one document per ``effect_N``."""
+
+    card_id = str(card["id"])
+    name = card.get("name") or card_id
+    effects = sorted_effects(card)
+    header = (
+        f"{name}（{card.get('class', '-')} / {card.get('rarity', '-')} / "
+        f"コスト{card.get('cost', 0)} {card.get('attack', 0)}/{card.get('hp', 0)}）"
+    )
+    keywords = card.get("keywords") or []
+    lines = [header]
+    if keywords:
+        lines.append("キーワード: " + "、".join(keywords))
+    lines.extend(text for _, text in effects)
+    yield None, {"id": card_id, "text": "\n".join(lines), "title": name, "card_id": card_id}
+
+    for index, text in effects:
+        yield f"effect_{index}", {"id": f"{card_id}:effect_{index}", "text": text, "title": name, "card_id": card_id}
+
+
+def build_card_summary(card_id: str, master: dict) -> CardSummary:
+    return CardSummary(
+        card_id=str(card_id),
+        name=master.get("name", "Unknown"),
+        class_=master.get("class", "-"),
+        rarity=master.get("rarity", "-"),
+        cost=master.get("cost", 0),
+        attack=master.get("attack", 0),
+        hp=master.get("hp", 0),
+        effect=master.get("effect_1") or "",
+        effects=[text for _, text in sorted_effects(master)],
+        keywords=master.get("keywords", []),
+        image_before=master.get("image_before", ""),
+        image_after=master.get("image_after", ""),
+    )
+
+
+def serialize_card_summary(summary: CardSummary) -> bytes:
+    return summary.model_dump_json(by_alias=True).encode("utf-8")
@@ -0,0 +1,272 @@
+"""Conversation sessions: what the previous chat turn retrieved, kept for the next one.
+
+A session holds the recent messages and the previous turn's retrieval (docs,
+card ids and the query embedding). ``detect_follow_up`` recognises short
+questions that only make sense against that retrieval: "その効果は？" is
+answered from the previous docs again (``reuse``) and "他には？" re-runs the
+previous vector search for cards not shown yet (``extend``), so neither needs
+the follow-up text embedded and searched on its own.
+
+Sessions are kept in an in-process LRU with a TTL. When a ``SharedCache`` is
+given they are stored there instead, so whichever worker receives the next
+turn of a conversation sees the same session.
+
+Session ids are issued by the server: a random token followed by its HMAC
+under the store's secret. ``ConversationStore.issued`` rejects any other id, so
+a client cannot pick or guess its way into someone else's conversation.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import re
+import secrets
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .models import ChatMessage
+from .shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+_SESSION_TOKEN_BYTES = 18
+_SESSION_MAC_BYTES = 18
+# Both halves are unpadded URL-safe base64, 4 characters per 3 bytes.
+SESSION_ID_LENGTH = (_SESSION_TOKEN_BYTES + _SESSION_MAC_BYTES) * 4 // 3
+
+FOLLOW_UP_REUSE = "reuse"
+FOLLOW_UP_EXTEND = "extend"
+
+_REFERENCE = r"(その|それ|この|これ|あの|あれ|さっきの|前の|上の)"
+_ATTRIBUTE = r"(効果|能力|コスト|攻撃力|体力|hp|レアリティ|クラス|進化後|キーワード|使い方|強さ|評価|弱点|相性)"
+# Questions about "that" card ("その効果は？") or just an attribute of it ("コストは？").
+_REUSE_PATTERN = re.compile(rf"^{_REFERENCE}|^{_ATTRIBUTE}(は|って|を|について|も)")
+# Everything a reuse question may consist of; anything else ("このゲームの最強カードは？") is a new topic.
+_REUSE_WORDS = re.compile(
+    rf"{_REFERENCE}|{_ATTRIBUTE}"
+    r"|(について|ですか|です|なに|何|どう|どんな|いくつ|カード|教えて|ください|は|の|を|が|って|も|か)"
+)
+# Requests for more results than the previous answer showed.
+_EXTEND_PATTERN = re.compile(r"(他に|他の|他は|ほかに|ほかの|ほかは|別の|もっと|さらに|まだ|以外)")
+_FOLLOW_UP_FILLERS = re.compile(
+    r"(カード|それ|ある|あります|ありますか|いる|います|教えて|ください|ないの|ない|は|の|を|が|で|って|か|ね|よ)"
+)
+# Content left over after markers and fillers are removed; more than this means a new question.
+_EXTEND_MAX_RESIDUAL = 2
+_REUSE_MAX_RESIDUAL = 2
+_STRIP_PATTERN = re.compile(r"[\s\W_]+")
+
+
+def _normalize(text: str) -> str:
+    return _STRIP_PATTERN.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+@dataclass
+class ConversationTurn:
+    """Retrieval of the last turn; ``query`` is the topic a chain of follow-ups started from."""
+
+    query: str
+    namespace: str | None = None
+    docs: List[dict] = field(default_factory=list)
+    embedding: List[float] | None = None
+    # Every card shown since the last full search, so repeated "他には？" keeps moving on.
+    shown_card_ids: List[str] = field(default_factory=list)
+
+    @property
+    def card_ids(self) -> List[str]:
+        return list(dict.fromkeys(doc["card_id"] for doc in self.docs if doc.get("card_id")))
+
+
+@dataclass
+class ConversationSession:
+    session_id: str
+    messages: List[ChatMessage] = field(default_factory=list)
+    last_turn: ConversationTurn | None = None
+
+    def record(self, query: str, answer: str, turn: ConversationTurn, max_messages: int) -> None:
+        messages = [*self.messages, ChatMessage(role="user", content=query), ChatMessage(role="assistant", content=answer)]
+        self.messages = messages[-max_messages:] if max_messages > 0 else []
+        self.last_turn = turn
+
+    def to_json(self) -> bytes:
+        turn = self.last_turn
+        payload: Dict[str, Any] = {
+            "messages": [message.model_dump() for message in self.messages],
+            "last_turn": None,
+        }
+        if turn is not None:
+            payload["last_turn"] = {
+                "query": turn.query,
+                "namespace": turn.namespace,
+                "docs": turn.docs,
+                # float32 bytes are a quarter of the size of a JSON float list.
+                "embedding": (
+                    base64.b64encode(np.asarray(turn.embedding, dtype=np.float32).tobytes()).decode("ascii")
+                    if turn.embedding is not None
+                    else None
+                ),
+                "shown_card_ids": turn.shown_card_ids,
+            }
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, session_id: str, raw: bytes) -> "ConversationSession":
+        payload = json.loads(raw)
+        turn = payload.get("last_turn")
+        return cls(
+            session_id=session_id,
+            messages=[ChatMessage.model_validate(message) for message in payload.get("messages", [])],
+            last_turn=(
+                ConversationTurn(
+                    query=turn["query"],
+                    namespace=turn.get("namespace"),
+                    docs=turn.get("docs") or [],
+                    embedding=(
+                        np.frombuffer(base64.b64decode(turn["embedding"]), dtype=np.float32).tolist()
+                        if turn.get("embedding")
+                        else None
+                    ),
+                    shown_card_ids=turn.get("shown_card_ids") or [],
+                )
+                if turn
+                else None
+            ),
+        )
+
+
+def detect_follow_up(query: str, previous: ConversationTurn | None, max_chars: int) -> str | None:
+    """``reuse``, ``extend`` or None (a new question) for ``query`` following ``previous``.
+
+    >>> turn = ConversationTurn(query="コスト2のフォロワー", docs=[{"card_id": "1", "text": "..."}])
+    >>> [detect_follow_up(q, turn, 20) for q in ("その効果は？", "このカードの強さは？", "これは？", "コストは？")]
+    ['reuse', 'reuse', 'reuse', 'reuse']
+    >>> [detect_follow_up(q, turn, 20) for q in ("他には？", "もっと教えて")]
+    ['extend', 'extend']
+    >>> [detect_follow_up(q, turn, 20) for q in ("このゲームの最強カードは？", "このデッキに合うフォロワーは", "コストは2以下のカード")]
+    [None, None, None]
+    """
+
+    if previous is None:
+        return None
+    text = _normalize(query)
+    if not text or len(text) > max_chars:
+        return None
+    if _EXTEND_PATTERN.search(text):
+        residual = _FOLLOW_UP_FILLERS.sub("", _EXTEND_PATTERN.sub("", text))
+        if len(residual) <= _EXTEND_MAX_RESIDUAL:
+            return FOLLOW_UP_EXTEND
+        return None
+    if previous.docs and _REUSE_PATTERN.search(text):
+        if len(_REUSE_WORDS.sub("", text)) <= _REUSE_MAX_RESIDUAL:
+            return FOLLOW_UP_REUSE
+    return None
+
+
+class ConversationStore:
+    namespace = "session"
+
+    def __init__(
+        self,
+        *,
+        max_sessions: int,
+        ttl_seconds: float,
+        max_messages: int,
+        shared: SharedCache | None = None,
+        secret: bytes = b"",
+    ) -> None:
+        if not secret:
+            # Ids then only verify in this process; workers sharing sessions need one configured secret.
+            logger.warning("No conversation session secret configured; session ids are valid in this process only")
+            secret = secrets.token_bytes(32)
+        self._secret = secret
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max(0, max_messages)
+        self.shared = shared
+        self._sessions: "OrderedDict[str, Tuple[float, ConversationSession]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _mac(self, token: str) -> str:
+        digest = hmac.new(self._secret, token.encode("ascii"), hashlib.sha256).digest()[:_SESSION_MAC_BYTES]
+        return base64.urlsafe_b64encode(digest).decode("ascii")
+
+    def new_session(self) -> ConversationSession:
+        token = base64.urlsafe_b64encode(secrets.token_bytes(_SESSION_TOKEN_BYTES)).decode("ascii")
+        return ConversationSession(session_id=token + self._mac(token))
+
+    def issued(self, session_id: str) -> bool:
+        """Whether ``session_id`` came from ``new_session`` of a store with the same secret."""
+
+        if len(session_id) != SESSION_ID_LENGTH or not session_id.isascii():
+            return False
+        split = _SESSION_TOKEN_BYTES * 4 // 3
+        return hmac.compare_digest(self._mac(session_id[:split]), session_id[split:])
+
+    async def load(self, session_id: str) -> ConversationSession:
+        """The stored session, or a new empty one for an issued id that is unknown here or expired.
+
+        Callers check ``issued`` first.
+        """
+
+        session = await self._get(session_id)
+        if session is None:
+            self.misses += 1
+            return ConversationSession(session_id=session_id)
+        self.hits += 1
+        return session
+
+    async def _get(self, session_id: str) -> ConversationSession | None:
+        if self.shared is not None:
+            raw = await self.shared.aget(self.namespace, session_id.encode("utf-8"))
+            if raw is None:
+                return None
+            try:
+                return ConversationSession.from_json(session_id, raw)
+            except (ValueError, KeyError, TypeError) as exc:
+                logger.warning("Discarding unreadable conversation session %s: %s", session_id, exc)
+                return None
+
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        expires_at, session = entry
+        if expires_at <= time.monotonic():
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def save(self, session: ConversationSession) -> None:
+        if self.shared is not None:
+            await self.shared.aput(
+                self.namespace, session.session_id.encode("utf-8"), session.to_json(), ttl_seconds=self.ttl_seconds
+            )
+            return
+
+        self._sessions.pop(session.session_id, None)
+        self._sessions[session.session_id] = (time.monotonic() + self.ttl_seconds, session)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._sessions),
+            "shared": self.shared is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from .query_analyzer import canonical_query_text
+from .shared_cache import SharedCache
+
+# Rough per-entry bookkeeping cost (key bytes, OrderedDict node, tuple) on top of the vector buffer.
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+class EmbeddingCache:
+    """In-memory LRU of query embeddings with TTL and a byte cap, backed by an optional shared tier.
+
+    ``get``/``put`` only touch this process's memory. ``aget``/``aput`` also
+    read and write the ``SharedCache`` file, so an embedding computed by one
+    worker is reused by the others.
+    """
+
+    namespace = "embedding"
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+        shared: SharedCache | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._entries: "OrderedDict[bytes, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        raw = f"{model}\x00{canonical_query_text(text)}".encode("utf-8")
+        return hashlib.sha256(raw).digest()
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        vector = self._lookup(self.make_key(model, text))
+        if vector is None:
+            self.misses += 1
+        return vector
+
+    def put(self, model: str, text: str, embedding: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._store(self.make_key(model, text), vector, time.monotonic())
+        return vector
+
+    async def aget(self, model: str, text: str) -> np.ndarray | None:
+        key = self.make_key(model, text)
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+        if self.shared is not None:
+            blob = await self.shared.aget(self.namespace, key)
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self.hits += 1
+                self.disk_hits += 1
+                self._store(key, vector, time.monotonic())
+                return vector
+        self.misses += 1
+        return None
+
+    async def aput(self, model: str, text: str, embedding: Iterable[float]) -> np.ndarray:
+        vector = self.put(model, text, embedding)
+        if self.shared is not None:
+            await self.shared.aput(
+                self.namespace, self.make_key(model, text), vector.tobytes(), ttl_seconds=self.ttl_seconds
+            )
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _lookup(self, key: bytes) -> np.ndarray | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def _store(self, key: bytes, vector: np.ndarray, now: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (now + self.ttl_seconds, vector)
+        self._bytes += vector.nbytes + _ENTRY_OVERHEAD_BYTES
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: bytes) -> None:
+        _, vector = self._entries.pop(key)
+        self._bytes -= vector.nbytes + _ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,66 @@
+"""When to start the default-namespace fallback search before the targeted one finishes.
+
+A namespaced search (``effect_N`` or the multi-effect fan-out) that comes back
+empty is retried against the default namespace. Running that retry only after
+the first search doubles latency for exactly those queries, so the fallback can
+be started speculatively alongside the targeted search. ``adaptive`` mode does
+so only for namespaces whose recent empty-result rate makes it worthwhile.
+
+The policy is keyed by the namespace's metric label (``services.namespace_label``),
+so namespaces outside ``EFFECT_NAMESPACE_LIST`` share the ``other`` entry.
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+from .metrics import NAMESPACE_EMPTY_RATE
+
+SPECULATION_MODES = ("off", "always", "adaptive")
+
+
+class SpeculativeFallbackPolicy:
+    """Per-namespace exponentially weighted empty-result rate and the speculation decision."""
+
+    def __init__(self, *, mode: str, empty_rate_threshold: float, min_samples: int, decay: float) -> None:
+        self.mode = mode if mode in SPECULATION_MODES else "off"
+        self.empty_rate_threshold = empty_rate_threshold
+        self.min_samples = max(1, min_samples)
+        self.decay = min(max(decay, 0.0), 1.0)
+        self._empty_rate: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+
+    def should_speculate(self, namespace: str) -> bool:
+        if self.mode == "always":
+            return True
+        if self.mode != "adaptive" or self._samples.get(namespace, 0) < self.min_samples:
+            return False
+        return self._empty_rate[namespace] >= self.empty_rate_threshold
+
+    def record(self, namespace: str, *, empty: bool) -> None:
+        observed = 1.0 if empty else 0.0
+        samples = self._samples.get(namespace, 0) + 1
+        previous = self._empty_rate.get(namespace)
+        # Plain average until the window fills, then exponential decay so the rate tracks recent traffic.
+        if previous is None:
+            rate = observed
+        elif samples <= self.min_samples:
+            rate = previous + (observed - previous) / samples
+        else:
+            rate = previous + (observed - previous) * self.decay
+        self._samples[namespace] = samples
+        self._empty_rate[namespace] = rate
+        NAMESPACE_EMPTY_RATE.set(rate, namespace=namespace)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "mode": self.mode,
+            "namespaces": {
+                namespace: {
+                    "empty_rate": round(rate, 4),
+                    "samples": self._samples[namespace],
+                    "speculating": self.should_speculate(namespace),
+                }
+                for namespace, rate in sorted(self._empty_rate.items())
+            },
+        }
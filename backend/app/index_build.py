@@ -0,0 +1,559 @@
+"""Offline pipeline that embeds ``data/data.json`` into the vector index the API searches.
+
+``data.json`` is streamed card by card and split by ``cards.card_documents``
+into the default document and one ``effect_N`` document per effect, with the
+``text`` / ``title`` / ``card_id`` metadata ``search_similar_docs`` reads. The
+documents go to a sink:
+
+* ``upstash``: upserted into the Upstash Vector namespaces over REST
+  (``UPSTASH_VECTOR_URL`` / ``UPSTASH_VECTOR_TOKEN``)
+* ``local``: written with ``local_index.write_namespace`` for ``RAG_RETRIEVAL_BACKEND=local``
+
+A SQLite state file keeps every embedding by model and text hash, and which
+version of each document every sink already holds. A document whose text,
+title and card id are unchanged is skipped, and one whose text is unchanged is
+not embedded again. Both tables are committed batch by batch, so an
+interrupted build resumes where it stopped. Documents of cards removed from
+``data.json`` are deleted from the sink.
+
+Embedding requests are batched and run ``--concurrency`` at a time through an
+``AdaptiveLimiter``, which backs off and retries on 429s. Progress and
+throughput are logged every ``--report-interval`` seconds.
+
+    python -m app.index_build --sink upstash
+    python -m app.index_build --sink local --out ../data/local_index
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+
+import httpx
+import numpy as np
+
+from .backpressure import AdaptiveLimiter
+from .card_pack import CardPack, is_card_pack
+from .cards import card_documents
+from .local_index import DEFAULT_NAMESPACE, write_namespace
+
+logger = logging.getLogger(__name__)
+
+_READ_CHUNK_CHARS = 1 << 16
+_WHITESPACE = " \t\n\r"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS embeddings ("
+    " model TEXT NOT NULL,"
+    " text_hash BLOB NOT NULL,"
+    " vector BLOB NOT NULL,"
+    " PRIMARY KEY (model, text_hash))",
+    "CREATE TABLE IF NOT EXISTS synced ("
+    " sink TEXT NOT NULL,"
+    " namespace TEXT NOT NULL,"
+    " doc_id TEXT NOT NULL,"
+    " digest BLOB NOT NULL,"
+    " PRIMARY KEY (sink, namespace, doc_id))",
+)
+
+
+def iter_json_array(path: str | os.PathLike[str], chunk_chars: int = _READ_CHUNK_CHARS) -> Iterator[Any]:
+    """Items of the top-level JSON array in ``path``, decoded one at a time."""
+
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_chars).lstrip(_WHITESPACE)
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        position = 1
+        eof = False
+        expect_item = True
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                char = buffer[position]
+                if char == "]":
+                    return
+                if char == "," and not expect_item:
+                    position += 1
+                    expect_item = True
+                    continue
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Most likely the item continues in the next chunk.
+                    if eof:
+                        raise
+                else:
+                    # A number can end exactly at the chunk boundary; only trust it with more input behind it.
+                    if end < len(buffer) or eof:
+                        yield item
+                        position = end
+                        expect_item = False
+                        continue
+            elif eof:
+                raise ValueError(f"{path} ends before the JSON array is closed")
+            chunk = f.read(chunk_chars)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def iter_cards(path: str | os.PathLike[str]) -> Iterator[dict]:
+    """Cards with an ``id`` from ``data.json`` (streamed) or a compiled card pack."""
+
+    if is_card_pack(path):
+        # Each card is read once; do not keep decoded cards around.
+        pack = CardPack(path, cache_size=0)
+        for card_id in pack:
+            yield pack[card_id]
+        return
+    for card in iter_json_array(path):
+        if isinstance(card, dict) and "id" in card:
+            yield card
+
+
+def _hash(*parts: object) -> bytes:
+    encoded = json.dumps(parts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+@dataclass
+class IndexDocument:
+    namespace: str
+    id: str
+    text: str
+    title: str
+    card_id: str
+    text_hash: bytes
+    digest: bytes
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        return {"text": self.text, "title": self.title, "card_id": self.card_id}
+
+
+def iter_documents(cards: Iterable[dict], model: str) -> Iterator[IndexDocument]:
+    for card in cards:
+        for namespace, doc in card_documents(card):
+            text_hash = _hash(doc["text"])
+            yield IndexDocument(
+                namespace=namespace or DEFAULT_NAMESPACE,
+                id=doc["id"],
+                text=doc["text"],
+                title=doc["title"],
+                card_id=doc["card_id"],
+                text_hash=text_hash,
+                # The embedding model is part of the digest: switching models rewrites every vector.
+                digest=_hash(model, text_hash.hex(), doc["title"], doc["card_id"]),
+            )
+
+
+class IndexState:
+    """Embeddings by ``(model, text hash)`` and the document digests each sink holds."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+
+    def synced(self, sink: str) -> Dict[Tuple[str, str], bytes]:
+        rows = self._db.execute("SELECT namespace, doc_id, digest FROM synced WHERE sink = ?", (sink,))
+        return {(namespace, doc_id): digest for namespace, doc_id, digest in rows}
+
+    def embeddings(self, model: str, text_hashes: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        # Stay below SQLite's default limit on bound parameters.
+        for start in range(0, len(text_hashes), 500):
+            chunk = text_hashes[start : start + 500]
+            rows = self._db.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                (model, *chunk),
+            )
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_embeddings(self, model: str, vectors: Dict[bytes, np.ndarray]) -> None:
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in vectors.items()],
+        )
+
+    def mark_synced(self, sink: str, docs: Sequence[IndexDocument]) -> None:
+        self._db.executemany(
+            "INSERT OR REPLACE INTO synced (sink, namespace, doc_id, digest) VALUES (?, ?, ?, ?)",
+            [(sink, doc.namespace, doc.id, doc.digest) for doc in docs],
+        )
+
+    def forget(self, sink: str, namespace: str, doc_ids: Sequence[str]) -> None:
+        self._db.executemany(
+            "DELETE FROM synced WHERE sink = ? AND namespace = ? AND doc_id = ?",
+            [(sink, namespace, doc_id) for doc_id in doc_ids],
+        )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class IndexSink(ABC):
+    """Where the documents go. ``name`` keys the sink's rows in the state file."""
+
+    name = "sink"
+    # Buffered sinks need every document, not only changed ones, and hold them until ``flush``.
+    buffered = False
+
+    @abstractmethod
+    async def upsert(self, namespace: str, docs: Sequence[IndexDocument], vectors: np.ndarray) -> None: ...
+
+    def mark_changed(self, namespace: str) -> None:
+        """Called for every namespace that received a new or changed document."""
+
+    @abstractmethod
+    async def delete(self, namespace: str, doc_ids: Sequence[str]) -> None: ...
+
+    async def flush(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class UpstashSink(IndexSink):
+    """Upserts into Upstash Vector over its REST API."""
+
+    def __init__(self, url: str, token: str, *, limiter: AdaptiveLimiter, timeout: float = 30.0) -> None:
+        self.name = f"upstash:{url.rstrip('/')}"
+        self._base_url = url.rstrip("/")
+        self._limiter = limiter
+        self._client = httpx.AsyncClient(timeout=timeout, headers={"Authorization": f"Bearer {token}"})
+
+    def _url(self, operation: str, namespace: str) -> str:
+        if namespace == DEFAULT_NAMESPACE:
+            return f"{self._base_url}/{operation}"
+        return f"{self._base_url}/{operation}/{namespace}"
+
+    async def _send(self, method: str, url: str, payload: object) -> None:
+        async def _request() -> None:
+            response = await self._client.request(method, url, json=payload)
+            response.raise_for_status()
+
+        await self._limiter.call(_request)
+
+    async def upsert(self, namespace: str, docs: Sequence[IndexDocument], vectors: np.ndarray) -> None:
+        payload = [
+            {"id": doc.id, "vector": vector.tolist(), "metadata": doc.metadata} for doc, vector in zip(docs, vectors)
+        ]
+        await self._send("POST", self._url("upsert", namespace), payload)
+
+    async def delete(self, namespace: str, doc_ids: Sequence[str]) -> None:
+        await self._send("DELETE", self._url("delete", namespace), {"ids": list(doc_ids)})
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class LocalIndexSink(IndexSink):
+    """Collects every document and rewrites the namespaces that changed with ``write_namespace``."""
+
+    buffered = True
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = Path(path)
+        self.name = f"local:{self.path.resolve()}"
+        self._rows: Dict[str, Dict[str, Tuple[dict, np.ndarray]]] = {}
+        self._changed: Set[str] = set()
+
+    def mark_changed(self, namespace: str) -> None:
+        self._changed.add(namespace)
+
+    async def upsert(self, namespace: str, docs: Sequence[IndexDocument], vectors: np.ndarray) -> None:
+        rows = self._rows.setdefault(namespace, {})
+        for doc, vector in zip(docs, vectors):
+            rows[doc.id] = ({"id": doc.id, **doc.metadata}, vector)
+
+    async def delete(self, namespace: str, doc_ids: Sequence[str]) -> None:
+        self._changed.add(namespace)
+
+    async def flush(self) -> None:
+        # Rewrite namespaces whose files went missing even if the state says they are current.
+        self._changed.update(namespace for namespace in self._rows if not (self.path / f"{namespace}.npy").exists())
+        for namespace in sorted(self._changed):
+            rows = self._rows.get(namespace)
+            if not rows:
+                for suffix in (".npy", ".meta.json"):
+                    (self.path / f"{namespace}{suffix}").unlink(missing_ok=True)
+                logger.info("Removed empty local index namespace=%s", namespace)
+                continue
+            ordered = [rows[doc_id] for doc_id in sorted(rows)]
+            write_namespace(
+                self.path,
+                None if namespace == DEFAULT_NAMESPACE else namespace,
+                np.stack([vector for _, vector in ordered]),
+                [row for row, _ in ordered],
+            )
+            logger.info("Wrote local index namespace=%s documents=%s", namespace, len(ordered))
+        self._changed.clear()
+
+
+@dataclass
+class BuildProgress:
+    started: float = field(default_factory=time.monotonic)
+    documents: int = 0
+    unchanged: int = 0
+    embedded: int = 0
+    reused: int = 0
+    upserted: int = 0
+    deleted: int = 0
+    tokens: int = 0
+    requests: int = 0
+
+    def summary(self) -> Dict[str, float]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "documents": self.documents,
+            "unchanged": self.unchanged,
+            "embedded": self.embedded,
+            "reused_embeddings": self.reused,
+            "upserted": self.upserted,
+            "deleted": self.deleted,
+            "embedding_requests": self.requests,
+            "tokens": self.tokens,
+            "seconds": round(elapsed, 1),
+            "documents_per_second": round(self.documents / elapsed, 1),
+            "embedded_per_second": round(self.embedded / elapsed, 1),
+        }
+
+    def log(self) -> None:
+        logger.info("Index build: %s", " ".join(f"{key}={value}" for key, value in self.summary().items()))
+
+
+class IndexBuilder:
+    def __init__(
+        self,
+        *,
+        client: Any,
+        model: str,
+        sink: IndexSink,
+        state: IndexState,
+        limiter: AdaptiveLimiter,
+        batch_size: int = 256,
+        concurrency: int = 4,
+        force: bool = False,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.sink = sink
+        self.state = state
+        self.limiter = limiter
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.force = force
+        self.progress = BuildProgress()
+
+    async def run(self, documents: Iterable[IndexDocument], report_interval: float = 10.0) -> Dict[str, float]:
+        synced = {} if self.force else self.state.synced(self.sink.name)
+        seen: Set[Tuple[str, str]] = set()
+        pending: List[Tuple[IndexDocument, bool]] = []
+        buffered_marks: List[IndexDocument] = []
+        # Bounded, so streaming data.json never runs more than a few batches ahead of the API.
+        queue: asyncio.Queue[List[Tuple[IndexDocument, bool]]] = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def _worker() -> None:
+            while True:
+                batch = await queue.get()
+                try:
+                    changed = await self._process(batch)
+                finally:
+                    queue.task_done()
+                if self.sink.buffered:
+                    buffered_marks.extend(changed)
+                else:
+                    self.state.mark_synced(self.sink.name, changed)
+
+        async def _report() -> None:
+            while True:
+                await asyncio.sleep(report_interval)
+                self.progress.log()
+
+        workers = [asyncio.create_task(_worker()) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(_report()) if report_interval > 0 else None
+        try:
+            for doc in documents:
+                key = (doc.namespace, doc.id)
+                if key in seen:
+                    logger.warning("Duplicate document %s in namespace=%s; keeping the first", doc.id, doc.namespace)
+                    continue
+                seen.add(key)
+                self.progress.documents += 1
+                changed = synced.get(key) != doc.digest
+                if not changed:
+                    self.progress.unchanged += 1
+                    if not self.sink.buffered:
+                        continue
+                pending.append((doc, changed))
+                if len(pending) >= self.batch_size:
+                    await self._until_workers_fail(queue.put(pending), workers)
+                    pending = []
+            if pending:
+                await self._until_workers_fail(queue.put(pending), workers)
+            await self._until_workers_fail(queue.join(), workers)
+
+            await self._delete_removed(synced, seen)
+            await self.sink.flush()
+            if buffered_marks:
+                self.state.mark_synced(self.sink.name, buffered_marks)
+        finally:
+            tasks = [task for task in (*workers, reporter) if task is not None]
+            for task in tasks:
+                task.cancel()
+            # Let cancelled workers finish their state commits and limiter releases before the build returns.
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.progress.summary()
+
+    @staticmethod
+    async def _until_workers_fail(operation: Awaitable[None], workers: List[asyncio.Task[None]]) -> None:
+        """Await ``operation``, raising a worker's error instead of waiting on a queue nobody drains."""
+
+        waiting = asyncio.ensure_future(operation)
+        await asyncio.wait({waiting, *workers}, return_when=asyncio.FIRST_COMPLETED)
+        for worker in workers:
+            if worker.done():
+                waiting.cancel()
+                await asyncio.gather(waiting, return_exceptions=True)
+                worker.result()
+        await waiting
+
+    async def _process(self, batch: List[Tuple[IndexDocument, bool]]) -> List[IndexDocument]:
+        docs = [doc for doc, _ in batch]
+        vectors = self.state.embeddings(self.model, list({doc.text_hash for doc in docs}))
+        self.progress.reused += sum(1 for doc in docs if doc.text_hash in vectors)
+        missing: Dict[bytes, str] = {}
+        for doc in docs:
+            if doc.text_hash not in vectors:
+                missing.setdefault(doc.text_hash, doc.text)
+        if missing:
+            embedded = await self._embed(list(missing.values()))
+            new_vectors = dict(zip(missing, embedded))
+            self.state.put_embeddings(self.model, new_vectors)
+            vectors.update(new_vectors)
+            self.progress.embedded += len(new_vectors)
+
+        by_namespace: Dict[str, List[IndexDocument]] = {}
+        for doc in docs:
+            by_namespace.setdefault(doc.namespace, []).append(doc)
+        for namespace, namespace_docs in by_namespace.items():
+            await self.sink.upsert(namespace, namespace_docs, np.stack([vectors[doc.text_hash] for doc in namespace_docs]))
+
+        changed = [doc for doc, is_changed in batch if is_changed]
+        for doc in changed:
+            self.sink.mark_changed(doc.namespace)
+        self.progress.upserted += len(changed)
+        return changed
+
+    async def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        result = await self.limiter.call(lambda: self.client.embeddings.create(model=self.model, input=texts))
+        self.progress.requests += 1
+        usage = getattr(result, "usage", None)
+        if usage is not None:
+            self.progress.tokens += getattr(usage, "total_tokens", 0) or 0
+        return [np.asarray(item.embedding, dtype=np.float32) for item in sorted(result.data, key=lambda item: item.index)]
+
+    async def _delete_removed(self, synced: Dict[Tuple[str, str], bytes], seen: Set[Tuple[str, str]]) -> None:
+        removed: Dict[str, List[str]] = {}
+        for namespace, doc_id in synced:
+            if (namespace, doc_id) not in seen:
+                removed.setdefault(namespace, []).append(doc_id)
+        for namespace, doc_ids in sorted(removed.items()):
+            for start in range(0, len(doc_ids), self.batch_size):
+                chunk = doc_ids[start : start + self.batch_size]
+                await self.sink.delete(namespace, chunk)
+                self.state.forget(self.sink.name, namespace, chunk)
+                self.progress.deleted += len(chunk)
+            logger.info("Deleted %s removed documents from namespace=%s", len(doc_ids), namespace)
+
+
+def _limiter(upstream: str, concurrency: int, max_retries: int) -> AdaptiveLimiter:
+    # No request deadline here: calls queue for a slot and 429s shrink the limit below --concurrency.
+    return AdaptiveLimiter(
+        upstream,
+        initial_limit=concurrency,
+        min_limit=1,
+        max_limit=concurrency,
+        max_queue=concurrency * 2,
+        max_retries=max_retries,
+        retry_base_delay=1.0,
+        retry_max_delay=30.0,
+    )
+
+
+async def _build(args: argparse.Namespace) -> Dict[str, float]:
+    from openai import AsyncOpenAI
+
+    if args.sink == "upstash":
+        url, token = os.getenv("UPSTASH_VECTOR_URL"), os.getenv("UPSTASH_VECTOR_TOKEN")
+        if not url or not token:
+            raise SystemExit("UPSTASH_VECTOR_URL and UPSTASH_VECTOR_TOKEN must be set for --sink upstash")
+        sink: IndexSink = UpstashSink(url, token, limiter=_limiter("upstash", args.concurrency, args.max_retries))
+    else:
+        sink = LocalIndexSink(args.out)
+
+    state = IndexState(args.state)
+    builder = IndexBuilder(
+        # Retries go through the limiter, which also backs off on 429s.
+        client=AsyncOpenAI(max_retries=0),
+        model=args.model,
+        sink=sink,
+        state=state,
+        limiter=_limiter("openai_embeddings", args.concurrency, args.max_retries),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        force=args.force,
+    )
+    try:
+        return await builder.run(iter_documents(iter_cards(args.data), args.model), args.report_interval)
+    finally:
+        await builder.client.close()
+        await sink.aclose()
+        state.close()
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    base_dir = Path(__file__).resolve().parent.parent.parent
+    parser = argparse.ArgumentParser(description="Embed data.json into the Upstash or local vector index")
+    parser.add_argument("--data", default=str(base_dir / "data" / "data.json"), help="data.json or a card pack")
+    parser.add_argument("--sink", choices=("upstash", "local"), default="upstash")
+    parser.add_argument("--out", default=str(base_dir / "data" / "local_index"), help="Directory for --sink local")
+    parser.add_argument("--state", default=str(base_dir / "data" / "index_state.sqlite3"))
+    parser.add_argument("--model", default=os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"))
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument("--force", action="store_true", help="Send every document to the sink again")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(_build(args))
+    print(" ".join(f"{key}={value}" for key, value in summary.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""Character n-gram inverted index over card names and effect text.
+
+Japanese text has no whitespace word boundaries, so documents and queries are
+split into overlapping character bigrams instead of tokens. Each card is one
+document with two fields (name and effect text); a posting stores the
+precomputed BM25 weight of a gram for a card so a query is a handful of
+vectorized ``scores[rows] += weights`` updates.
+"""
+
+from __future__ import annotations
+
+import copy
+import itertools
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+from .cards import sorted_effects
+
+_NGRAM = 2
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_NAME_FIELD_WEIGHT = 3.0
+_STRIP_PATTERN = re.compile(r"[\s\W_]+")
+# Words that commonly wrap a card name in a question ("<name>の効果を教えて").
+_NAME_QUESTION_FILLERS = re.compile(
+    r"(について|を教えてください|を教えて|教えてください|教えて|の効果|効果|とは|って何|ってなに|は|の|を|が|って|何|なに)"
+)
+
+
+def normalize_lexical_text(text: str) -> str:
+    if not unicodedata.is_normalized("NFKC", text):
+        text = unicodedata.normalize("NFKC", text)
+    return _STRIP_PATTERN.sub("", text.lower())
+
+
+def ngrams(text: str, n: int = _NGRAM) -> List[str]:
+    if len(text) < n:
+        return [text] if text else []
+    return [text[index : index + n] for index in range(len(text) - n + 1)]
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Sequence[dict]], limit: int, k: int = 60) -> List[dict]:
+    """Fuse ranked doc lists by ``sum(1 / (k + rank))``; the first list wins ties and duplicate payloads."""
+
+    fused: Dict[object, Tuple[float, int, dict]] = {}
+    order = 0
+    for docs in result_lists:
+        for rank, doc in enumerate(docs, start=1):
+            key = doc.get("card_id") or doc.get("text")
+            contribution = 1.0 / (k + rank)
+            if key in fused:
+                score, first_seen, kept = fused[key]
+                fused[key] = (score + contribution, first_seen, kept)
+            else:
+                fused[key] = (contribution, order, doc)
+                order += 1
+
+    ranked = sorted(fused.values(), key=lambda item: (-item[0], item[1]))
+    return [dict(doc, fusion_score=round(score, 6)) for score, _, doc in ranked[:limit]]
+
+
+class _FieldStats:
+    """Corpus statistics BM25 needs for one field, kept up to date as rows change."""
+
+    def __init__(self, document_frequency: Dict[str, int] | None = None, total_length: int = 0) -> None:
+        self.document_frequency: Dict[str, int] = document_frequency or {}
+        self.total_length = total_length
+
+    def copy(self) -> "_FieldStats":
+        return _FieldStats(dict(self.document_frequency), self.total_length)
+
+    def add(self, counts: Mapping[str, int], sign: int) -> None:
+        for gram in counts:
+            df = self.document_frequency.get(gram, 0) + sign
+            if df > 0:
+                self.document_frequency[gram] = df
+            else:
+                self.document_frequency.pop(gram, None)
+        self.total_length += sign * sum(counts.values())
+
+
+@dataclass(frozen=True)
+class LexicalTables:
+    """Everything a ``LexicalIndex`` is restored from; ``app.card_pack`` stores these in the pack.
+
+    Per field (name, effect text): the document frequency of each gram and the
+    total gram count. ``postings`` maps a gram to its rows and BM25 weights.
+    """
+
+    card_ids: List[str]
+    names: List[str]
+    effect_texts: List[str]
+    document_frequencies: Tuple[Dict[str, int], Dict[str, int]]
+    total_lengths: Tuple[int, int]
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+class LexicalIndex:
+    """BM25 over card names and effect texts.
+
+    ``with_changes`` returns an updated copy that only re-scores the changed
+    cards; postings of untouched cards keep the corpus statistics from when they
+    were scored, which drift only slightly for small diffs. Build a new index
+    after large changes.
+    """
+
+    def __init__(self, cards: Mapping[str, dict], *, min_coverage: float = 0.6, name_coverage: float = 0.6) -> None:
+        self.card_ids: List[str] = []
+        self.min_coverage = min_coverage
+        self.name_coverage = name_coverage
+        self.names: List[str] = []
+        self.effect_texts: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._live: List[bool] = []
+        self._document_count = 0
+        self._field_stats = [_FieldStats(), _FieldStats()]
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._name_rows: Dict[str, List[int]] = {}
+        self._names_by_first_gram: Dict[str, List[int]] = {}
+        self._apply(cards, list(cards), ())
+
+    @classmethod
+    def from_tables(
+        cls, tables: LexicalTables, *, min_coverage: float = 0.6, name_coverage: float = 0.6
+    ) -> "LexicalIndex":
+        """Index over ``tables`` without re-reading or re-scoring any card; posting arrays are used as given."""
+
+        index = cls({}, min_coverage=min_coverage, name_coverage=name_coverage)
+        index.card_ids = tables.card_ids
+        index.names = tables.names
+        index.effect_texts = tables.effect_texts
+        index._rows = {card_id: row for row, card_id in enumerate(tables.card_ids)}
+        index._live = [True] * len(tables.card_ids)
+        index._document_count = len(tables.card_ids)
+        index._field_stats = [
+            _FieldStats(document_frequency, total_length)
+            for document_frequency, total_length in zip(tables.document_frequencies, tables.total_lengths)
+        ]
+        index._postings = tables.postings
+        for row in range(len(tables.card_ids)):
+            index._index_name(row)
+        return index
+
+    def tables(self) -> LexicalTables:
+        if self.dead_rows:
+            raise ValueError("Only an index without removed rows can be exported; build a new one")
+        return LexicalTables(
+            card_ids=list(self.card_ids),
+            names=list(self.names),
+            effect_texts=list(self.effect_texts),
+            document_frequencies=(
+                dict(self._field_stats[0].document_frequency),
+                dict(self._field_stats[1].document_frequency),
+            ),
+            total_lengths=(self._field_stats[0].total_length, self._field_stats[1].total_length),
+            postings=dict(self._postings),
+        )
+
+    def with_changes(self, cards: Mapping[str, dict], changed: Iterable[str], removed: Iterable[str]) -> "LexicalIndex":
+        """Copy of this index with ``changed`` cards re-read from ``cards`` and ``removed`` cards dropped.
+
+        The copy shares no mutable state with ``self``, so searches running
+        against the old index are unaffected.
+        """
+
+        index = copy.copy(self)
+        index.card_ids = list(self.card_ids)
+        index.names = list(self.names)
+        index.effect_texts = list(self.effect_texts)
+        index._rows = dict(self._rows)
+        index._live = list(self._live)
+        index._field_stats = [stats.copy() for stats in self._field_stats]
+        index._postings = dict(self._postings)
+        index._name_rows = dict(self._name_rows)
+        index._names_by_first_gram = dict(self._names_by_first_gram)
+        index._apply(cards, list(changed), list(removed))
+        return index
+
+    def _fields(self) -> Tuple[Tuple[List[str], float], ...]:
+        return ((self.names, _NAME_FIELD_WEIGHT), (self.effect_texts, 1.0))
+
+    def _apply(self, cards: Mapping[str, dict], changed: Sequence[str], removed: Sequence[str]) -> None:
+        touched: Dict[int, None] = {}
+        affected_grams = set()
+
+        # Take the old version of every touched row out of the statistics and name lookups.
+        for card_id in itertools.chain(removed, changed):
+            row = self._rows.get(card_id)
+            if row is None or not self._live[row]:
+                continue
+            for (texts, _), stats in zip(self._fields(), self._field_stats):
+                counts = _count(ngrams(texts[row]))
+                stats.add(counts, -1)
+                affected_grams.update(counts)
+            self._unindex_name(row)
+            self._live[row] = False
+            self._document_count -= 1
+            touched[row] = None
+
+        for card_id in removed:
+            row = self._rows.get(card_id)
+            if row is not None:
+                self.names[row] = self.effect_texts[row] = ""
+
+        for card_id in changed:
+            row = self._rows.get(card_id)
+            if row is None:
+                row = self._rows[card_id] = len(self.card_ids)
+                self.card_ids.append(card_id)
+                self.names.append("")
+                self.effect_texts.append("")
+                self._live.append(False)
+            master = cards[card_id]
+            self.names[row] = normalize_lexical_text(str(master.get("name") or ""))
+            self.effect_texts[row] = normalize_lexical_text("".join(text for _, text in sorted_effects(master)))
+            for (texts, _), stats in zip(self._fields(), self._field_stats):
+                stats.add(_count(ngrams(texts[row])), 1)
+            self._index_name(row)
+            self._live[row] = True
+            self._document_count += 1
+            touched[row] = None
+
+        # Score the new version of every touched row against the updated statistics.
+        new_entries: Dict[str, Dict[int, float]] = {}
+        document_count = self._document_count
+        for (texts, field_weight), stats in zip(self._fields(), self._field_stats):
+            average_length = stats.total_length / document_count if document_count else 0.0
+            for row in touched:
+                if not self._live[row]:
+                    continue
+                counts = _count(ngrams(texts[row]))
+                length = sum(counts.values())
+                length_norm = 1 - _BM25_B + _BM25_B * (length / average_length if average_length else 0.0)
+                for gram, tf in counts.items():
+                    df = stats.document_frequency[gram]
+                    idf = math.log(1 + (document_count - df + 0.5) / (df + 0.5))
+                    weight = idf * tf * (_BM25_K1 + 1) / (tf + _BM25_K1 * length_norm) * field_weight
+                    per_row = new_entries.setdefault(gram, {})
+                    per_row[row] = per_row.get(row, 0.0) + weight
+        affected_grams.update(new_entries)
+
+        touched_rows = np.fromiter(touched, dtype=np.int32, count=len(touched))
+        for gram in affected_grams:
+            row_parts: List[np.ndarray] = []
+            weight_parts: List[np.ndarray] = []
+            existing = self._postings.get(gram)
+            if existing is not None:
+                keep = ~np.isin(existing[0], touched_rows)
+                row_parts.append(existing[0][keep])
+                weight_parts.append(existing[1][keep])
+            per_row = new_entries.get(gram)
+            if per_row:
+                row_parts.append(np.fromiter(per_row.keys(), dtype=np.int32, count=len(per_row)))
+                weight_parts.append(np.fromiter(per_row.values(), dtype=np.float32, count=len(per_row)))
+            rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.int32)
+            if rows.size:
+                weights = np.concatenate(weight_parts) if len(weight_parts) > 1 else weight_parts[0]
+                self._postings[gram] = (rows, weights)
+            else:
+                self._postings.pop(gram, None)
+
+    def _index_name(self, row: int) -> None:
+        name = self.names[row]
+        if name:
+            self._name_rows[name] = self._name_rows.get(name, []) + [row]
+            first_gram = name[:_NGRAM]
+            self._names_by_first_gram[first_gram] = self._names_by_first_gram.get(first_gram, []) + [row]
+
+    def _unindex_name(self, row: int) -> None:
+        # Lists are replaced rather than mutated because earlier index copies may share them.
+        name = self.names[row]
+        if not name:
+            return
+        for lookup, key in ((self._name_rows, name), (self._names_by_first_gram, name[:_NGRAM])):
+            rows = [other for other in lookup.get(key, ()) if other != row]
+            if rows:
+                lookup[key] = rows
+            else:
+                lookup.pop(key, None)
+
+    def __len__(self) -> int:
+        return self._document_count
+
+    @property
+    def dead_rows(self) -> int:
+        return len(self.card_ids) - self._document_count
+
+    def search(self, text: str, top_k: int) -> List[Tuple[str, float]]:
+        query_grams = set(ngrams(normalize_lexical_text(text)))
+        if not query_grams or not self.card_ids:
+            return []
+
+        scores = np.zeros(len(self.card_ids), dtype=np.float32)
+        matched = np.zeros(len(self.card_ids), dtype=np.int32)
+        for gram in query_grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                continue
+            rows, weights = posting
+            scores[rows] += weights
+            matched[rows] += 1
+
+        eligible = np.flatnonzero(matched >= max(1, math.ceil(self.min_coverage * len(query_grams))))
+        if eligible.size == 0:
+            return []
+        k = min(top_k, eligible.size)
+        top = eligible[np.argpartition(-scores[eligible], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.card_ids[row], float(scores[row])) for row in top]
+
+    def match_card_name(self, text: str) -> List[str]:
+        """Card ids whose name is the question, or most of it once question fillers are removed."""
+
+        normalized = normalize_lexical_text(text)
+        if not normalized:
+            return []
+        exact = self._name_rows.get(normalized)
+        if exact:
+            return [self.card_ids[row] for row in exact]
+
+        # Only names whose first gram occurs in the query can be contained in it.
+        best_name = ""
+        for gram in set(ngrams(normalized)):
+            for row in self._names_by_first_gram.get(gram, ()):
+                name = self.names[row]
+                if len(name) > len(best_name) and len(name) >= _NGRAM and name in normalized:
+                    best_name = name
+        if not best_name:
+            return []
+
+        residual = _NAME_QUESTION_FILLERS.sub("", normalized.replace(best_name, "", 1))
+        if len(best_name) / (len(best_name) + len(residual)) < self.name_coverage:
+            return []
+        return [self.card_ids[row] for row in self._name_rows[best_name]]
+
+
+def _count(grams: Iterable[str]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for gram in grams:
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
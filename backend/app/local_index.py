@@ -0,0 +1,174 @@
+"""In-process vector index used instead of Upstash when RAG_RETRIEVAL_BACKEND=local.
+
+Each namespace is stored as two files inside the index directory:
+
+* ``<namespace>.npy``: float32 matrix of L2-normalized document vectors, memory-mapped read-only
+* ``<namespace>.meta.json``: list of ``{"id", "text", "title", "card_id"}`` rows in matrix order
+
+The default (unnamed) namespace is stored as ``default``.
+
+Build an index offline from ``data/data.json`` with::
+
+    python -m app.index_build --sink local --out ../data/local_index
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAMESPACE = "default"
+_NAMESPACE_FILE_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+def _namespace_key(namespace: str | None) -> str:
+    return namespace or DEFAULT_NAMESPACE
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class LocalVectorIndex:
+    """Brute-force cosine top-k over memory-mapped per-namespace float32 matrices."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = Path(path)
+        # Loaded namespaces keyed by name, with the file signature they were loaded from.
+        self._namespaces: Dict[str, Tuple[Tuple[int, ...], Tuple[np.ndarray, List[dict]] | None]] = {}
+        self._reported_missing: Set[str] = set()
+
+    def _signature(self, key: str) -> Tuple[int, ...] | None:
+        try:
+            matrix_stat = (self.path / f"{key}.npy").stat()
+            meta_stat = (self.path / f"{key}.meta.json").stat()
+        except OSError:
+            return None
+        return matrix_stat.st_ino, matrix_stat.st_mtime_ns, meta_stat.st_ino, meta_stat.st_mtime_ns
+
+    def _load_namespace(self, key: str) -> Tuple[np.ndarray, List[dict]] | None:
+        # Misses are not cached and replaced files are reloaded, so a namespace written by
+        # ``python -m app.index_build --sink local`` is picked up without a restart.
+        signature = self._signature(key) if _NAMESPACE_FILE_PATTERN.match(key) else None
+        if signature is None:
+            self._namespaces.pop(key, None)
+            if key not in self._reported_missing:
+                self._reported_missing.add(key)
+                logger.warning("Local index namespace=%s not found under %s", key, self.path)
+            return None
+        self._reported_missing.discard(key)
+        cached = self._namespaces.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        loaded: Tuple[np.ndarray, List[dict]] | None = None
+        matrix = np.load(self.path / f"{key}.npy", mmap_mode="r")
+        with open(self.path / f"{key}.meta.json", "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        if matrix.ndim != 2 or matrix.shape[0] != len(rows):
+            # Also seen briefly while write_namespace replaces the two files one after the other.
+            logger.error("Local index namespace=%s is inconsistent: matrix=%s rows=%s", key, matrix.shape, len(rows))
+        else:
+            loaded = (matrix, rows)
+            logger.info("Loaded local index namespace=%s vectors=%s dim=%s", key, *matrix.shape)
+
+        self._namespaces[key] = (signature, loaded)
+        return loaded
+
+    def namespaces(self) -> List[str]:
+        return sorted(path.name[: -len(".npy")] for path in self.path.glob("*.npy"))
+
+    def search(
+        self,
+        embedding: Iterable[float],
+        top_k: int,
+        namespace: str | None = None,
+    ) -> Tuple[List[dict], Dict[str, Any]]:
+        diagnostics: Dict[str, Any] = {
+            "namespace": namespace or "default",
+            "payload_top_k": top_k,
+            "backend": "local",
+        }
+
+        loaded = self._load_namespace(_namespace_key(namespace))
+        if loaded is None:
+            diagnostics["raw_match_count"] = 0
+            diagnostics["usable_doc_count"] = 0
+            diagnostics["warning"] = "namespace_not_found"
+            return [], diagnostics
+
+        matrix, rows = loaded
+        query = np.asarray(embedding if isinstance(embedding, np.ndarray) else list(embedding), dtype=np.float32)
+        if query.shape != (matrix.shape[1],):
+            raise ValueError(f"Query dimension {query.shape} does not match index dimension {matrix.shape[1]}")
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+
+        similarities = matrix @ query
+        k = min(top_k, similarities.shape[0])
+        if k <= 0:
+            top_indices = np.empty(0, dtype=np.intp)
+        elif k < similarities.shape[0]:
+            top_indices = np.argpartition(-similarities, k - 1)[:k]
+            top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        else:
+            top_indices = np.argsort(-similarities)
+
+        docs: List[dict] = []
+        for index in top_indices:
+            row = rows[int(index)]
+            if not row.get("text"):
+                continue
+            docs.append(
+                {
+                    "text": row["text"],
+                    "title": row.get("title"),
+                    "card_id": row.get("card_id"),
+                    # Same scale as Upstash's COSINE metric: (1 + cos) / 2.
+                    "score": (1.0 + float(similarities[index])) / 2.0,
+                }
+            )
+
+        diagnostics["raw_match_count"] = int(top_indices.shape[0])
+        diagnostics["usable_doc_count"] = len(docs)
+        if not docs:
+            diagnostics["warning"] = "no_usable_docs"
+        return docs, diagnostics
+
+
+def write_namespace(
+    path: str | os.PathLike[str],
+    namespace: str | None,
+    vectors: Sequence[Sequence[float]] | np.ndarray,
+    rows: Sequence[dict],
+) -> None:
+    key = _namespace_key(namespace)
+    if not _NAMESPACE_FILE_PATTERN.match(key):
+        raise ValueError(f"Invalid namespace name: {key!r}")
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(rows):
+        raise ValueError(f"Expected {len(rows)} vectors, got matrix of shape {matrix.shape}")
+
+    target = Path(path)
+    target.mkdir(parents=True, exist_ok=True)
+    # Write to temporary names first so a running worker never maps a half-written file.
+    tmp_matrix = target / f".{key}.npy.tmp"
+    tmp_meta = target / f".{key}.meta.json.tmp"
+    with open(tmp_matrix, "wb") as f:
+        np.save(f, _normalize_rows(matrix))
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(list(rows), f, ensure_ascii=False)
+    os.replace(tmp_matrix, target / f"{key}.npy")
+    os.replace(tmp_meta, target / f"{key}.meta.json")
+
@@ -1,10 +1,46 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import os
+import secrets
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from .models import ChatRequest, ChatResponse
+from .backpressure import start_request_deadline
+from .batch_chat import CHAT_BATCH_MAX_ITEMS, encode_record, parse_batch_lines, run_batch
+from .metrics import REGISTRY, start_request_timings
+from .models import ChatRequest, ChatResponse, ChatResponseMeta, StageTiming
+from .response_encoding import PreEncodedJSONResponse, encode_chat_response, encode_meta
 from .services import chat as run_chat
+from .services import CARD_DATA_WATCH_INTERVAL, REQUEST_DEADLINE_SECONDS, reload_card_data, watch_card_data
+from .services import card_store, close_http_clients, get_cache_stats, refresh_cache_gauges, start_http_clients
+from .services import token_counter
+from .services import stream_chat as run_chat_stream
+
+# Required in the X-Admin-Token header by the batch chat and admin endpoints; while unset they answer 403.
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+# Return chat responses as pre-encoded JSON (see app.response_encoding) instead of re-validating the model.
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() in {"1", "true", "yes"}
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await start_http_clients()
+    # May download the tiktoken BPE file, so not on the import path or the event loop.
+    await asyncio.to_thread(token_counter.load)
+    watcher = asyncio.create_task(watch_card_data()) if CARD_DATA_WATCH_INTERVAL > 0 else None
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await close_http_clients()
 
-app = FastAPI(title="gamechat-ai", version="0.1.0")
+
+app = FastAPI(title="gamechat-ai", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,11 +51,136 @@ app.add_middleware(
 )
 
 
+def _debug_timings(header_value: str | None) -> List[Dict[str, object]] | None:
+    if header_value and header_value.lower() not in ("0", "false", "no"):
+        return start_request_timings()
+    return None
+
+
+def _require_admin_token(x_admin_token: str | None) -> None:
+    # Fails closed: without a configured token nobody passes.
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled; set ADMIN_API_TOKEN")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
 @app.post("/api/v1/chat", response_model=ChatResponse)
-async def chat_endpoint(payload: ChatRequest):
+async def chat_endpoint(payload: ChatRequest, x_debug_timings: str | None = Header(default=None)):
+    timings = _debug_timings(x_debug_timings)
+    start_request_deadline(REQUEST_DEADLINE_SECONDS)
     try:
-        return await run_chat(payload.message, payload.history or [])
+        response = await run_chat(
+            payload.message, payload.history or [], session_id=payload.session_id, start_session=payload.start_session
+        )
     except HTTPException:
         raise
     except Exception as exc:  # pragma: no cover - FastAPI will surface clean 500 JSON
         raise HTTPException(status_code=500, detail=f"Failed to generate answer: {exc}") from exc
+    if timings is not None:
+        # Cached responses are shared between requests, so attach timings to a copy.
+        stage_timings = [StageTiming.model_validate(timing) for timing in timings]
+        response = response.model_copy(
+            update={"meta": response.meta.model_copy(update={"stage_timings": stage_timings})}
+        )
+    if FAST_JSON_RESPONSES:
+        # Returning a Response makes FastAPI skip response_model validation and encoding.
+        return PreEncodedJSONResponse(encode_chat_response(response, card_store.snapshot))
+    return response
+
+
+def _format_sse(event: str, data: dict | ChatResponseMeta) -> str:
+    if isinstance(data, ChatResponseMeta):
+        if FAST_JSON_RESPONSES:
+            payload = encode_meta(data, card_store.snapshot).decode("utf-8")
+        else:
+            payload = json.dumps(data.model_dump(mode="json", by_alias=True), ensure_ascii=False)
+    else:
+        payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@app.post("/api/v1/chat/stream")
+async def chat_stream_endpoint(payload: ChatRequest, x_debug_timings: str | None = Header(default=None)):
+    timings = _debug_timings(x_debug_timings)
+    start_request_deadline(REQUEST_DEADLINE_SECONDS)
+    events = run_chat_stream(payload.message, payload.history or [], payload.session_id, payload.start_session)
+    # Retrieval runs before the response starts so its failures still map to proper status codes.
+    try:
+        first_event = await anext(events)
+    except HTTPException:
+        raise
+    except Exception as exc:  # pragma: no cover - FastAPI will surface clean 500 JSON
+        raise HTTPException(status_code=500, detail=f"Failed to generate answer: {exc}") from exc
+
+    async def _sse(first: Tuple[str, Any], rest: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[str]:
+        yield _format_sse(*first)
+        try:
+            async for event, data in rest:
+                if event == "done" and timings is not None:
+                    data = dict(data, stage_timings=timings)
+                yield _format_sse(event, data)
+        except HTTPException as exc:
+            yield _format_sse("error", {"status_code": exc.status_code, "detail": exc.detail})
+        except Exception as exc:  # pragma: no cover - headers are already sent, report in-band
+            yield _format_sse("error", {"status_code": 500, "detail": f"Failed to generate answer: {exc}"})
+
+    return StreamingResponse(
+        _sse(first_event, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/v1/chat/batch")
+async def chat_batch_endpoint(request: Request, x_admin_token: str | None = Header(default=None)):
+    """Accept JSONL questions (see app.batch_chat) and stream JSONL results in completion order."""
+
+    # One request fans out to hundreds of OpenAI calls, so it is not open to any origin.
+    _require_admin_token(x_admin_token)
+    body = (await request.body()).decode("utf-8", errors="replace")
+    items, rejected = parse_batch_lines(body.splitlines())
+    if len(items) + len(rejected) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {CHAT_BATCH_MAX_ITEMS} lines")
+
+    results = run_batch(items)
+    # As with the SSE endpoint, batch embedding failures surface as a status code before streaming starts.
+    try:
+        first_result = await anext(results, None)
+    except HTTPException:
+        raise
+    except Exception as exc:  # pragma: no cover - FastAPI will surface clean 500 JSON
+        raise HTTPException(status_code=500, detail=f"Failed to run batch: {exc}") from exc
+
+    async def _jsonl() -> AsyncIterator[str]:
+        for record in rejected:
+            yield encode_record(record)
+        if first_result is None:
+            return
+        yield encode_record(first_result)
+        async for record in results:
+            yield encode_record(record)
+
+    return StreamingResponse(_jsonl(), media_type="application/x-ndjson")
+
+
+@app.post("/api/v1/admin/reload-cards")
+async def reload_cards_endpoint(x_admin_token: str | None = Header(default=None)):
+    """Re-read data/data.json and swap in the changed cards without a restart."""
+
+    _require_admin_token(x_admin_token)
+    try:
+        return await reload_card_data()
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Failed to reload card data: {exc}") from exc
+
+
+@app.get("/api/v1/cache/stats")
+async def cache_stats_endpoint():
+    return await get_cache_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    await refresh_cache_gauges()
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
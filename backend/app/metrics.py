@@ -0,0 +1,269 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Only what the RAG pipeline needs: labelled counters, gauges and histograms kept
+in plain dicts, a ``stage_timer`` context manager, and an optional per-request
+list of stage timings collected through a context variable.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values) if value != ""]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple("" if labels.get(name) is None else str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: object) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def count(self, **labels: object) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self) -> List[str]:
+        lines: List[str] = []
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Latency of each RAG pipeline stage.",
+    ("stage", "namespace", "path"),
+)
+CHAT_DURATION = REGISTRY.histogram(
+    "rag_chat_duration_seconds",
+    "End-to-end latency of chat requests by retrieval path.",
+    ("endpoint", "path"),
+)
+CACHE_EVENTS = REGISTRY.counter(
+    "rag_cache_events_total",
+    "Cache lookups by cache and result (hit/miss).",
+    ("cache", "result"),
+)
+CACHE_ENTRIES = REGISTRY.gauge(
+    "rag_cache_entries",
+    "Current number of entries held by each cache.",
+    ("cache",),
+)
+FALLBACKS = REGISTRY.counter(
+    "rag_fallback_total",
+    "Searches that fell back to the default namespace, by the namespace that came back empty.",
+    ("from_namespace",),
+)
+UPSTASH_RESPONSES = REGISTRY.counter(
+    "rag_upstash_responses_total",
+    "Upstash query responses by HTTP status code ('error' for transport failures).",
+    ("namespace", "status_code"),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "rag_stage_errors_total",
+    "Pipeline failures by stage, as reported through _stage_error.",
+    ("stage",),
+)
+SINGLE_FLIGHT_CALLS = REGISTRY.counter(
+    "rag_single_flight_calls_total",
+    "Coalesced calls by stage; role=follower calls reused an in-flight upstream call.",
+    ("stage", "role"),
+)
+SPECULATIVE_FALLBACKS = REGISTRY.counter(
+    "rag_speculative_fallback_total",
+    "Speculative default-namespace searches by outcome (used, cancelled).",
+    ("from_namespace", "outcome"),
+)
+NAMESPACE_EMPTY_RATE = REGISTRY.gauge(
+    "rag_namespace_empty_rate",
+    "Recent share of targeted searches per namespace that returned no documents.",
+    ("namespace",),
+)
+CARD_DATA_RELOADS = REGISTRY.counter(
+    "rag_card_data_reloads_total",
+    "Card master data reload attempts by result (applied, unchanged, failed).",
+    ("result",),
+)
+CARD_DATA_VERSION = REGISTRY.gauge(
+    "rag_card_data_version",
+    "Version of the card master data snapshot currently served (bumped on every applied reload).",
+)
+UPSTREAM_CONCURRENCY_LIMIT = REGISTRY.gauge(
+    "rag_upstream_concurrency_limit",
+    "Current adaptive concurrency limit per upstream (openai_embeddings, upstash, openai_chat).",
+    ("upstream",),
+)
+UPSTREAM_SHED = REGISTRY.counter(
+    "rag_upstream_shed_total",
+    "Upstream calls rejected before queueing, by reason (queue_full, deadline).",
+    ("upstream", "reason"),
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "rag_upstream_retries_total",
+    "Retries of transient upstream failures that fit the request deadline.",
+    ("upstream",),
+)
+
+_request_timings: ContextVar[List[Dict[str, object]] | None] = ContextVar("rag_request_timings", default=None)
+
+
+def start_request_timings() -> List[Dict[str, object]]:
+    """Collect stage timings for the current request (and the tasks it spawns) into the returned list."""
+
+    timings: List[Dict[str, object]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float, *, namespace: str | None = None, path: str | None = None) -> None:
+    STAGE_DURATION.observe(seconds, stage=stage, namespace=namespace, path=path)
+    timings = _request_timings.get()
+    if timings is not None:
+        entry: Dict[str, object] = {"stage": stage, "ms": round(seconds * 1000, 3)}
+        if namespace:
+            entry["namespace"] = namespace
+        if path:
+            entry["path"] = path
+        timings.append(entry)
+
+
+@contextmanager
+def stage_timer(stage: str, *, namespace: str | None = None, path: str | None = None) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, namespace=namespace, path=path)
@@ -11,10 +11,15 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: Optional[List[ChatMessage]] = None
+    # Conversation id the server issued in an earlier response's meta.session_id; ids it did not issue get 403.
+    session_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{8,128}$")
+    # Without a session_id: start a conversation, whose new id comes back in meta.session_id.
+    start_session: bool = False
 
 
 class CardSummary(BaseModel):
-    model_config = {"populate_by_name": True}
+    # Frozen: summaries are built once per card at load time and shared across requests.
+    model_config = {"populate_by_name": True, "frozen": True}
     card_id: str
     name: str
     class_: str = Field(alias="class")
@@ -29,6 +34,13 @@ class CardSummary(BaseModel):
     image_after: str
 
 
+class StageTiming(BaseModel):
+    stage: str
+    ms: float
+    namespace: Optional[str] = None
+    path: Optional[str] = None
+
+
 class ChatResponseMeta(BaseModel):
     used_context_count: int
     matched_titles: List[str] = Field(default_factory=list)
@@ -38,6 +50,14 @@ class ChatResponseMeta(BaseModel):
     upstash_status_code: Optional[int] = None
     upstash_error: Optional[str] = None
     cards: List[CardSummary] = Field(default_factory=list)
+    cache_hit: bool = False
+    cache_similarity: Optional[float] = None
+    stage_timings: Optional[List[StageTiming]] = None
+    context_tokens: Optional[int] = None
+    history_tokens: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    session_id: Optional[str] = None
+    follow_up: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -0,0 +1,122 @@
+"""Front-end that turns a raw chat message into the query the retrieval pipeline runs.
+
+``QueryAnalyzer.analyze`` NFKC-normalizes the message once (full-width
+letters, digits and spaces become their ASCII forms, whitespace runs collapse)
+and then applies the two directives with precompiled patterns:
+
+* the first ``effect_N`` token anywhere selects that namespace and is removed
+* a leading directive keyword (``効果`` / ``namespace 効果``, optionally followed
+  by ``:``) selects the multi-namespace effect search and is removed
+
+The result is the same as ``extract_effect_namespace`` followed by
+``strip_effect_directive`` on the normalized text; ``benchmarks.query_analyzer``
+checks that on random inputs. ``resolve_card_names`` adds the ids of the card
+whose name the question is, from the snapshot's lexical index.
+
+``AnalyzedQuery.cache_key`` identifies the question regardless of width,
+case, runs of whitespace and trailing ``?`` / ``!`` / ``。``; caches and
+single-flight keys use it, while the embedding input stays
+``AnalyzedQuery.text``. Punctuation inside the text is kept: "コスト1、2" and
+"コスト12", or "攻撃力-1" and "攻撃力1", are different questions.
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Tuple
+
+from .card_store import CardSnapshot
+
+EFFECT_NAMESPACE_PATTERN = re.compile(r"(effect_\d+)", re.IGNORECASE)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# The full-width ASCII block and the ideographic space, the width variants questions usually contain.
+_WIDE_PATTERN = re.compile("[\uff01-\uff5e\u3000]")
+# Normalized text has single spaces as its only whitespace.
+_TRAILING_CHARS = " ?!。"
+
+
+def _narrow(match: re.Match[str]) -> str:
+    char = match.group(0)
+    return " " if char == "\u3000" else chr(ord(char) - 0xFEE0)
+
+
+def normalize_query_text(text: str) -> str:
+    # NFKC returns already-normalized text after a quick check, and mapping the width variants first
+    # (touching only those characters) lets most Japanese questions, "？" included, take that path.
+    text = unicodedata.normalize("NFKC", _WIDE_PATTERN.sub(_narrow, text))
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def _canonical(normalized: str) -> str:
+    # A message of nothing but "?!。" keeps it, rather than colliding with every other such message.
+    return normalized.lower().rstrip(_TRAILING_CHARS) or normalized
+
+
+def canonical_query_text(text: str) -> str:
+    """``text`` with width, case, whitespace-run and trailing ``?!。`` differences removed."""
+
+    return _canonical(normalize_query_text(text))
+
+
+@dataclass(slots=True)
+class AnalyzedQuery:
+    raw: str
+    # Normalized text with the directives removed: what is embedded and matched.
+    text: str
+    namespace: str | None = None
+    multi_effect: bool = False
+    canonical: str = ""
+    # Ids of the card the question names; empty until resolve_card_names() ran.
+    card_ids: Tuple[str, ...] = ()
+
+    @property
+    def has_directive(self) -> bool:
+        return self.namespace is not None or self.multi_effect
+
+    @property
+    def cache_key(self) -> Tuple[str, str | None, bool]:
+        return self.canonical, self.namespace, self.multi_effect
+
+
+class QueryAnalyzer:
+    def __init__(self, directive_keyword: str) -> None:
+        self.directive_keyword = directive_keyword
+        keyword = re.escape(directive_keyword)
+        # The bare keyword is case-sensitive, the "namespace <keyword>" form is not.
+        self._directive_pattern = (
+            re.compile(rf"(?:{keyword}|(?i:namespace {keyword}))\s*(?:[:：]\s*)?") if directive_keyword else None
+        )
+
+    def analyze(self, raw: str) -> AnalyzedQuery:
+        text = normalize_query_text(raw)
+
+        namespace = None
+        match = EFFECT_NAMESPACE_PATTERN.search(text)
+        if match is not None:
+            namespace = match.group(1).lower()
+            text = (text[: match.start()] + text[match.end() :]).strip() or text
+
+        multi_effect = False
+        if self._directive_pattern is not None:
+            directive = self._directive_pattern.match(text)
+            if directive is not None:
+                multi_effect = True
+                text = text[directive.end() :] or self.directive_keyword
+
+        return AnalyzedQuery(
+            raw=raw, text=text, namespace=namespace, multi_effect=multi_effect, canonical=_canonical(text)
+        )
+
+    @staticmethod
+    def resolve_card_names(query: AnalyzedQuery, snapshot: CardSnapshot) -> AnalyzedQuery:
+        """``query`` with ``card_ids`` set when it is (nearly) just a card name; directive queries are left alone."""
+
+        if query.has_directive or snapshot.lexical_index is None:
+            return query
+        card_ids = snapshot.lexical_index.match_card_name(query.text)
+        if not card_ids:
+            return query
+        # Spelled out: dataclasses.replace costs about a third of the name match itself.
+        return AnalyzedQuery(query.raw, query.text, query.namespace, query.multi_effect, query.canonical, tuple(card_ids))
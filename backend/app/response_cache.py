@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .models import ChatResponse
+
+
+def make_context_key(*parts: object) -> int:
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class SemanticResponseCache:
+    """Fixed-capacity nearest-neighbour cache of chat responses keyed on query embeddings.
+
+    Cached query vectors live in one preallocated float32 matrix so a lookup is a
+    single vectorized dot product over the live slots that share the context key.
+    """
+
+    def __init__(self, *, max_entries: int, ttl_seconds: float, threshold: float) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._matrix: np.ndarray | None = None
+        self._context_keys = np.zeros(self.max_entries, dtype=np.int64)
+        self._expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._responses: List[ChatResponse | None] = [None] * self.max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit_vector(embedding: Iterable[float]) -> np.ndarray | None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            return None
+        return vector / norm
+
+    def _ensure_matrix(self, dimensions: int) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[1] != dimensions:
+            # A different embedding size means a different model; older entries are unusable.
+            self._matrix = np.zeros((self.max_entries, dimensions), dtype=np.float32)
+            self._expires_at[:] = 0
+            self._responses = [None] * self.max_entries
+        return self._matrix
+
+    def lookup(self, embedding: Iterable[float], context_key: int) -> Tuple[ChatResponse, float] | None:
+        vector = self._unit_vector(embedding)
+        if vector is None or self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        candidates = np.flatnonzero((self._expires_at > now) & (self._context_keys == context_key))
+        if candidates.size == 0:
+            self.misses += 1
+            return None
+
+        similarities = self._matrix[candidates] @ vector
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.threshold:
+            self.misses += 1
+            return None
+
+        slot = int(candidates[best])
+        response = self._responses[slot]
+        if response is None:
+            self.misses += 1
+            return None
+        self._last_used[slot] = now
+        self.hits += 1
+        return response, similarity
+
+    def store(self, embedding: Iterable[float], context_key: int, response: ChatResponse) -> None:
+        vector = self._unit_vector(embedding)
+        if vector is None:
+            return
+        matrix = self._ensure_matrix(vector.shape[0])
+        now = time.monotonic()
+
+        free_slots = np.flatnonzero(self._expires_at <= now)
+        if free_slots.size:
+            slot = int(free_slots[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self.evictions += 1
+
+        matrix[slot] = vector
+        self._context_keys[slot] = context_key
+        self._expires_at[slot] = now + self.ttl_seconds
+        self._last_used[slot] = now
+        self._responses[slot] = response
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(np.count_nonzero(self._expires_at > time.monotonic())),
+            "capacity": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        self._expires_at[:] = 0
+        self._responses = [None] * self.max_entries
@@ -0,0 +1,71 @@
+"""Pre-encoded JSON for chat responses.
+
+FastAPI turns a returned ``ChatResponse`` into a dict, validates it again
+against ``response_model`` and encodes it with the stdlib ``json`` module. Most of
+that work is spent on the ``CardSummary`` list, whose JSON is already stored per
+card in the ``CardSnapshot`` (``summary_json``). ``encode_chat_response`` splices
+those fragments into the output and encodes only the remaining scalar fields,
+with ``orjson`` (a dependency in requirements.txt; the stdlib encoder is only a
+fallback for environments where it is missing). The bytes are the same document
+FastAPI would produce.
+
+A summary is taken from the snapshot only if it is the snapshot's own object;
+summaries that were copied with changes (or come from an older snapshot through
+the response cache) are serialized on the spot.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List
+
+from fastapi.responses import Response
+
+from .card_store import CardSnapshot
+from .cards import serialize_card_summary
+from .models import ChatResponse, ChatResponseMeta
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _stdlib_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+dumps: Callable[[Any], bytes] = orjson.dumps if orjson is not None else _stdlib_dumps
+
+_META_SCALAR_FIELDS = tuple(name for name in ChatResponseMeta.model_fields if name not in ("cards", "stage_timings"))
+
+
+class PreEncodedJSONResponse(Response):
+    """Sends bytes that already are the JSON body."""
+
+    media_type = "application/json"
+
+
+def _card_fragments(meta: ChatResponseMeta, snapshot: CardSnapshot) -> List[bytes]:
+    fragments: List[bytes] = []
+    for summary in meta.cards:
+        if snapshot.get_card_summary(summary.card_id) is summary:
+            fragment = snapshot.summary_json.get(summary.card_id)
+            if fragment is not None:
+                fragments.append(fragment)
+                continue
+        fragments.append(serialize_card_summary(summary))
+    return fragments
+
+
+def encode_meta(meta: ChatResponseMeta, snapshot: CardSnapshot) -> bytes:
+    fields: Dict[str, Any] = {name: getattr(meta, name) for name in _META_SCALAR_FIELDS}
+    fields["stage_timings"] = (
+        [timing.model_dump(mode="json") for timing in meta.stage_timings] if meta.stage_timings is not None else None
+    )
+    encoded = dumps(fields)
+    return b"".join((encoded[:-1], b',"cards":[', b",".join(_card_fragments(meta, snapshot)), b"]}"))
+
+
+def encode_chat_response(response: ChatResponse, snapshot: CardSnapshot) -> bytes:
+    return b"".join((b'{"answer":', dumps(response.answer), b',"meta":', encode_meta(response.meta, snapshot), b"}"))
@@ -1,50 +1,57 @@
 from __future__ import annotations
+import asyncio
+import hashlib
+import itertools
 import json
 import logging
-import math
 import os
-import re
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple
 import httpx
+import numpy as np
 from fastapi import HTTPException
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from .backpressure import AdaptiveLimiter, LimiterRejected, is_overload
+from .card_query import StructuredQuery
+from .card_store import DEFAULT_CARD_DATA_PATH, CardSnapshot, CardStore
+from .cards import card_documents
+from .conversation import (
+    FOLLOW_UP_EXTEND,
+    FOLLOW_UP_REUSE,
+    ConversationSession,
+    ConversationStore,
+    ConversationTurn,
+    detect_follow_up,
+)
+from .embedding_cache import EmbeddingCache
+from .fallback_policy import SpeculativeFallbackPolicy
+from .lexical_index import reciprocal_rank_fusion
+from .metrics import (
+    CACHE_ENTRIES,
+    CACHE_EVENTS,
+    CHAT_DURATION,
+    FALLBACKS,
+    SPECULATIVE_FALLBACKS,
+    STAGE_ERRORS,
+    UPSTASH_RESPONSES,
+    record_stage,
+    stage_timer,
+)
+from .local_index import LocalVectorIndex
 from .models import ChatMessage, ChatResponse, ChatResponseMeta, CardSummary
+from .query_analyzer import EFFECT_NAMESPACE_PATTERN, AnalyzedQuery, QueryAnalyzer, canonical_query_text
+from .response_cache import SemanticResponseCache, make_context_key
+from .shared_cache import SharedCache
+from .single_flight import SingleFlight
+from .token_budget import MESSAGE_OVERHEAD_TOKENS, TokenCounter, pack_documents, trim_history
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Load card master data
-CARD_MASTER_DATA: Dict[str, dict] = {}
-
-def _load_card_master_data():
-    global CARD_MASTER_DATA
-    try:
-        # Assuming backend/app/services.py is the location, data is in ../../data/data.json
-        base_dir = Path(__file__).resolve().parent.parent.parent
-        data_path = base_dir / "data" / "data.json"
-        
-        if not data_path.exists():
-            logger.warning(f"Card master data not found at {data_path}")
-            return
-
-        with open(data_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            for item in data:
-                if "id" in item:
-                    CARD_MASTER_DATA[str(item["id"])] = item
-        logger.info(f"Loaded {len(CARD_MASTER_DATA)} cards from master data.")
-    except Exception as e:
-        logger.error(f"Failed to load card master data: {e}")
-
-_load_card_master_data()
-
-def get_card_master(card_id: str) -> dict | None:
-    return CARD_MASTER_DATA.get(str(card_id))
-
-
 def _load_effect_namespaces() -> Tuple[str, ...]:
     env_value = os.getenv("EFFECT_NAMESPACE_LIST")
     if env_value:
@@ -67,17 +74,98 @@ def _load_effect_namespaces() -> Tuple[str, ...]:
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+# The embeddings API accepts at most 2048 inputs per request.
+OPENAI_EMBEDDING_BATCH_SIZE = min(int(os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", "2048")), 2048)
 UPSTASH_VECTOR_URL = os.getenv("UPSTASH_VECTOR_URL")
 UPSTASH_VECTOR_TOKEN = os.getenv("UPSTASH_VECTOR_TOKEN")
-CONTEXT_CHAR_LIMIT = int(os.getenv("RAG_CONTEXT_CHAR_LIMIT", "2000"))
+# RAG_CONTEXT_CHAR_LIMIT is the old character cap on the context; card text is about one token per character.
+PROMPT_TOKEN_BUDGET = int(os.getenv("RAG_PROMPT_TOKEN_BUDGET") or os.getenv("RAG_CONTEXT_CHAR_LIMIT") or "1500")
+if not os.getenv("RAG_PROMPT_TOKEN_BUDGET") and os.getenv("RAG_CONTEXT_CHAR_LIMIT"):
+    logger.warning("RAG_CONTEXT_CHAR_LIMIT is deprecated; using it as RAG_PROMPT_TOKEN_BUDGET=%s", PROMPT_TOKEN_BUDGET)
+HISTORY_TOKEN_SHARE = min(max(float(os.getenv("RAG_HISTORY_TOKEN_SHARE", "0.3")), 0.0), 1.0)
 TOP_K = int(os.getenv("RAG_TOP_K", "5"))
 USE_FAKE_RAG = os.getenv("USE_FAKE_RAG", "false").lower() in {"1", "true", "yes"}
-EFFECT_NAMESPACE_PATTERN = re.compile(r"(effect_\d+)", re.IGNORECASE)
+UPSTASH_HTTP2 = os.getenv("UPSTASH_HTTP2", "true").lower() in {"1", "true", "yes"}
+UPSTASH_MAX_CONNECTIONS = int(os.getenv("UPSTASH_MAX_CONNECTIONS", "100"))
+UPSTASH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTASH_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UPSTASH_KEEPALIVE_EXPIRY = float(os.getenv("UPSTASH_KEEPALIVE_EXPIRY", "30"))
+UPSTASH_TIMEOUT = float(os.getenv("UPSTASH_TIMEOUT", "15"))
+UPSTASH_CONNECT_TIMEOUT = float(os.getenv("UPSTASH_CONNECT_TIMEOUT", "5"))
+UPSTASH_POOL_TIMEOUT = float(os.getenv("UPSTASH_POOL_TIMEOUT", "5"))
+EFFECT_NAMESPACE_CONCURRENCY = int(os.getenv("EFFECT_NAMESPACE_CONCURRENCY", "5"))
+EFFECT_NAMESPACE_TIMEOUT = float(os.getenv("EFFECT_NAMESPACE_TIMEOUT", "5"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+# One SQLite file shared by every worker on the host; EMBEDDING_CACHE_PATH is the older name.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH") or os.getenv("EMBEDDING_CACHE_PATH") or None
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97"))
+HISTORY_CONTEXT_TURNS = 5
+CONVERSATION_SESSIONS_ENABLED = os.getenv("CONVERSATION_SESSIONS_ENABLED", "true").lower() in {"1", "true", "yes"}
+CONVERSATION_SESSION_MAX = int(os.getenv("CONVERSATION_SESSION_MAX", "10000"))
+CONVERSATION_SESSION_TTL = float(os.getenv("CONVERSATION_SESSION_TTL", "1800"))
+# Signs the session ids the server issues; set the same value on every worker that shares sessions.
+CONVERSATION_SESSION_SECRET = os.getenv("CONVERSATION_SESSION_SECRET", "")
+# Longer questions are always treated as new questions, never as follow-ups.
+FOLLOW_UP_MAX_CHARS = int(os.getenv("FOLLOW_UP_MAX_CHARS", "24"))
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in {"1", "true", "yes"}
+SPECULATIVE_FALLBACK_MODE = os.getenv("SPECULATIVE_FALLBACK", "off").strip().lower()
+SPECULATIVE_FALLBACK_EMPTY_RATE = float(os.getenv("SPECULATIVE_FALLBACK_EMPTY_RATE", "0.3"))
+SPECULATIVE_FALLBACK_MIN_SAMPLES = int(os.getenv("SPECULATIVE_FALLBACK_MIN_SAMPLES", "20"))
+SPECULATIVE_FALLBACK_DECAY = float(os.getenv("SPECULATIVE_FALLBACK_DECAY", "0.05"))
+STRUCTURED_QUERY_ENABLED = os.getenv("STRUCTURED_QUERY_ENABLED", "true").lower() in {"1", "true", "yes"}
+STRUCTURED_QUERY_LIMIT = int(os.getenv("STRUCTURED_QUERY_LIMIT", "20"))
+STRUCTURED_NAMESPACE_LABEL = "structured"
+LEXICAL_SEARCH_ENABLED = os.getenv("LEXICAL_SEARCH_ENABLED", "true").lower() in {"1", "true", "yes"}
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.6"))
+LEXICAL_NAMESPACE_LABEL = "lexical"
+RAG_RETRIEVAL_BACKEND = os.getenv("RAG_RETRIEVAL_BACKEND", "upstash").strip().lower()
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH") or str(
+    Path(__file__).resolve().parent.parent.parent / "data" / "local_index"
+)
+CARD_DATA_PATH = os.getenv("CARD_DATA_PATH") or str(DEFAULT_CARD_DATA_PATH)
+# Seconds between checks of the card data file for changes; 0 disables the watcher.
+CARD_DATA_WATCH_INTERVAL = float(os.getenv("CARD_DATA_WATCH_INTERVAL", "0"))
+CARD_DATA_REBUILD_RATIO = float(os.getenv("CARD_DATA_REBUILD_RATIO", "0.2"))
+# Decoded cards each worker keeps when CARD_DATA_PATH is a card pack.
+CARD_PACK_CACHE_SIZE = int(os.getenv("CARD_PACK_CACHE_SIZE", "1024"))
+# Time a chat request may take before upstream calls that would not finish in time are shed with 503.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+UPSTREAM_LIMIT_ENABLED = os.getenv("UPSTREAM_LIMIT_ENABLED", "true").lower() in {"1", "true", "yes"}
+UPSTREAM_LIMIT_INITIAL = int(os.getenv("UPSTREAM_LIMIT_INITIAL", "20"))
+UPSTREAM_LIMIT_MIN = int(os.getenv("UPSTREAM_LIMIT_MIN", "2"))
+UPSTREAM_LIMIT_MAX = int(os.getenv("UPSTREAM_LIMIT_MAX", "200"))
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "100"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
 EFFECT_DIRECTIVE_KEYWORD = os.getenv("EFFECT_NAMESPACE_DIRECTIVE", "効果").strip() or "効果"
 EFFECT_MULTI_NAMESPACE_LABEL = "effect_multi"
 EFFECT_NAMESPACE_LIST = _load_effect_namespaces()
+OTHER_NAMESPACE_LABEL = "other"
+_KNOWN_NAMESPACE_LABELS = frozenset({"default", EFFECT_MULTI_NAMESPACE_LABEL, *EFFECT_NAMESPACE_LIST})
 
 SearchDiagnostics = Dict[str, Any]
+
+
+def namespace_label(namespace: str | None) -> str:
+    """Metric label for ``namespace``; any ``effect_N`` typed by a user outside EFFECT_NAMESPACE_LIST is ``other``."""
+
+    label = namespace or "default"
+    return label if label in _KNOWN_NAMESPACE_LABELS else OTHER_NAMESPACE_LABEL
+
+
+query_analyzer = QueryAnalyzer(EFFECT_DIRECTIVE_KEYWORD)
+
+
+# extract_effect_namespace and strip_effect_directive define the directive semantics that
+# QueryAnalyzer implements in one pass; benchmarks.query_analyzer checks the two agree.
 def extract_effect_namespace(text: str) -> tuple[str, str | None]:
     match = EFFECT_NAMESPACE_PATTERN.search(text)
     if not match:
@@ -115,23 +203,257 @@ def strip_effect_directive(text: str) -> tuple[str, bool]:
     return text, False
 
 
+shared_cache: SharedCache | None = (
+    SharedCache(SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES) if SHARED_CACHE_PATH else None
+)
+if shared_cache is not None and not shared_cache.enabled:
+    shared_cache = None
+# Search results are only shared between workers; a per-process copy would duplicate the search single-flight.
+search_cache: SharedCache | None = shared_cache if SEARCH_CACHE_ENABLED else None
+
+if EMBEDDING_CACHE_ENABLED:
+    embedding_cache: EmbeddingCache | None = EmbeddingCache(
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+        ttl_seconds=EMBEDDING_CACHE_TTL,
+        shared=shared_cache,
+    )
+else:
+    embedding_cache = None
+
+if RESPONSE_CACHE_ENABLED:
+    response_cache: SemanticResponseCache | None = SemanticResponseCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESPONSE_CACHE_TTL,
+        threshold=RESPONSE_CACHE_SIMILARITY,
+    )
+else:
+    response_cache = None
+
+if CONVERSATION_SESSIONS_ENABLED:
+    conversation_store: ConversationStore | None = ConversationStore(
+        max_sessions=CONVERSATION_SESSION_MAX,
+        ttl_seconds=CONVERSATION_SESSION_TTL,
+        max_messages=HISTORY_CONTEXT_TURNS,
+        shared=shared_cache,
+        secret=CONVERSATION_SESSION_SECRET.encode("utf-8"),
+    )
+else:
+    conversation_store = None
+
+
+# Identical requests that arrive while the first one is still running share its upstream calls.
+chat_flights: SingleFlight | None = SingleFlight("chat") if SINGLE_FLIGHT_ENABLED else None
+embedding_flights: SingleFlight | None = SingleFlight("embedding") if SINGLE_FLIGHT_ENABLED else None
+search_flights: SingleFlight | None = SingleFlight("search") if SINGLE_FLIGHT_ENABLED else None
+
+
+fallback_policy = SpeculativeFallbackPolicy(
+    mode=SPECULATIVE_FALLBACK_MODE,
+    empty_rate_threshold=SPECULATIVE_FALLBACK_EMPTY_RATE,
+    min_samples=SPECULATIVE_FALLBACK_MIN_SAMPLES,
+    decay=SPECULATIVE_FALLBACK_DECAY,
+)
+if fallback_policy.mode != SPECULATIVE_FALLBACK_MODE:
+    logger.warning("Unknown SPECULATIVE_FALLBACK=%s; speculation disabled", SPECULATIVE_FALLBACK_MODE)
+
+
+# The encoding is loaded on first count; the app's lifespan loads it in a thread before serving.
+token_counter = TokenCounter(OPENAI_CHAT_MODEL)
+
+
+def _upstream_limiter(upstream: str) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        upstream,
+        initial_limit=UPSTREAM_LIMIT_INITIAL,
+        min_limit=UPSTREAM_LIMIT_MIN,
+        max_limit=UPSTREAM_LIMIT_MAX,
+        max_queue=UPSTREAM_QUEUE_SIZE,
+        max_retries=UPSTREAM_MAX_RETRIES,
+        retry_base_delay=UPSTREAM_RETRY_BASE_DELAY,
+        enabled=UPSTREAM_LIMIT_ENABLED,
+    )
+
+
+# One adaptive concurrency limit per upstream service; retries of transient failures go through them too.
+embedding_limiter = _upstream_limiter("openai_embeddings")
+search_limiter = _upstream_limiter("upstash")
+chat_limiter = _upstream_limiter("openai_chat")
+
+
+async def get_cache_stats() -> Dict[str, Any]:
+    return {
+        "embedding": embedding_cache.stats() if embedding_cache else None,
+        "response": response_cache.stats() if response_cache else None,
+        # Reads the SQLite usage row under the cache lock, so it stays off the event loop.
+        "shared": await shared_cache.astats() if shared_cache else None,
+        "sessions": conversation_store.stats() if conversation_store else None,
+        "single_flight": {
+            flights.stage: flights.stats() for flights in (chat_flights, embedding_flights, search_flights) if flights
+        },
+        "upstream_limits": {
+            limiter.upstream: limiter.stats() for limiter in (embedding_limiter, search_limiter, chat_limiter)
+        }
+        or None,
+        "speculative_fallback": fallback_policy.stats(),
+    }
+
+
+async def refresh_cache_gauges() -> None:
+    for name, stats in (await get_cache_stats()).items():
+        if stats and "entries" in stats:
+            CACHE_ENTRIES.set(stats.get("entries", 0), cache=name)
+
+
+# Card master data and everything derived from it; requests pin card_store.snapshot for their whole run.
+card_store = CardStore(
+    CARD_DATA_PATH,
+    attribute_index=STRUCTURED_QUERY_ENABLED,
+    lexical_index=LEXICAL_SEARCH_ENABLED,
+    lexical_min_coverage=LEXICAL_MIN_COVERAGE,
+    rebuild_ratio=CARD_DATA_REBUILD_RATIO,
+    pack_cache_size=CARD_PACK_CACHE_SIZE,
+)
+card_store.load()
+
+
+def get_card_master(card_id: str) -> dict | None:
+    return card_store.snapshot.get_card_master(card_id)
+
+
+def get_card_summary(card_id: str) -> CardSummary | None:
+    return card_store.snapshot.get_card_summary(card_id)
+
+
+async def reload_card_data() -> Dict[str, Any]:
+    report = await card_store.reload()
+    # Cached answers may quote cards that just changed.
+    if report["result"] == "applied" and response_cache is not None:
+        response_cache.clear()
+    return report
+
+
+async def watch_card_data() -> None:
+    """Reload card data whenever the file changes; runs until cancelled."""
+
+    while True:
+        await card_store.wait_for_change(CARD_DATA_WATCH_INTERVAL)
+        try:
+            await reload_card_data()
+        except Exception as exc:
+            # Keep serving the previous snapshot until the file is fixed.
+            logger.error("Card data reload from %s failed: %s", card_store.path, exc)
+
+
+if RAG_RETRIEVAL_BACKEND == "local":
+    local_vector_index: LocalVectorIndex | None = LocalVectorIndex(LOCAL_INDEX_PATH)
+else:
+    if RAG_RETRIEVAL_BACKEND != "upstash":
+        logger.warning("Unknown RAG_RETRIEVAL_BACKEND=%s. Falling back to upstash.", RAG_RETRIEVAL_BACKEND)
+    local_vector_index = None
+
+
 if OPENAI_API_KEY:
-    openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    # Retries are left to the upstream limiters, which only retry when the request deadline allows.
+    openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 else:
     openai_client = None
 
 
-def _stage_error(stage: str, message: str, *, status_code: int, exc: Exception | None = None) -> HTTPException:
+_upstash_http_client: httpx.AsyncClient | None = None
+
+
+def _create_upstash_http_client() -> httpx.AsyncClient:
+    http2 = UPSTASH_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("UPSTASH_HTTP2 is enabled but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+            http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=UPSTASH_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTASH_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UPSTASH_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            UPSTASH_TIMEOUT,
+            connect=UPSTASH_CONNECT_TIMEOUT,
+            pool=UPSTASH_POOL_TIMEOUT,
+        ),
+    )
+
+
+def get_upstash_http_client() -> httpx.AsyncClient:
+    """Return the app-lifetime Upstash client, creating it lazily outside of the FastAPI lifespan."""
+
+    global _upstash_http_client
+    if _upstash_http_client is None or _upstash_http_client.is_closed:
+        _upstash_http_client = _create_upstash_http_client()
+    return _upstash_http_client
+
+
+async def start_http_clients() -> None:
+    get_upstash_http_client()
+
+
+async def close_http_clients() -> None:
+    global _upstash_http_client
+    if _upstash_http_client is not None:
+        await _upstash_http_client.aclose()
+        _upstash_http_client = None
+
+
+def _stage_error(
+    stage: str,
+    message: str,
+    *,
+    status_code: int,
+    exc: Exception | None = None,
+    headers: Dict[str, str] | None = None,
+) -> HTTPException:
     detail: dict[str, str] = {"stage": stage, "message": message}
+    STAGE_ERRORS.inc(stage=stage)
     if exc is not None:
         detail["upstream_error"] = str(exc)
         logger.error("RAG %s failed: %s", stage, exc)
     else:
         logger.error("RAG %s failed: %s", stage, message)
-    return HTTPException(status_code=status_code, detail=detail)
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+def _upstream_error(stage: str, message: str, exc: Exception, limiter: AdaptiveLimiter) -> HTTPException:
+    """503 with Retry-After when the call was shed or the upstream is overloaded, 502 otherwise."""
+
+    if isinstance(exc, LimiterRejected):
+        message = f"{message}: too many concurrent requests ({exc.reason})"
+        retry_after = exc.retry_after
+    elif is_overload(exc):
+        retry_after = limiter.retry_after()
+    else:
+        return _stage_error(stage, message, status_code=502, exc=exc)
+    return _stage_error(stage, message, status_code=503, exc=exc, headers={"Retry-After": str(retry_after)})
 
 
 async def create_query_embedding(text: str) -> List[float]:
+    if embedding_cache is not None:
+        cached = await embedding_cache.aget(OPENAI_EMBEDDING_MODEL, text)
+        CACHE_EVENTS.inc(cache="embedding", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached.tolist()
+
+    if embedding_flights is None:
+        return await _fetch_query_embedding(text)
+    embedding = await embedding_flights.do(
+        (OPENAI_EMBEDDING_MODEL, canonical_query_text(text)), lambda: _fetch_query_embedding(text)
+    )
+    return list(embedding)
+
+
+async def _fetch_query_embedding(text: str) -> List[float]:
     if not openai_client:
         raise _stage_error(
             "openai_embeddings_config",
@@ -140,19 +462,72 @@ async def create_query_embedding(text: str) -> List[float]:
         )
 
     try:
-        result = await openai_client.embeddings.create(
-            model=OPENAI_EMBEDDING_MODEL,
-            input=text,
-        )
+        with stage_timer("openai_embeddings"):
+            result = await embedding_limiter.call(
+                lambda: openai_client.embeddings.create(
+                    model=OPENAI_EMBEDDING_MODEL,
+                    input=text,
+                )
+            )
     except Exception as exc:
+        raise _upstream_error("openai_embeddings", "Embedding request failed", exc, embedding_limiter) from exc
+
+    embedding = result.data[0].embedding
+    if embedding_cache is not None:
+        await embedding_cache.aput(OPENAI_EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+
+async def create_query_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embed many queries with one embeddings request per OPENAI_EMBEDDING_BATCH_SIZE cache misses."""
+
+    embeddings: List[List[float] | None] = [None] * len(texts)
+    missing: Dict[str, List[int]] = {}
+    for index, text in enumerate(texts):
+        cached = await embedding_cache.aget(OPENAI_EMBEDDING_MODEL, text) if embedding_cache is not None else None
+        if cached is not None:
+            CACHE_EVENTS.inc(cache="embedding", result="hit")
+            embeddings[index] = cached.tolist()
+        else:
+            if embedding_cache is not None:
+                CACHE_EVENTS.inc(cache="embedding", result="miss")
+            missing.setdefault(text, []).append(index)
+
+    if missing and not openai_client:
         raise _stage_error(
-            "openai_embeddings",
-            "Embedding request failed",
-            status_code=502,
-            exc=exc,
-        ) from exc
+            "openai_embeddings_config",
+            "OpenAI API key is not configured",
+            status_code=500,
+        )
+
+    unique_texts = list(missing)
+    for start in range(0, len(unique_texts), OPENAI_EMBEDDING_BATCH_SIZE):
+        batch = unique_texts[start : start + OPENAI_EMBEDDING_BATCH_SIZE]
+        try:
+            with stage_timer("openai_embeddings_batch"):
+                result = await embedding_limiter.call(
+                    lambda: openai_client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=batch)
+                )
+        except Exception as exc:
+            raise _upstream_error(
+                "openai_embeddings",
+                f"Batch embedding request failed ({len(batch)} inputs)",
+                exc,
+                embedding_limiter,
+            ) from exc
 
-    return result.data[0].embedding
+        for item in result.data:
+            text = batch[item.index]
+            if embedding_cache is not None:
+                await embedding_cache.aput(OPENAI_EMBEDDING_MODEL, text, item.embedding)
+            for index in missing[text]:
+                embeddings[index] = item.embedding
+    return embeddings  # type: ignore[return-value]
+
+
+def _search_flight_key(embedding: Iterable[float], top_k: int, namespace: str | None) -> Tuple[object, ...]:
+    vector = np.asarray(embedding if isinstance(embedding, np.ndarray) else list(embedding), dtype=np.float32)
+    return namespace or "", top_k, hashlib.blake2b(vector.tobytes(), digest_size=16).digest()
 
 
 async def search_similar_docs(
@@ -160,6 +535,68 @@ async def search_similar_docs(
     top_k: int | None = None,
     namespace: str | None = None,
 ) -> Tuple[List[dict], SearchDiagnostics]:
+    if search_flights is None and search_cache is None:
+        return await _search_similar_docs(embedding, top_k, namespace)
+
+    embedding = list(embedding)
+    key = _search_flight_key(embedding, top_k or TOP_K, namespace)
+    if search_flights is None:
+        return await _cached_search_similar_docs(key, embedding, top_k, namespace)
+
+    docs, diagnostics = await search_flights.do(
+        key, lambda: _cached_search_similar_docs(key, embedding, top_k, namespace)
+    )
+    # Callers annotate diagnostics (e.g. fallback_namespace), so every waiter gets its own copies.
+    return [dict(doc) for doc in docs], dict(diagnostics)
+
+
+def _search_cache_key(flight_key: Tuple[object, ...]) -> bytes:
+    namespace, top_k, vector_digest = flight_key
+    prefix = f"{RAG_RETRIEVAL_BACKEND}\x00{namespace}\x00{top_k}\x00".encode("utf-8")
+    return prefix + vector_digest  # type: ignore[operator]
+
+
+async def _cached_search_similar_docs(
+    flight_key: Tuple[object, ...],
+    embedding: List[float],
+    top_k: int | None,
+    namespace: str | None,
+) -> Tuple[List[dict], SearchDiagnostics]:
+    if search_cache is None:
+        return await _search_similar_docs(embedding, top_k, namespace)
+
+    key = _search_cache_key(flight_key)
+    blob = await search_cache.aget("search", key)
+    CACHE_EVENTS.inc(cache="search", result="hit" if blob is not None else "miss")
+    if blob is not None:
+        docs, diagnostics = json.loads(blob)
+        return docs, diagnostics
+
+    docs, diagnostics = await _search_similar_docs(embedding, top_k, namespace)
+    # Warnings (unknown namespace, unusable matches) may be transient; do not pin them for every worker.
+    if not diagnostics.get("warning"):
+        value = json.dumps([docs, diagnostics], ensure_ascii=False).encode("utf-8")
+        await search_cache.aput("search", key, value, ttl_seconds=SEARCH_CACHE_TTL)
+    return docs, diagnostics
+
+
+async def _search_similar_docs(
+    embedding: Iterable[float],
+    top_k: int | None,
+    namespace: str | None,
+) -> Tuple[List[dict], SearchDiagnostics]:
+    if local_vector_index is not None:
+        try:
+            with stage_timer("local_index_query", namespace=namespace_label(namespace)):
+                return local_vector_index.search(embedding, top_k or TOP_K, namespace)
+        except ValueError as exc:
+            raise _stage_error(
+                "local_index_query",
+                f"Local vector search failed (namespace={namespace or 'default'})",
+                status_code=500,
+                exc=exc,
+            ) from exc
+
     if not UPSTASH_VECTOR_URL or not UPSTASH_VECTOR_TOKEN:
         raise _stage_error(
             "upstash_config",
@@ -189,18 +626,29 @@ async def search_similar_docs(
 
     headers = {"Authorization": f"Bearer {UPSTASH_VECTOR_TOKEN}"}
 
-    async with httpx.AsyncClient(timeout=15) as client:
+    client = get_upstash_http_client()
+
+    async def _query() -> httpx.Response:
         try:
             response = await client.post(query_url, json=payload, headers=headers)
-            diagnostics["upstash_status_code"] = response.status_code
-            response.raise_for_status()
-        except httpx.HTTPError as exc:
-            raise _stage_error(
-                "upstash_query",
-                f"Vector search failed (namespace={namespace or 'default'})",
-                status_code=502,
-                exc=exc,
-            ) from exc
+        except httpx.HTTPError:
+            UPSTASH_RESPONSES.inc(namespace=namespace_label(namespace), status_code="error")
+            raise
+        diagnostics["upstash_status_code"] = response.status_code
+        UPSTASH_RESPONSES.inc(namespace=namespace_label(namespace), status_code=response.status_code)
+        response.raise_for_status()
+        return response
+
+    try:
+        with stage_timer("upstash_query", namespace=namespace_label(namespace)):
+            response = await search_limiter.call(_query)
+    except (httpx.HTTPError, LimiterRejected) as exc:
+        raise _upstream_error(
+            "upstash_query",
+            f"Vector search failed (namespace={namespace or 'default'})",
+            exc,
+            search_limiter,
+        ) from exc
 
     data = response.json()
 
@@ -248,7 +696,7 @@ async def search_similar_docs(
         card_id = metadata.get("card_id")
         if not text:
             continue
-        docs.append({"text": text, "title": title, "card_id": card_id})
+        docs.append({"text": text, "title": title, "card_id": card_id, "score": item.get("score")})
 
     if not docs:
         logger.warning("Upstash returned no usable documents. Raw matches: %s", matches)
@@ -266,11 +714,23 @@ async def search_similar_docs(
     return docs, diagnostics
 
 
-def _per_namespace_top_k(top_k: int | None, namespace_count: int) -> int:
-    effective_top_k = top_k or TOP_K
-    if namespace_count <= 0:
-        return effective_top_k
-    return max(1, math.ceil(effective_top_k / namespace_count))
+def _doc_score(doc: dict) -> float:
+    score = doc.get("score")
+    return float(score) if isinstance(score, (int, float)) else float("-inf")
+
+
+def _merge_docs_by_score(docs: Iterable[dict], limit: int) -> List[dict]:
+    merged: List[dict] = []
+    seen_keys = set()
+    for doc in sorted(docs, key=_doc_score, reverse=True):
+        key = doc.get("card_id") or doc.get("text")
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        merged.append(doc)
+        if len(merged) >= limit:
+            break
+    return merged
 
 
 async def search_effect_namespaces(
@@ -288,14 +748,44 @@ async def search_effect_namespaces(
         diagnostics["warning"] = "no_effect_namespaces_configured"
         return [], diagnostics
 
-    per_namespace_k = _per_namespace_top_k(top_k, len(namespaces))
+    # Every namespace is asked for the full top_k so that the merged global top-k is exact.
+    limit = top_k or TOP_K
+    vector = list(embedding)
+    semaphore = asyncio.Semaphore(max(1, EFFECT_NAMESPACE_CONCURRENCY))
+
+    async def _search_namespace(namespace: str) -> Tuple[List[dict], SearchDiagnostics]:
+        async with semaphore:
+            return await asyncio.wait_for(
+                search_similar_docs(vector, top_k=limit, namespace=namespace),
+                timeout=EFFECT_NAMESPACE_TIMEOUT,
+            )
+
+    with stage_timer("effect_namespace_fanout", namespace=EFFECT_MULTI_NAMESPACE_LABEL):
+        results = await asyncio.gather(
+            *(_search_namespace(namespace) for namespace in namespaces),
+            return_exceptions=True,
+        )
+
     aggregated_docs: List[dict] = []
     nested: List[SearchDiagnostics] = []
     status_codes: List[int] = []
+    failed_namespaces: List[str] = []
     total_raw_matches = 0
 
-    for namespace in namespaces:
-        docs, diag = await search_similar_docs(embedding, top_k=per_namespace_k, namespace=namespace)
+    for namespace, result in zip(namespaces, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                error = f"timeout after {EFFECT_NAMESPACE_TIMEOUT}s"
+            elif isinstance(result, HTTPException):
+                error = str(result.detail)
+            else:
+                error = repr(result)
+            logger.warning("Effect namespace search degraded namespace=%s error=%s", namespace, error)
+            failed_namespaces.append(namespace)
+            nested.append({"namespace": namespace, "error": error})
+            continue
+
+        docs, diag = result
         aggregated_docs.extend(docs)
         total_raw_matches += diag.get("raw_match_count", 0) or 0
         nested.append(
@@ -309,41 +799,27 @@ async def search_effect_namespaces(
         if status_code is not None:
             status_codes.append(status_code)
 
+    merged_docs = _merge_docs_by_score(aggregated_docs, limit)
+
     diagnostics["raw_match_count"] = total_raw_matches
-    diagnostics["usable_doc_count"] = len(aggregated_docs)
+    diagnostics["usable_doc_count"] = len(merged_docs)
     diagnostics["effect_namespace_results"] = nested
     if status_codes:
         diagnostics["upstash_status_code"] = status_codes[-1]
         diagnostics["upstash_status_codes"] = status_codes
+    if failed_namespaces:
+        diagnostics["failed_effect_namespaces"] = failed_namespaces
+        diagnostics["warning"] = "effect_namespace_failures=" + ",".join(failed_namespaces)
 
-    limit = top_k or TOP_K
-    if len(aggregated_docs) > limit:
-        aggregated_docs = aggregated_docs[:limit]
-
-    return aggregated_docs, diagnostics
-
+    return merged_docs, diagnostics
 
-def build_context_text(docs: List[dict]) -> str:
-    text_chunks = [doc["text"].strip() for doc in docs if doc.get("text")]
-    context = "\n\n".join(chunk for chunk in text_chunks if chunk)
-    if CONTEXT_CHAR_LIMIT and len(context) > CONTEXT_CHAR_LIMIT:
-        return context[:CONTEXT_CHAR_LIMIT]
-    return context
 
-
-async def generate_answer(
+def _build_answer_messages(
     query: str,
     context: str,
     history: List[ChatMessage] | None,
     titles: List[str] | None,
-) -> str:
-    if not openai_client:
-        raise _stage_error(
-            "openai_chat_config",
-            "OpenAI API key is not configured",
-            status_code=500,
-        )
-
+) -> List[dict]:
     system_prompt = (
         "あなたはカードゲームの攻略アシスタントです。"
         "与えられた参考情報の範囲で、簡潔に（200文字以内を目安）で回答してください。"
@@ -355,7 +831,7 @@ async def generate_answer(
     ]
 
     if history:
-        for message in history[-5:]:
+        for message in history[-HISTORY_CONTEXT_TURNS:]:
             messages.append({"role": message.role, "content": message.content})
 
     supplemental = []
@@ -368,114 +844,489 @@ async def generate_answer(
 
     user_content = "\n\n".join(supplemental) + "\n\n質問: " + query
     messages.append({"role": "user", "content": user_content})
+    return messages
 
-    try:
-        completion = await openai_client.chat.completions.create(
-            model=OPENAI_CHAT_MODEL,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=400,
+
+def _title_line(titles: List[str] | None) -> str | None:
+    if not titles:
+        return None
+    return "候補タイトル: " + ", ".join(titles)
+
+
+async def generate_answer(
+    query: str,
+    context: str,
+    history: List[ChatMessage] | None,
+    titles: List[str] | None,
+) -> str:
+    if not openai_client:
+        raise _stage_error(
+            "openai_chat_config",
+            "OpenAI API key is not configured",
+            status_code=500,
         )
+
+    messages = _build_answer_messages(query, context, history, titles)
+
+    try:
+        with stage_timer("openai_chat"):
+            completion = await chat_limiter.call(
+                lambda: openai_client.chat.completions.create(
+                    model=OPENAI_CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=400,
+                )
+            )
     except Exception as exc:
-        raise _stage_error(
-            "openai_chat",
-            "Answer generation failed",
-            status_code=502,
-            exc=exc,
-        ) from exc
+        raise _upstream_error("openai_chat", "Answer generation failed", exc, chat_limiter) from exc
 
     answer_text = completion.choices[0].message.content or ""
-    if titles:
-        title_line = "候補タイトル: " + ", ".join(titles)
+    title_line = _title_line(titles)
+    if title_line:
         return f"{title_line}\n\n{answer_text}".strip()
     return answer_text
 
 
-async def chat(query: str, history: List[ChatMessage] | None) -> ChatResponse:
-    if USE_FAKE_RAG:
-        return _fake_chat(query, history)
+async def stream_answer(
+    query: str,
+    context: str,
+    history: List[ChatMessage] | None,
+    titles: List[str] | None,
+) -> AsyncIterator[str]:
+    """Yield the answer in chunks; the joined (and stripped) chunks equal generate_answer's result."""
+
+    if not openai_client:
+        raise _stage_error(
+            "openai_chat_config",
+            "OpenAI API key is not configured",
+            status_code=500,
+        )
+
+    messages = _build_answer_messages(query, context, history, titles)
 
+    title_line = _title_line(titles)
+    if title_line:
+        yield f"{title_line}\n\n"
+
+    started = time.perf_counter()
+    first_token_recorded = False
     try:
-        cleaned_query, namespace = extract_effect_namespace(query)
-        cleaned_query, multi_effect_directive = strip_effect_directive(cleaned_query)
-        embedding = await create_query_embedding(cleaned_query)
+        # The slot is held for the whole stream; chunks already sent cannot be retried.
+        async with chat_limiter.acquire():
+            stream = await openai_client.chat.completions.create(
+                model=OPENAI_CHAT_MODEL,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=400,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not first_token_recorded:
+                        first_token_recorded = True
+                        record_stage("openai_chat_first_token", time.perf_counter() - started)
+                    yield delta
+        record_stage("openai_chat_stream", time.perf_counter() - started)
+    except Exception as exc:
+        raise _upstream_error("openai_chat", "Answer generation failed", exc, chat_limiter) from exc
+
+
+@dataclass
+class PreparedChat:
+    """Everything chat() knows once retrieval is done and only the answer is missing."""
+
+    query: str
+    history: List[ChatMessage] | None
+    cache_context_key: int
+    snapshot: CardSnapshot
+    embedding: List[float] | None = None
+    docs: List[dict] = field(default_factory=list)
+    diagnostics: SearchDiagnostics = field(default_factory=dict)
+    context_text: str = ""
+    context_doc_count: int = 0
+    prompt_history: List[ChatMessage] = field(default_factory=list)
+    context_tokens: int = 0
+    history_tokens: int = 0
+    prompt_tokens: int = 0
+    titles: List[str] = field(default_factory=list)
+    card_summaries: List[CardSummary] = field(default_factory=list)
+    cached_response: ChatResponse | None = None
+    session_id: str | None = None
+    follow_up: str | None = None
+    # What the session remembers of this turn once it is answered (docs are filled in then).
+    turn: ConversationTurn | None = None
+
+    def build_meta(self) -> ChatResponseMeta:
+        return ChatResponseMeta(
+            used_context_count=self.context_doc_count,
+            matched_titles=self.titles,
+            used_namespace=self.diagnostics.get("namespace"),
+            fallback_namespace=self.diagnostics.get("fallback_namespace"),
+            raw_match_count=self.diagnostics.get("raw_match_count"),
+            upstash_status_code=self.diagnostics.get("upstash_status_code"),
+            upstash_error=self.diagnostics.get("warning"),
+            cards=self.card_summaries,
+            context_tokens=self.context_tokens,
+            history_tokens=self.history_tokens,
+            prompt_tokens=self.prompt_tokens,
+            session_id=self.session_id,
+            follow_up=self.follow_up,
+        )
+
+    @property
+    def retrieval_path(self) -> str:
+        """Coarse label of how retrieval was answered, used to break latency metrics down."""
+
+        if self.cached_response is not None:
+            return "response_cache"
+        if self.diagnostics.get("fallback_namespace"):
+            return "fallback"
+        return str(self.diagnostics.get("retrieval") or "vector")
+
+
+def _attach_retrieval(prepared: PreparedChat, docs: List[dict], diagnostics: SearchDiagnostics) -> PreparedChat:
+    with stage_timer("context_assembly", path=str(diagnostics.get("retrieval") or "vector")):
+        return _assemble_context(prepared, docs, diagnostics)
+
+
+def _assemble_context(prepared: PreparedChat, docs: List[dict], diagnostics: SearchDiagnostics) -> PreparedChat:
+    card_summaries: List[CardSummary] = []
+    seen_card_ids = set()
+    for doc in docs:
+        c_id = doc.get("card_id")
+        if c_id and c_id not in seen_card_ids:
+            summary = prepared.snapshot.get_card_summary(c_id)
+            if summary:
+                seen_card_ids.add(c_id)
+                if not summary.effect and doc.get("text"):
+                    summary = summary.model_copy(update={"effect": doc["text"]})
+                card_summaries.append(summary)
+
+    # History and documents share one prompt budget; history is capped at its share and docs get the rest.
+    history_budget = int(PROMPT_TOKEN_BUDGET * HISTORY_TOKEN_SHARE)
+    prompt_history, history_tokens = trim_history(
+        (prepared.history or [])[-HISTORY_CONTEXT_TURNS:], history_budget, token_counter
+    )
+    packed = pack_documents(docs, PROMPT_TOKEN_BUDGET - history_tokens, token_counter)
+    if packed.dropped_count or packed.duplicate_count:
+        diagnostics["context_dropped_docs"] = packed.dropped_count
+        diagnostics["context_duplicate_docs"] = packed.duplicate_count
+
+    prepared.docs = docs
+    prepared.diagnostics = diagnostics
+    prepared.context_text = packed.text
+    prepared.context_doc_count = len(packed.docs)
+    prepared.prompt_history = prompt_history
+    prepared.context_tokens = packed.tokens
+    prepared.history_tokens = history_tokens
+    # Only titles of documents that made it into the prompt; the model cannot ground answers in the rest.
+    prepared.titles = [doc.get("title") for doc in packed.docs if doc.get("title")]
+    prepared.card_summaries = card_summaries
+    prepared.prompt_tokens = sum(
+        token_counter.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        for message in _build_answer_messages(prepared.query, packed.text, prompt_history, prepared.titles)
+    )
+    return prepared
+
+
+def _card_docs(
+    snapshot: CardSnapshot, card_ids: Iterable[str], scores: Iterable[float] | None = None
+) -> List[dict]:
+    docs: List[dict] = []
+    for card_id, score in zip(card_ids, scores if scores is not None else itertools.repeat(None)):
+        master = snapshot.get_card_master(card_id)
+        if master:
+            _, doc = next(card_documents(master))
+            doc["score"] = score
+            docs.append(doc)
+    return docs
+
+
+def search_structured_cards(
+    structured: StructuredQuery, snapshot: CardSnapshot
+) -> Tuple[List[dict], SearchDiagnostics]:
+    index = snapshot.attribute_index
+    card_ids = index.filter(structured) if index is not None else []
+    docs = _card_docs(snapshot, card_ids[:STRUCTURED_QUERY_LIMIT])
+
+    diagnostics: SearchDiagnostics = {
+        "namespace": STRUCTURED_NAMESPACE_LABEL,
+        "payload_top_k": STRUCTURED_QUERY_LIMIT,
+        "structured_filters": structured.describe(),
+        "raw_match_count": len(card_ids),
+        "usable_doc_count": len(docs),
+    }
+    if not docs:
+        diagnostics["warning"] = "no_structured_matches"
+    logger.info("Structured search filters=%s matched=%s", diagnostics["structured_filters"], len(card_ids))
+    return docs, diagnostics
+
+
+def search_card_names(card_ids: List[str], snapshot: CardSnapshot) -> Tuple[List[dict], SearchDiagnostics]:
+    docs = _card_docs(snapshot, card_ids[:TOP_K])
+    diagnostics: SearchDiagnostics = {
+        "namespace": LEXICAL_NAMESPACE_LABEL,
+        "payload_top_k": TOP_K,
+        "raw_match_count": len(card_ids),
+        "usable_doc_count": len(docs),
+    }
+    logger.info("Card name match card_ids=%s", card_ids[:TOP_K])
+    return docs, diagnostics
+
+
+def fuse_lexical_results(
+    query: str,
+    docs: List[dict],
+    diagnostics: SearchDiagnostics,
+    snapshot: CardSnapshot,
+) -> Tuple[List[dict], SearchDiagnostics]:
+    if snapshot.lexical_index is None:
+        return docs, diagnostics
+    hits = snapshot.lexical_index.search(query, TOP_K)
+    if not hits:
+        return docs, diagnostics
+
+    lexical_docs = _card_docs(snapshot, (card_id for card_id, _ in hits), (score for _, score in hits))
+    fused = reciprocal_rank_fusion([docs, lexical_docs], limit=TOP_K)
+    diagnostics["retrieval"] = "hybrid"
+    diagnostics["lexical_match_count"] = len(lexical_docs)
+    diagnostics["usable_doc_count"] = len(fused)
+    return fused, diagnostics
+
+
+async def _timed_search(
+    search: Callable[[], Awaitable[Tuple[List[dict], SearchDiagnostics]]], namespace: str, path: str
+) -> Tuple[List[dict], SearchDiagnostics]:
+    with stage_timer("vector_search", namespace=namespace_label(namespace), path=path):
+        return await search()
+
+
+def _abandon(task: asyncio.Task[Any]) -> None:
+    """Cancel ``task`` without waiting for it; an exception it ends with anyway is marked retrieved."""
+
+    task.cancel()
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def search_with_fallback(
+    embedding: List[float],
+    label: str,
+    targeted: Callable[[], Awaitable[Tuple[List[dict], SearchDiagnostics]]],
+) -> Tuple[List[dict], SearchDiagnostics]:
+    """Run a namespaced search and fall back to the default namespace when it finds nothing.
+
+    When the fallback policy says so, the default-namespace search starts at the same
+    time as the targeted one and is cancelled if the targeted search returns docs.
+    """
+
+    def _default_search() -> Awaitable[Tuple[List[dict], SearchDiagnostics]]:
+        return search_similar_docs(embedding, namespace=None)
+
+    # Namespaces outside EFFECT_NAMESPACE_LIST share one policy entry, so user-typed effect_N cannot grow it.
+    bucket = namespace_label(label)
+    speculative: asyncio.Task[Tuple[List[dict], SearchDiagnostics]] | None = None
+    if fallback_policy.should_speculate(bucket):
+        speculative = asyncio.create_task(_timed_search(_default_search, "default", "speculative"))
+
+    try:
+        docs, diagnostics = await _timed_search(targeted, label, "primary")
+    except BaseException:
+        if speculative is not None:
+            _abandon(speculative)
+        raise
+    fallback_policy.record(bucket, empty=not docs)
+
+    if docs:
+        if speculative is not None:
+            _abandon(speculative)
+            SPECULATIVE_FALLBACKS.inc(from_namespace=bucket, outcome="cancelled")
+        return docs, diagnostics
+
+    FALLBACKS.inc(from_namespace=bucket)
+    if speculative is not None:
+        SPECULATIVE_FALLBACKS.inc(from_namespace=bucket, outcome="used")
+        fallback_docs, fallback_diag = await speculative
+        fallback_diag["speculative_fallback"] = True
+    else:
+        fallback_docs, fallback_diag = await _timed_search(_default_search, "default", "fallback")
+    fallback_diag["fallback_namespace"] = label
+    return fallback_docs, fallback_diag
+
+
+def _fast_path_retrieval(query: AnalyzedQuery, snapshot: CardSnapshot) -> Tuple[List[dict], SearchDiagnostics] | None:
+    """Retrieval that needs no embedding, or None when the query has to go through vector search.
+
+    ``query`` must have gone through ``resolve_card_names`` against ``snapshot``.
+    """
+
+    if query.has_directive:
+        return None
+
+    # Pure attribute filters ("コスト2のフォロワー") are answered from master data without embeddings.
+    if snapshot.attribute_index is not None:
+        with stage_timer("structured_filter"):
+            structured = snapshot.attribute_index.parse(query.text)
+            if structured.fully_structured:
+                return search_structured_cards(structured, snapshot)
+
+    # A question that is (nearly) just a card name needs no embedding to find that card.
+    if query.card_ids:
+        return search_card_names(list(query.card_ids), snapshot)
+    return None
+
+
+def _analyze_query(query: str, snapshot: CardSnapshot, analyzed: AnalyzedQuery | None = None) -> AnalyzedQuery:
+    if analyzed is None:
+        with stage_timer("query_parse"):
+            analyzed = query_analyzer.analyze(query)
+    if snapshot.lexical_index is not None:
+        with stage_timer("lexical_name_match"):
+            analyzed = query_analyzer.resolve_card_names(analyzed, snapshot)
+    return analyzed
+
+
+async def extend_previous_search(
+    previous: ConversationTurn, embedding: List[float]
+) -> Tuple[List[dict], SearchDiagnostics]:
+    """Re-run the previous turn's vector search deeper and keep only cards the conversation has not shown."""
+
+    shown = set(previous.shown_card_ids)
+    namespace = previous.namespace
+    with stage_timer("vector_search", namespace=namespace_label(namespace), path="session_extend"):
+        docs, diagnostics = await search_similar_docs(embedding, top_k=TOP_K + len(shown), namespace=namespace)
+    fresh = [doc for doc in docs if doc.get("card_id") not in shown][:TOP_K]
+    diagnostics["retrieval"] = "session_extend"
+    diagnostics["session_excluded_cards"] = len(shown)
+    diagnostics["usable_doc_count"] = len(fresh)
+    return fresh, diagnostics
+
+
+def _reuse_previous_retrieval(previous: ConversationTurn) -> Tuple[List[dict], SearchDiagnostics]:
+    docs = [dict(doc) for doc in previous.docs]
+    return docs, {
+        "namespace": previous.namespace or "default",
+        "retrieval": "session_reuse",
+        "raw_match_count": len(docs),
+        "usable_doc_count": len(docs),
+    }
+
+
+def embedding_text_for(query: str) -> str | None:
+    """The text prepare_chat() would embed for ``query``, or None if it is answered without one."""
+
+    snapshot = card_store.snapshot
+    analyzed = _analyze_query(query, snapshot)
+    if _fast_path_retrieval(analyzed, snapshot) is not None:
+        return None
+    return analyzed.text
+
+
+async def prepare_chat(
+    query: str,
+    history: List[ChatMessage] | None,
+    *,
+    embedding: List[float] | None = None,
+    session: ConversationSession | None = None,
+    analyzed: AnalyzedQuery | None = None,
+) -> PreparedChat:
+    """Run retrieval for ``query``; ``embedding`` may carry a precomputed query embedding (batch mode).
+
+    With a ``session``, follow-up questions reuse or extend the previous turn's retrieval. ``analyzed``
+    is ``query`` already run through ``query_analyzer.analyze``, if the caller has it.
+    """
+
+    try:
+        snapshot = card_store.snapshot
+        analyzed = _analyze_query(query, snapshot, analyzed)
+        cleaned_query, namespace, multi_effect_directive = analyzed.text, analyzed.namespace, analyzed.multi_effect
+        prepared = PreparedChat(
+            query=query,
+            history=history,
+            cache_context_key=make_context_key(
+                namespace,
+                multi_effect_directive,
+                tuple((message.role, message.content) for message in (history or [])[-HISTORY_CONTEXT_TURNS:]),
+            ),
+            snapshot=snapshot,
+            session_id=session.session_id if session is not None else None,
+            turn=ConversationTurn(query=cleaned_query, namespace=namespace),
+        )
+
+        fast_path = _fast_path_retrieval(analyzed, snapshot)
+        if fast_path is not None:
+            return _attach_retrieval(prepared, *fast_path)
+
+        previous = session.last_turn if session is not None else None
+        follow_up = (
+            None
+            if namespace or multi_effect_directive
+            else detect_follow_up(cleaned_query, previous, FOLLOW_UP_MAX_CHARS)
+        )
+        if previous is not None and follow_up is not None:
+            # The conversation stays on the previous topic, so later follow-ups keep referring to it.
+            prepared.follow_up = follow_up
+            prepared.turn = ConversationTurn(
+                query=previous.query,
+                namespace=previous.namespace,
+                embedding=previous.embedding,
+                shown_card_ids=list(previous.shown_card_ids),
+            )
+            if follow_up == FOLLOW_UP_REUSE:
+                return _attach_retrieval(prepared, *_reuse_previous_retrieval(previous))
+            if follow_up == FOLLOW_UP_EXTEND:
+                if prepared.turn.embedding is None:
+                    # The previous turn was answered without vector search; embed its topic instead.
+                    prepared.turn.embedding = await create_query_embedding(previous.query)
+                return _attach_retrieval(prepared, *await extend_previous_search(previous, prepared.turn.embedding))
+
+        if embedding is None:
+            embedding = await create_query_embedding(cleaned_query)
+        prepared.embedding = embedding
+        prepared.turn.embedding = embedding
+
+        if response_cache is not None:
+            with stage_timer("response_cache_lookup"):
+                cached = response_cache.lookup(embedding, prepared.cache_context_key)
+            CACHE_EVENTS.inc(cache="response", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                cached_response, similarity = cached
+                prepared.cached_response = cached_response.model_copy(
+                    update={
+                        "meta": cached_response.meta.model_copy(
+                            update={
+                                "cache_hit": True,
+                                "cache_similarity": round(similarity, 4),
+                                "session_id": prepared.session_id,
+                                "follow_up": None,
+                            }
+                        )
+                    }
+                )
+                return prepared
 
         docs: List[dict]
         diagnostics: SearchDiagnostics
 
         if namespace:
-            docs, diagnostics = await search_similar_docs(embedding, namespace=namespace)
-            if not docs:
-                fallback_docs, fallback_diag = await search_similar_docs(embedding, namespace=None)
-                fallback_diag["fallback_namespace"] = namespace
-                docs = fallback_docs
-                diagnostics = fallback_diag
+            docs, diagnostics = await search_with_fallback(
+                embedding, namespace, lambda: search_similar_docs(embedding, namespace=namespace)
+            )
         else:
             if multi_effect_directive:
-                docs, diagnostics = await search_effect_namespaces(embedding)
-                if not docs:
-                    fallback_docs, fallback_diag = await search_similar_docs(embedding, namespace=None)
-                    fallback_diag["fallback_namespace"] = EFFECT_MULTI_NAMESPACE_LABEL
-                    docs = fallback_docs
-                    diagnostics = fallback_diag
+                docs, diagnostics = await search_with_fallback(
+                    embedding, EFFECT_MULTI_NAMESPACE_LABEL, lambda: search_effect_namespaces(embedding)
+                )
             else:
-                docs, diagnostics = await search_similar_docs(embedding, namespace=None)
-
-        context_text = build_context_text(docs)
-        titles = [doc.get("title") for doc in docs if doc.get("title")]
-        
-        # Build card summaries
-        card_summaries: List[CardSummary] = []
-        seen_card_ids = set()
-        
-        for doc in docs:
-            c_id = doc.get("card_id")
-            if c_id and c_id not in seen_card_ids:
-                master = get_card_master(c_id)
-                if master:
-                    seen_card_ids.add(c_id)
-                    
-                    # Collect all effect_N fields
-                    effects_list = []
-                    for k, v in master.items():
-                        if k.startswith("effect_") and v:
-                            try:
-                                idx = int(k.split("_")[1])
-                                effects_list.append((idx, v))
-                            except ValueError:
-                                pass
-                    effects_list.sort(key=lambda x: x[0])
-                    sorted_effects = [val for _, val in effects_list]
-
-                    card_summaries.append(CardSummary(
-                        card_id=str(c_id),
-                        name=master.get("name", "Unknown"),
-                        class_=master.get("class", "-"),
-                        rarity=master.get("rarity", "-"),
-                        cost=master.get("cost", 0),
-                        attack=master.get("attack", 0),
-                        hp=master.get("hp", 0),
-                        effect=master.get("effect_1") or doc.get("text", ""),
-                        effects=sorted_effects,
-                        keywords=master.get("keywords", []),
-                        image_before=master.get("image_before", ""),
-                        image_after=master.get("image_after", "")
-                    ))
-
-        answer = await generate_answer(query, context_text, history, titles)
-        return ChatResponse(
-            answer=answer,
-            meta=ChatResponseMeta(
-                used_context_count=len(docs),
-                matched_titles=titles,
-                used_namespace=diagnostics.get("namespace"),
-                fallback_namespace=diagnostics.get("fallback_namespace"),
-                raw_match_count=diagnostics.get("raw_match_count"),
-                upstash_status_code=diagnostics.get("upstash_status_code"),
-                upstash_error=diagnostics.get("warning"),
-                cards=card_summaries,
-            ),
-        )
+                with stage_timer("vector_search", namespace="default", path="primary"):
+                    docs, diagnostics = await search_similar_docs(embedding, namespace=None)
+                with stage_timer("lexical_fusion"):
+                    docs, diagnostics = fuse_lexical_results(cleaned_query, docs, diagnostics, prepared.snapshot)
+
+        return _attach_retrieval(prepared, docs, diagnostics)
     except HTTPException:
         raise
     except Exception as exc:
@@ -487,6 +1338,159 @@ async def chat(query: str, history: List[ChatMessage] | None) -> ChatResponse:
         ) from exc
 
 
+def _remember_response(prepared: PreparedChat, response: ChatResponse) -> None:
+    # Degraded retrievals (e.g. failed effect namespaces) are not worth replaying to later users.
+    if response_cache is None or prepared.embedding is None or prepared.diagnostics.get("warning"):
+        return
+    response_cache.store(prepared.embedding, prepared.cache_context_key, response)
+
+
+async def _load_session(session_id: str | None, start_session: bool = False) -> ConversationSession | None:
+    """The session ``session_id`` names, a newly issued one for ``start_session``, or None."""
+
+    if conversation_store is None:
+        return None
+    if session_id is None:
+        return conversation_store.new_session() if start_session else None
+    if not conversation_store.issued(session_id):
+        raise HTTPException(status_code=403, detail="Unknown session_id; send start_session to get a new one")
+    return await conversation_store.load(session_id)
+
+
+async def _record_turn(session: ConversationSession | None, prepared: PreparedChat, response: ChatResponse) -> None:
+    if session is None or conversation_store is None or prepared.turn is None:
+        return
+    turn = prepared.turn
+    docs = prepared.docs
+    if prepared.cached_response is not None:
+        # A cached answer carries its cards but not the docs they were retrieved as.
+        docs = _card_docs(prepared.snapshot, (card.card_id for card in response.meta.cards))
+    turn.docs = docs[:TOP_K]
+    turn.shown_card_ids = list(dict.fromkeys([*turn.shown_card_ids, *turn.card_ids]))
+    session.record(prepared.query, response.answer, turn, conversation_store.max_messages)
+    await conversation_store.save(session)
+
+
+def _chat_flight_key(
+    analyzed: AnalyzedQuery, history: List[ChatMessage] | None, session_id: str | None = None
+) -> Tuple[object, ...]:
+    recent_history = tuple((message.role, message.content) for message in (history or [])[-HISTORY_CONTEXT_TURNS:])
+    # Sessions differ in their previous retrieval and each records its own turn, so they never share a flight.
+    return analyzed.cache_key, recent_history, session_id
+
+
+async def chat(
+    query: str,
+    history: List[ChatMessage] | None,
+    *,
+    embedding: List[float] | None = None,
+    endpoint: str = "chat",
+    session_id: str | None = None,
+    start_session: bool = False,
+) -> ChatResponse:
+    if USE_FAKE_RAG:
+        return _fake_chat(query, history)
+
+    session = await _load_session(session_id, start_session)
+    if session is not None and not history:
+        history = session.messages
+
+    analyzed = query_analyzer.analyze(query)
+
+    def _run() -> Awaitable[ChatResponse]:
+        return _run_chat(query, history, embedding=embedding, endpoint=endpoint, session=session, analyzed=analyzed)
+
+    if chat_flights is None:
+        return await _run()
+    session_key = session.session_id if session is not None else None
+    return await chat_flights.do(_chat_flight_key(analyzed, history, session_key), _run)
+
+
+async def _run_chat(
+    query: str,
+    history: List[ChatMessage] | None,
+    *,
+    embedding: List[float] | None = None,
+    endpoint: str = "chat",
+    session: ConversationSession | None = None,
+    analyzed: AnalyzedQuery | None = None,
+) -> ChatResponse:
+    started = time.perf_counter()
+    prepared = await prepare_chat(query, history, embedding=embedding, session=session, analyzed=analyzed)
+    if prepared.cached_response is not None:
+        await _record_turn(session, prepared, prepared.cached_response)
+        CHAT_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, path=prepared.retrieval_path)
+        return prepared.cached_response
+
+    try:
+        answer = await generate_answer(query, prepared.context_text, prepared.prompt_history, prepared.titles)
+        response = ChatResponse(answer=answer, meta=prepared.build_meta())
+        _remember_response(prepared, response)
+        await _record_turn(session, prepared, response)
+        CHAT_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, path=prepared.retrieval_path)
+        return response
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise _stage_error(
+            "rag_pipeline",
+            "Unexpected error while running the RAG pipeline",
+            status_code=500,
+            exc=exc,
+        ) from exc
+
+
+def _complete_response_events(response: ChatResponse) -> List[Tuple[str, Any]]:
+    return [
+        ("meta", response.meta),
+        ("token", {"delta": response.answer}),
+        ("done", {"answer": response.answer}),
+    ]
+
+
+async def stream_chat(
+    query: str, history: List[ChatMessage] | None, session_id: str | None = None, start_session: bool = False
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Yield ``(event, payload)`` pairs: ``meta`` as soon as retrieval finishes, then ``token`` chunks and ``done``.
+
+    The ``meta`` payload is the ``ChatResponseMeta`` model, so the endpoint can pick its encoding; the others are dicts.
+    """
+
+    if USE_FAKE_RAG:
+        for event in _complete_response_events(_fake_chat(query, history)):
+            yield event
+        return
+
+    started = time.perf_counter()
+    session = await _load_session(session_id, start_session)
+    if session is not None and not history:
+        history = session.messages
+    prepared = await prepare_chat(query, history, session=session)
+    if prepared.cached_response is not None:
+        await _record_turn(session, prepared, prepared.cached_response)
+        CHAT_DURATION.observe(time.perf_counter() - started, endpoint="stream", path=prepared.retrieval_path)
+        for event in _complete_response_events(prepared.cached_response):
+            yield event
+        return
+
+    meta = prepared.build_meta()
+    yield "meta", meta
+
+    chunks: List[str] = []
+    async for delta in stream_answer(query, prepared.context_text, prepared.prompt_history, prepared.titles):
+        chunks.append(delta)
+        yield "token", {"delta": delta}
+
+    answer = "".join(chunks)
+    if prepared.titles:
+        answer = answer.strip()
+    response = ChatResponse(answer=answer, meta=meta)
+    _remember_response(prepared, response)
+    await _record_turn(session, prepared, response)
+    CHAT_DURATION.observe(time.perf_counter() - started, endpoint="stream", path=prepared.retrieval_path)
+    yield "done", {"answer": answer}
+
+
 def _fake_chat(query: str, history: List[ChatMessage] | None) -> ChatResponse:
     """Return a deterministic but helpful-sounding answer without external APIs."""
 
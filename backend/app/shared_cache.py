@@ -0,0 +1,225 @@
+"""Cache tier shared by every worker process on a host, stored in one SQLite WAL file.
+
+Entries are opaque bytes under ``(namespace, key)`` with a TTL. WAL mode lets
+readers in all workers proceed while one writer commits, and ``busy_timeout``
+makes concurrent writers wait instead of failing. The total stored size is kept
+in a one-row table by triggers; once it passes ``max_bytes``, expired entries
+and then the least recently used ones are deleted until usage is back under
+``low_water`` of the limit.
+
+Every method swallows ``sqlite3.Error`` (logged, counted as an error and
+treated as a miss): the cache must never fail a request. The ``a``-prefixed
+coroutines run the blocking calls in ``asyncio.to_thread``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-row bookkeeping (row header, index entries) counted on top of key and value.
+_ENTRY_OVERHEAD_BYTES = 64
+# Hits refresh the LRU timestamp at most this often, so most reads stay read-only.
+_TOUCH_INTERVAL_SECONDS = 30.0
+_EVICTION_BATCH = 256
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache_entries ("
+    " id INTEGER PRIMARY KEY,"
+    " namespace TEXT NOT NULL,"
+    " key BLOB NOT NULL,"
+    " value BLOB NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " expires_at REAL NOT NULL,"
+    " accessed_at REAL NOT NULL,"
+    " UNIQUE (namespace, key))",
+    "CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at)",
+    "CREATE TABLE IF NOT EXISTS cache_usage ("
+    " id INTEGER PRIMARY KEY CHECK (id = 0),"
+    " entries INTEGER NOT NULL,"
+    " bytes INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO cache_usage (id, entries, bytes) VALUES (0, 0, 0)",
+    "CREATE TRIGGER IF NOT EXISTS cache_entries_insert AFTER INSERT ON cache_entries"
+    " BEGIN UPDATE cache_usage SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0; END",
+    "CREATE TRIGGER IF NOT EXISTS cache_entries_update AFTER UPDATE OF size ON cache_entries"
+    " BEGIN UPDATE cache_usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END",
+    "CREATE TRIGGER IF NOT EXISTS cache_entries_delete AFTER DELETE ON cache_entries"
+    " BEGIN UPDATE cache_usage SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0; END",
+)
+
+
+class SharedCache:
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_bytes: int,
+        low_water: float = 0.9,
+        busy_timeout_ms: int = 2000,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = min(max(low_water, 0.0), 1.0)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._pid = 0
+        self.enabled = self._connect() is not None
+
+    def _connect(self) -> sqlite3.Connection | None:
+        # A connection must not cross fork(); workers forked from a preloaded app reopen it.
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("BEGIN IMMEDIATE")
+            for statement in _SCHEMA:
+                db.execute(statement)
+            db.execute("COMMIT")
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("Shared cache disabled (path=%s): %s", self.path, exc)
+            self._db = None
+            return None
+        self._db, self._pid = db, os.getpid()
+        return db
+
+    def _failed(self, operation: str, exc: sqlite3.Error) -> None:
+        self.errors += 1
+        logger.warning("Shared cache %s failed: %s", operation, exc)
+
+    def get(self, namespace: str, key: bytes) -> bytes | None:
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute(
+                    "SELECT id, value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                now = time.time()
+                if row is None or row[2] <= now:
+                    self.misses += 1
+                    return None
+                if row[3] < now - _TOUCH_INTERVAL_SECONDS:
+                    db.execute("UPDATE cache_entries SET accessed_at = ? WHERE id = ?", (now, row[0]))
+            except sqlite3.Error as exc:
+                self._failed("read", exc)
+                return None
+            self.hits += 1
+            return row[1]
+
+    def put(self, namespace: str, key: bytes, value: bytes, *, ttl_seconds: float) -> None:
+        size = len(key) + len(value) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            now = time.time()
+            try:
+                db.execute(
+                    "INSERT INTO cache_entries (namespace, key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+                    " expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                    (namespace, key, value, size, now + ttl_seconds, now),
+                )
+                self.writes += 1
+                if self._used_bytes(db) > self.max_bytes:
+                    self._evict(db, now)
+            except sqlite3.Error as exc:
+                self._failed("write", exc)
+
+    @staticmethod
+    def _usage(db: sqlite3.Connection) -> Tuple[int, int]:
+        entries, used = db.execute("SELECT entries, bytes FROM cache_usage WHERE id = 0").fetchone()
+        return int(entries), int(used)
+
+    def _used_bytes(self, db: sqlite3.Connection) -> int:
+        return self._usage(db)[1]
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        target = int(self.max_bytes * self.low_water)
+        # One write transaction, so workers racing past the limit do not both evict.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self.evictions += db.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,)).rowcount
+            while True:
+                entries, used = self._usage(db)
+                if used <= target:
+                    break
+                deleted = db.execute(
+                    "DELETE FROM cache_entries WHERE id IN"
+                    " (SELECT id FROM cache_entries ORDER BY accessed_at LIMIT ?)",
+                    (max(1, min(_EVICTION_BATCH, entries // 8)),),
+                ).rowcount
+                if deleted <= 0:
+                    break
+                self.evictions += deleted
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+
+    def clear(self, namespace: str | None = None) -> None:
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                if namespace is None:
+                    db.execute("DELETE FROM cache_entries")
+                else:
+                    db.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+            except sqlite3.Error as exc:
+                self._failed("clear", exc)
+
+    def stats(self) -> Dict[str, float]:
+        entries = used = 0
+        with self._lock:
+            db = self._connect()
+            if db is not None:
+                try:
+                    entries, used = self._usage(db)
+                except sqlite3.Error as exc:
+                    self._failed("stats", exc)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def aget(self, namespace: str, key: bytes) -> bytes | None:
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def aput(self, namespace: str, key: bytes, value: bytes, *, ttl_seconds: float) -> None:
+        await asyncio.to_thread(self.put, namespace, key, value, ttl_seconds=ttl_seconds)
+
+    async def astats(self) -> Dict[str, float]:
+        return await asyncio.to_thread(self.stats)
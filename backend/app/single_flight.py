@@ -0,0 +1,77 @@
+"""Single-flight deduplication of identical concurrent upstream calls.
+
+The first caller for a key (the leader) starts the work as its own task; callers
+arriving while it is still running (followers) await the same task instead of
+repeating the call. The key is dropped as soon as the task finishes, so nothing
+is cached beyond the lifetime of the in-flight call. The task is cancelled once
+every caller waiting on it has been cancelled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from .metrics import SINGLE_FLIGHT_CALLS, stage_timer
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self._in_flight: Dict[Hashable, asyncio.Task[Any]] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """Run ``factory`` once per in-flight ``key``.
+
+        Every caller receives the same result object (or exception), so callers
+        must not mutate it.
+        """
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.leaders += 1
+            SINGLE_FLIGHT_CALLS.inc(stage=self.stage, role="leader")
+            return await self._wait(key, task)
+
+        self.followers += 1
+        SINGLE_FLIGHT_CALLS.inc(stage=self.stage, role="follower")
+        with stage_timer("single_flight_wait", path=self.stage):
+            return await self._wait(key, task)
+
+    async def _wait(self, key: Hashable, task: asyncio.Task[T]) -> T:
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Shield so one caller going away does not cancel the call the others are waiting on.
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._in_flight.get(key) is task and self._waiters.get(key) == 1:
+                task.cancel()
+            raise
+        finally:
+            remaining = self._waiters.get(key, 1) - 1
+            if remaining > 0:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+
+    def _forget(self, key: Hashable, task: asyncio.Task[Any]) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even when every waiter has gone away.
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "saved_calls": self.followers,
+        }
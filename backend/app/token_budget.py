@@ -0,0 +1,193 @@
+"""Token-budgeted prompt assembly.
+
+Retrieved documents are packed whole, in relevance order, until the budget is
+spent, instead of joining everything and slicing at a character limit. Repeated
+effect text (the same effect retrieved from ``effect_N`` and the default
+namespace) is only included once. Chat history is trimmed newest-first to its
+share of the same budget.
+
+Token counts use ``tiktoken`` (a dependency in requirements.txt). Its BPE file
+is downloaded on first use and cached under ``TIKTOKEN_CACHE_DIR``; fetch it at
+build time with ``python -m app.token_budget`` for hosts without network access.
+If the encoding still cannot be loaded, counts fall back to an approximate,
+conservative estimate: one token per CJK/kana character or symbol and one per
+four characters of ASCII words.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import sys
+import unicodedata
+from dataclasses import dataclass
+from typing import Callable, List, Sequence, Tuple
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_SEPARATOR = "\n\n"
+TRUNCATION_MARK = "…"
+# Per-message framing overhead of the chat format (role, separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+_MIN_TRUNCATED_MESSAGE_TOKENS = 16
+_ASCII_RUN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    ascii_tokens = 0
+
+    def _ascii_run(match: re.Match[str]) -> str:
+        nonlocal ascii_tokens
+        ascii_tokens += math.ceil(len(match.group(0)) / 4)
+        return ""
+
+    rest = _WHITESPACE_PATTERN.sub("", _ASCII_RUN_PATTERN.sub(_ascii_run, text))
+    return ascii_tokens + len(rest)
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken for ``model``, or with ``estimate_tokens`` when its encoding cannot be loaded.
+
+    The encoding is loaded on first use (or by an explicit ``load()``), since that
+    may download the BPE file; constructing a counter never touches the network.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self._encode: Callable[[str], Sequence[int]] | None = None
+        self._decode: Callable[[Sequence[int]], str] | None = None
+        self._loaded = False
+        self.name = "heuristic"
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            import tiktoken
+        except ImportError:
+            return
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as exc:  # e.g. the BPE file cannot be downloaded
+            logger.warning("tiktoken unavailable for model=%s, using approximate token counts: %s", self.model, exc)
+            return
+        self._encode = encoding.encode_ordinary
+        self._decode = encoding.decode
+        self.name = f"tiktoken:{encoding.name}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        self.load()
+        if self._encode is not None:
+            return len(self._encode(text))
+        return estimate_tokens(text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the beginning of ``text`` within ``max_tokens`` (including the truncation mark)."""
+
+        if self.count(text) <= max_tokens:
+            return text
+        budget = max(0, max_tokens - self.count(TRUNCATION_MARK))
+        if self._encode is not None and self._decode is not None:
+            return self._decode(list(self._encode(text))[:budget]) + TRUNCATION_MARK
+        # Binary search on the character prefix for the estimator.
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(text[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + TRUNCATION_MARK
+
+
+def _dedupe_key(text: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+@dataclass
+class PackedContext:
+    text: str = ""
+    docs: Tuple[dict, ...] = ()
+    tokens: int = 0
+    dropped_count: int = 0
+    duplicate_count: int = 0
+
+
+def pack_documents(docs: Sequence[dict], budget: int, counter: TokenCounter) -> PackedContext:
+    """Greedily add whole documents in the given (relevance) order while they fit in ``budget``."""
+
+    separator_tokens = counter.count(CONTEXT_SEPARATOR)
+    seen = set()
+    chunks: List[str] = []
+    packed: List[dict] = []
+    used = dropped = duplicates = 0
+    for doc in docs:
+        text = (doc.get("text") or "").strip()
+        if not text:
+            continue
+        key = _dedupe_key(text)
+        if key in seen:
+            duplicates += 1
+            continue
+        cost = counter.count(text) + (separator_tokens if chunks else 0)
+        if used + cost > budget:
+            # A shorter, less relevant document may still fit.
+            dropped += 1
+            continue
+        seen.add(key)
+        chunks.append(text)
+        packed.append(doc)
+        used += cost
+    return PackedContext(
+        text=CONTEXT_SEPARATOR.join(chunks),
+        docs=tuple(packed),
+        tokens=used,
+        dropped_count=dropped,
+        duplicate_count=duplicates,
+    )
+
+
+def trim_history(
+    history: Sequence[ChatMessage], budget: int, counter: TokenCounter
+) -> Tuple[List[ChatMessage], int]:
+    """Keep the most recent messages that fit in ``budget``; the oldest kept one may be truncated."""
+
+    kept: List[ChatMessage] = []
+    used = 0
+    for message in reversed(history):
+        cost = counter.count(message.content) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost <= budget:
+            kept.append(message)
+            used += cost
+            continue
+        remaining = budget - used - MESSAGE_OVERHEAD_TOKENS
+        if remaining >= _MIN_TRUNCATED_MESSAGE_TOKENS:
+            content = counter.truncate(message.content, remaining)
+            kept.append(message.model_copy(update={"content": content}))
+            used += counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+        break
+    kept.reverse()
+    return kept, used
+
+
+def main() -> None:
+    # Loads (and so downloads and caches) the encoding for OPENAI_CHAT_MODEL.
+    counter = TokenCounter(os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini"))
+    counter.load()
+    print(f"model={counter.model} counter={counter.name}")
+    sys.exit(0 if counter.name != "heuristic" else 1)
+
+
+if __name__ == "__main__":
+    main()
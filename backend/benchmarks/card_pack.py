@@ -0,0 +1,170 @@
+"""Cold-start time and per-worker memory: data.json versus a compiled card pack.
+
+Run from ``backend/``::
+
+    python -m benchmarks.card_pack --scales 1,10
+
+For each scale the cards in ``data/data.json`` are replicated (ids and names
+suffixed) into a temporary directory and compiled with ``app.card_pack``. Every
+measurement loads a ``CardStore`` in a fresh child process, as a uvicorn worker
+would, with and without the attribute/lexical indexes, and reports:
+
+* ``load``: time for ``CardStore.load()`` (parse or map, summaries, indexes)
+* ``anon``: growth of private anonymous memory (``RssAnon``), paid by every worker
+* ``file``: growth of file-backed resident pages (``RssFile``), shared by all workers
+  through the page cache
+* ``first``: mean ``get_card_master`` + ``get_card_summary`` time for the first
+  lookup of a card (a pack decodes the card and validates its summary then)
+* ``lookup``: the same for cards looked up before
+
+Memory columns need Linux ``/proc``; elsewhere only ``ru_maxrss`` is reported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+_BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def _memory_kb() -> Dict[str, int]:
+    usage: Dict[str, int] = {"maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("RssAnon", "RssFile"):
+                    usage[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def _child(path: str, indexes: bool) -> None:
+    from app.card_store import CardStore
+
+    gc.collect()
+    before = _memory_kb()
+    started = time.perf_counter()
+    store = CardStore(path, attribute_index=indexes, lexical_index=indexes)
+    snapshot = store.load()
+    load_ms = (time.perf_counter() - started) * 1000
+    gc.collect()
+    after = _memory_kb()
+
+    card_ids = list(snapshot.cards)[:1000]
+    random.Random(0).shuffle(card_ids)
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        for card_id in card_ids:
+            snapshot.get_card_master(card_id)
+            snapshot.get_card_summary(card_id)
+        timings.append((time.perf_counter() - started) / len(card_ids) * 1e6)
+    first_us, lookup_us = timings
+
+    print(
+        json.dumps(
+            {
+                "cards": len(snapshot.cards),
+                "load_ms": load_ms,
+                "first_us": first_us,
+                "lookup_us": lookup_us,
+                **{f"{key}_kb": after[key] - before[key] for key in after if key != "maxrss"},
+                "maxrss_kb": after["maxrss"],
+            }
+        )
+    )
+
+
+def _scaled_cards(cards: List[dict], scale: int) -> List[dict]:
+    scaled: List[dict] = []
+    for copy_index in range(scale):
+        for card in cards:
+            if copy_index == 0:
+                scaled.append(card)
+                continue
+            suffix = f"-{copy_index}"
+            scaled.append(dict(card, id=f"{card['id']}{suffix}", name=f"{card.get('name', '')}{suffix}"))
+    return scaled
+
+
+def _measure(path: Path, indexes: bool, repeat: int) -> Dict[str, float]:
+    runs: List[Dict[str, float]] = []
+    for _ in range(repeat):
+        command = [sys.executable, "-m", "benchmarks.card_pack", "--child", str(path)]
+        output = subprocess.run(
+            command if indexes else command + ["--no-indexes"],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent.parent,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def _format_row(scale: int, source: str, indexes: bool, result: Dict[str, float], file_size: int) -> str:
+    memory = (
+        f"anon={result['RssAnon_kb'] / 1024:7.1f}MB file={result['RssFile_kb'] / 1024:6.1f}MB"
+        if "RssAnon_kb" in result
+        else f"maxrss={result['maxrss_kb'] / 1024:7.1f}MB"
+    )
+    return (
+        f"{scale:>3}x cards={int(result['cards']):<6} {source:<9} indexes={'on ' if indexes else 'off'} "
+        f"load={result['load_ms']:8.1f}ms {memory} first={result['first_us']:6.1f}us "
+        f"lookup={result['lookup_us']:6.1f}us "
+        f"size={file_size / 1024:8.1f}KB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data", default=str(_BASE_DIR / "data" / "data.json"))
+    parser.add_argument("--scales", default="1,10", help="comma-separated card-count multipliers")
+    parser.add_argument("--repeat", type=int, default=3, help="child processes per measurement (median is shown)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--no-indexes", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, not args.no_indexes)
+        return
+
+    from app.card_pack import compile_cards
+
+    # Per-card summary warnings are repeated once per copy at higher scales.
+    logging.getLogger("app").setLevel(logging.ERROR)
+    with open(args.data, "r", encoding="utf-8") as f:
+        cards = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in (int(value) for value in args.scales.split(",")):
+            scaled = _scaled_cards(cards, scale)
+            json_path = Path(tmp) / f"data-{scale}x.json"
+            pack_path = Path(tmp) / f"cards-{scale}x.pack"
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(scaled, f, ensure_ascii=False)
+            started = time.perf_counter()
+            compile_cards(scaled, pack_path)
+            print(f"{scale:>3}x compiled {pack_path.name} in {(time.perf_counter() - started) * 1000:.0f}ms")
+            for indexes in (False, True):
+                for source, path in (("data.json", json_path), ("card pack", pack_path)):
+                    result = _measure(path, indexes, args.repeat)
+                    print(_format_row(scale, source, indexes, result, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
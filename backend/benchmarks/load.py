@@ -0,0 +1,346 @@
+"""Load-test the RAG pipeline against local OpenAI / Upstash stand-ins.
+
+Run from ``backend/``::
+
+    python -m benchmarks.load --input ../requests.jsonl --requests 500 --concurrency 32
+    python -m benchmarks.load --target app-stream --chat-latency-ms 300 --error-rate 0.01
+    python -m benchmarks.load --tracemalloc --json-out baseline.json
+    python -m benchmarks.load --compare baseline.json
+
+Questions are read from a JSONL file with the same rules as the batch endpoint
+(``message`` / ``query`` / ``body`` / ``title``) and replayed round-robin.
+``--target services`` calls ``services.chat`` directly; ``app`` and
+``app-stream`` go through the FastAPI app (``/api/v1/chat`` and
+``/api/v1/chat/stream``) in-process. The real OpenAI SDK and pooled Upstash
+client are used; only the remote APIs are replaced by ``benchmarks.mocks``.
+
+The report has throughput, end-to-end and per-stage p50/p95/p99 (from the
+``X-Debug-Timings`` stage timings), upstream call counts and, with
+``--tracemalloc``, peak traced memory plus the top allocation sites.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .mocks import MockBehavior, MockConfig, MockServer, percentile
+
+_PERCENTILES = (50, 95, 99)
+_DEFAULT_INPUT = Path(__file__).resolve().parent.parent.parent / "requests.jsonl"
+
+
+def _configure_environment(args: argparse.Namespace, server: MockServer) -> None:
+    # app.services reads its configuration at import time, so this must run before importing it.
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": server.openai_base_url,
+            "UPSTASH_VECTOR_URL": server.url,
+            "UPSTASH_VECTOR_TOKEN": "benchmark",
+            "USE_FAKE_RAG": "false",
+            "RAG_RETRIEVAL_BACKEND": "upstash",
+        }
+    )
+    if not args.keep_caches:
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+        os.environ["EMBEDDING_CACHE_PATH"] = ""
+        os.environ["SHARED_CACHE_PATH"] = ""
+        os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+
+def _load_questions(path: str) -> List[str]:
+    from app.batch_chat import parse_batch_lines
+
+    with open(path, "r", encoding="utf-8") as f:
+        items, rejected = parse_batch_lines(f)
+    if rejected:
+        print(f"skipped {len(rejected)} unusable lines in {path}")
+    if not items:
+        raise SystemExit(f"No questions found in {path}")
+    return [item.message for item in items]
+
+
+async def _call_services(question: str) -> List[Dict[str, Any]]:
+    from app import services
+    from app.metrics import start_request_timings
+
+    timings = start_request_timings()
+    await services.chat(question, [])
+    return timings
+
+
+async def _call_app(client: Any, question: str) -> List[Dict[str, Any]]:
+    response = await client.post(
+        "/api/v1/chat", json={"message": question, "history": []}, headers={"X-Debug-Timings": "1"}
+    )
+    response.raise_for_status()
+    return response.json()["meta"].get("stage_timings") or []
+
+
+async def _call_app_stream(client: Any, question: str) -> List[Dict[str, Any]]:
+    started = time.perf_counter()
+    first_token_ms: float | None = None
+    timings: List[Dict[str, Any]] = []
+    async with client.stream(
+        "POST", "/api/v1/chat/stream", json={"message": question, "history": []}, headers={"X-Debug-Timings": "1"}
+    ) as response:
+        response.raise_for_status()
+        event = ""
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: ") :]
+            elif line.startswith("data: "):
+                if event == "token" and first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                elif event == "done":
+                    timings = json.loads(line[len("data: ") :]).get("stage_timings") or []
+                elif event == "error":
+                    raise RuntimeError(line[len("data: ") :])
+    if first_token_ms is not None:
+        timings.append({"stage": "client_time_to_first_token", "ms": first_token_ms})
+    return timings
+
+
+async def _drive(args: argparse.Namespace, questions: List[str]) -> Dict[str, Any]:
+    import httpx
+
+    from app import services
+    from app.main import app
+
+    client: httpx.AsyncClient | None = None
+    if args.target != "services":
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+
+    async def _one(question: str) -> List[Dict[str, Any]]:
+        if args.target == "services":
+            return await _call_services(question)
+        if args.target == "app":
+            return await _call_app(client, question)
+        return await _call_app_stream(client, question)
+
+    latencies: List[float] = []
+    stage_samples: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    queue: asyncio.Queue[str] = asyncio.Queue()
+
+    async def _worker() -> None:
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                timings = await _one(question)
+            except Exception as exc:
+                response = getattr(exc, "response", None)
+                status = getattr(response, "status_code", None) or getattr(exc, "status_code", None)
+                label = f"{type(exc).__name__}:{status}" if status else type(exc).__name__
+                errors[label] = errors.get(label, 0) + 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            for timing in timings:
+                stage = str(timing["stage"])
+                if timing.get("path"):
+                    stage = f"{stage}[{timing['path']}]"
+                stage_samples.setdefault(stage, []).append(float(timing["ms"]))
+
+    sent = 0
+
+    async def _run(total: int) -> float:
+        nonlocal sent
+        for _ in range(total):
+            question = questions[sent % len(questions)]
+            # A unique suffix keeps single-flight and caches from collapsing repeated questions.
+            queue.put_nowait(f"{question} ({sent})" if args.distinct else question)
+            sent += 1
+        started = time.perf_counter()
+        await asyncio.gather(*(_worker() for _ in range(args.concurrency)))
+        return time.perf_counter() - started
+
+    await services.start_http_clients()
+    try:
+        if args.warmup:
+            await _run(args.warmup)
+            latencies.clear()
+            stage_samples.clear()
+            errors.clear()
+
+        snapshot_before = None
+        if args.tracemalloc:
+            tracemalloc.start(args.tracemalloc_frames)
+            snapshot_before = tracemalloc.take_snapshot()
+        elapsed = await _run(args.requests)
+        allocations = _allocation_report(snapshot_before, args) if snapshot_before is not None else None
+    finally:
+        if args.tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if client is not None:
+            await client.aclose()
+        await services.close_http_clients()
+
+    return {
+        "target": args.target,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "completed": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": _summary(latencies),
+        "stages_ms": {stage: _summary(samples) for stage, samples in sorted(stage_samples.items())},
+        "allocations": allocations,
+    }
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    summary: Dict[str, float] = {"count": len(samples)}
+    for pct in _PERCENTILES:
+        summary[f"p{pct}"] = round(percentile(samples, pct), 3)
+    return summary
+
+
+def _allocation_report(before: tracemalloc.Snapshot, args: argparse.Namespace) -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "retained_bytes_per_request": round(allocated / args.requests) if args.requests else 0,
+        "top": [
+            {"site": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in stats[: args.tracemalloc_top]
+        ],
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"target={report['target']} requests={report['requests']} concurrency={report['concurrency']} "
+        f"completed={report['completed']} elapsed={report['elapsed_s']}s throughput={report['throughput_rps']} req/s"
+    )
+    if report["errors"]:
+        print(f"errors: {report['errors']}")
+    print(f"upstream calls: {report['upstream']['requests']} injected errors: {report['upstream']['errors']}")
+
+    rows = [("end_to_end", report["latency_ms"])] + list(report["stages_ms"].items())
+    width = max(len(name) for name, _ in rows)
+    print(f"{'stage':<{width}} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, summary in rows:
+        if not summary.get("count"):
+            continue
+        print(
+            f"{name:<{width}} {summary['count']:>6} "
+            + " ".join(f"{summary[f'p{pct}']:>10.3f}" for pct in _PERCENTILES)
+        )
+
+    allocations = report.get("allocations")
+    if allocations:
+        print(
+            f"tracemalloc: peak={allocations['peak_bytes'] / 1024:.1f} KiB "
+            f"current={allocations['current_bytes'] / 1024:.1f} KiB "
+            f"retained/request={allocations['retained_bytes_per_request']} B"
+        )
+        for entry in allocations["top"]:
+            print(f"  {entry['size_diff'] / 1024:+10.1f} KiB {entry['count_diff']:+8d} blocks  {entry['site']}")
+
+
+def _print_comparison(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    def _delta(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\ncompared with baseline ({baseline.get('target')}, {baseline.get('requests')} requests):")
+    old_rps, new_rps = baseline["throughput_rps"], report["throughput_rps"]
+    print(f"  throughput {old_rps} -> {new_rps} req/s ({_delta(new_rps, old_rps)})")
+    rows = [("end_to_end", report["latency_ms"], baseline["latency_ms"])]
+    rows += [
+        (stage, summary, baseline["stages_ms"][stage])
+        for stage, summary in report["stages_ms"].items()
+        if stage in baseline.get("stages_ms", {})
+    ]
+    for name, new, old in rows:
+        if not new.get("count") or not old.get("count"):
+            continue
+        changes = []
+        for pct in _PERCENTILES:
+            before, after = old[f"p{pct}"], new[f"p{pct}"]
+            changes.append(f"p{pct} {before:.2f}->{after:.2f}ms ({_delta(after, before)})")
+        print(f"  {name}: " + " ".join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", default=str(_DEFAULT_INPUT), help="JSONL file of questions")
+    parser.add_argument("--target", choices=("services", "app", "app-stream"), default="services")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--distinct", action="store_true", help="Make every replayed question unique")
+    parser.add_argument("--keep-caches", action="store_true", help="Leave embedding/response caches enabled")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=150.0)
+    parser.add_argument("--upstash-latency-ms", type=float, default=15.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="Uniform extra latency added to every mock call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock calls answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Share of namespaced Upstash queries with no matches")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace allocations during the measured run")
+    parser.add_argument("--tracemalloc-frames", type=int, default=1)
+    parser.add_argument("--tracemalloc-top", type=int, default=10)
+    parser.add_argument("--json-out", help="Write the report as JSON (e.g. to keep as a baseline)")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    def _behavior(latency_ms: float, **extra: float) -> MockBehavior:
+        return MockBehavior(
+            latency_ms=latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            **extra,
+        )
+
+    config = MockConfig(
+        embeddings=_behavior(args.embed_latency_ms),
+        chat=_behavior(args.chat_latency_ms),
+        upstash=_behavior(args.upstash_latency_ms, empty_rate=args.empty_rate),
+        dimensions=args.dimensions,
+    )
+    server = MockServer(config)
+    _configure_environment(args, server)
+    from app import services
+
+    # Mock matches point at real card ids so card summaries and context assembly do real work.
+    config.card_ids = list(services.card_store.snapshot.cards)
+    questions = _load_questions(args.input)
+    with server:
+        report = asyncio.run(_drive(args, questions))
+        report["upstream"] = server.stats()
+    _print_report(report)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            _print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Local stand-ins for the OpenAI and Upstash Vector APIs used by the benchmarks.
+
+One uvicorn server on 127.0.0.1 serves:
+
+* ``POST /v1/embeddings``: deterministic unit vectors derived from the input text
+  (honours ``encoding_format=base64``, which the OpenAI SDK requests by default)
+* ``POST /v1/chat/completions``: a canned answer, as JSON or as an SSE stream
+* ``POST /query`` and ``POST /query/{namespace}``: Upstash-shaped matches
+
+Each API gets its own ``MockBehavior`` with injected latency, jitter and error
+rate; ``GET /_mock/stats`` returns per-API request and injected-error counts.
+The server runs in a child process by default so it does not compete with the
+code being measured for the GIL. Point the app at it with
+``OPENAI_BASE_URL=<server.openai_base_url>`` and ``UPSTASH_VECTOR_URL=<server.url>``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+import httpx
+import numpy as np
+import uvicorn
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@dataclass
+class MockBehavior:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Upstash only: share of namespaced queries answered with no matches.
+    empty_rate: float = 0.0
+
+
+@dataclass
+class MockConfig:
+    embeddings: MockBehavior = field(default_factory=MockBehavior)
+    chat: MockBehavior = field(default_factory=MockBehavior)
+    upstash: MockBehavior = field(default_factory=MockBehavior)
+    dimensions: int = 1536
+    card_ids: Sequence[str] = ()
+    answer: str = "モック回答です。序盤はコストの軽いフォロワーで盤面を取りましょう。"
+    stream_chunk_chars: int = 4
+    seed: int = 0
+
+
+def _text_vector(text: str, dimensions: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _MockApp:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.request_counts: Dict[str, int] = {}
+        self.error_counts: Dict[str, int] = {}
+        self.card_ids = list(config.card_ids) or [str(index) for index in range(100)]
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return
+        chunks: List[bytes] = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = json.loads(b"".join(chunks) or b"{}")
+
+        path: str = scope["path"]
+        if path == "/_mock/stats":
+            await self._send_json(send, 200, {"requests": self.request_counts, "errors": self.error_counts})
+            return
+        if path.endswith("/embeddings"):
+            api, behavior = "embeddings", self.config.embeddings
+        elif path.endswith("/chat/completions"):
+            api, behavior = "chat", self.config.chat
+        elif path == "/query" or path.startswith("/query/"):
+            api, behavior = "upstash", self.config.upstash
+        else:
+            await self._send_json(send, 404, {"error": {"message": f"no mock for {path}"}})
+            return
+
+        self.request_counts[api] = self.request_counts.get(api, 0) + 1
+        delay = behavior.latency_ms + (self.random.uniform(0, behavior.jitter_ms) if behavior.jitter_ms else 0.0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if behavior.error_rate and self.random.random() < behavior.error_rate:
+            self.error_counts[api] = self.error_counts.get(api, 0) + 1
+            await self._send_json(send, behavior.error_status, {"error": {"message": "injected error"}})
+            return
+
+        if api == "embeddings":
+            await self._send_json(send, 200, self._embeddings(body))
+        elif api == "chat" and body.get("stream"):
+            await self._stream_chat(send, body)
+        elif api == "chat":
+            await self._send_json(send, 200, self._chat(body))
+        else:
+            namespace = path[len("/query/") :] if path.startswith("/query/") else ""
+            await self._send_json(send, 200, self._query(body, namespace, behavior))
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: object) -> None:
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+    def _embeddings(self, body: dict) -> dict:
+        inputs = body.get("input")
+        texts = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        base64_output = body.get("encoding_format") == "base64"
+        data = []
+        for index, text in enumerate(texts):
+            vector = _text_vector(str(text), self.config.dimensions)
+            embedding = base64.b64encode(vector.tobytes()).decode() if base64_output else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(str(text)) for text in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "mock"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _chat(self, body: dict) -> dict:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.config.answer},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    async def _stream_chat(self, send, body: dict) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        answer = self.config.answer
+        size = max(1, self.config.stream_chunk_chars)
+        for start in range(0, len(answer), size):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": answer[start : start + size]}, "finish_reason": None}],
+            }
+            await send({"type": "http.response.body", "body": f"data: {json.dumps(chunk)}\n\n".encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+    def _query(self, body: dict, namespace: str, behavior: MockBehavior) -> dict:
+        if namespace and behavior.empty_rate and self.random.random() < behavior.empty_rate:
+            return {"result": []}
+        top_k = int(body.get("topK") or 5)
+        picked = self.random.sample(self.card_ids, min(top_k, len(self.card_ids)))
+        return {
+            "result": [
+                {
+                    "id": f"{card_id}-{namespace or 'default'}",
+                    "score": 0.95 - rank * 0.01,
+                    "metadata": {
+                        "text": f"mock {namespace or 'default'} text for {card_id}",
+                        "title": f"Mock {card_id}",
+                        "card_id": card_id,
+                    },
+                }
+                for rank, card_id in enumerate(picked)
+            ]
+        }
+
+
+def _uvicorn_server(config: MockConfig, port: int) -> uvicorn.Server:
+    return uvicorn.Server(
+        uvicorn.Config(
+            _MockApp(config),
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+            lifespan="off",
+            access_log=False,
+        )
+    )
+
+
+def _serve(config: MockConfig, port: int) -> None:
+    _uvicorn_server(config, port).run()
+
+
+class MockServer:
+    """Run the mock APIs for the duration of a ``with`` block (child process, or thread with ``in_process``)."""
+
+    def __init__(self, config: MockConfig | None = None, *, in_process: bool = False) -> None:
+        self.config = config or MockConfig()
+        self.port = free_port()
+        self._server: uvicorn.Server | None = None
+        self._runner: threading.Thread | multiprocessing.Process
+        if in_process:
+            self._server = _uvicorn_server(self.config, self.port)
+            self._runner = threading.Thread(target=self._server.run, daemon=True)
+        else:
+            self._runner = multiprocessing.Process(target=_serve, args=(self.config, self.port), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return httpx.get(f"{self.url}/_mock/stats").json()
+
+    def __enter__(self) -> "MockServer":
+        self._runner.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.1):
+                    return self
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Mock server did not start on port {self.port}")
+                time.sleep(0.02)
+
+    def __exit__(self, *exc) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._runner.join()
+        else:
+            self._runner.terminate()  # type: ignore[union-attr]
+            self._runner.join()
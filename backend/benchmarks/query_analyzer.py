@@ -0,0 +1,200 @@
+"""Query parsing per chat request: the separate directive helpers versus ``QueryAnalyzer``.
+
+Run from ``backend/``::
+
+    python -m benchmarks.query_analyzer --cases 20000 --iterations 20000
+
+Before timing, random messages built from directive fragments, full-width
+and half-width characters, whitespace and punctuation are checked:
+
+* ``QueryAnalyzer.analyze`` returns the text, namespace and multi-effect flag
+  that ``extract_effect_namespace`` and ``strip_effect_directive`` give for the
+  message after plain ``unicodedata.normalize("NFKC")`` and whitespace collapsing
+* full-width variants of a message analyze identically
+* whitespace-run and trailing ``?`` / ``！`` / ``。`` variants of a plain question
+  share one ``cache_key``
+* questions that differ only in digit separators, signs, decimal points or inner
+  symbols get different keys
+
+The timing compares one pass of the old parsing (NFKC and whitespace
+normalization, ``extract_effect_namespace`` and ``strip_effect_directive``)
+with ``analyze``, which also builds the cache key, and the same two with
+card-name matching added (``match_card_name`` versus ``resolve_card_names``).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import re
+import time
+import unicodedata
+from typing import Callable, List, Tuple
+
+_DIRECTIVE_FRAGMENTS = ["effect_", "EFFECT_", "Effect_", "effect", "namespace ", "Namespace ", "NAMESPACE "]
+_SEPARATORS = [" ", "  ", "　", "\t", ":", "：", ""]
+_CONTENT = [
+    "相手", "リーダー", "に", "ダメージ", "カード", "フォロワー", "コスト", "2", "12",
+    "は", "を", "abc", "Xyz",
+]
+_PUNCTUATION = ["?", "？", "!", "！", "。", "、", ",", "・", "…"]
+_WHITESPACE = [" ", "  ", "　", "\t", " \u3000 "]
+_TRAILING_PUNCTUATION = ["?", "？", "!", "！", "。", " "]
+# Pairs that must not share a key; {} is filled with random content words.
+_DISTINCT_PAIRS = [
+    ("{}コスト1、2のフォロワー", "{}コスト12のフォロワー"),
+    ("{}攻撃力-1", "{}攻撃力1"),
+    ("{}攻撃力+1", "{}攻撃力1"),
+    ("{}HP 1.5", "{}HP 15"),
+    ("{}A+B", "{}AB"),
+    ("{}1,000", "{}1000"),
+    ("{}コスト2・3", "{}コスト23"),
+]
+# Characters NFKC changes beyond the full-width ASCII block.
+_COMPATIBILITY = [
+    "ｶｰﾄﾞ", "ﾀﾞﾒｰｼﾞ", "①", "㌢", "ｶ\u3099", "e\u0301", "Ａ\u0301", "ﬁ", "\u00a0", "\u2003",
+]
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _reference_normalize(text: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def _full_width(text: str) -> str:
+    return "".join(
+        "　" if char == " " else chr(ord(char) + 0xFEE0) if "!" <= char <= "~" else char for char in text
+    )
+
+
+def _random_message(rng: random.Random, keyword: str) -> str:
+    parts: List[str] = []
+    for _ in range(rng.randint(0, 8)):
+        roll = rng.random()
+        if roll < 0.25:
+            parts.append(rng.choice(_DIRECTIVE_FRAGMENTS) + str(rng.randint(0, 12)) * rng.randint(0, 1))
+        elif roll < 0.4:
+            parts.append(keyword)
+        elif roll < 0.6:
+            parts.append(rng.choice(_SEPARATORS))
+        elif roll < 0.7:
+            parts.append(rng.choice(_PUNCTUATION))
+        elif roll < 0.78:
+            parts.append(rng.choice(_COMPATIBILITY))
+        else:
+            parts.append(rng.choice(_CONTENT))
+    message = "".join(parts)
+    return _full_width(message) if rng.random() < 0.2 else message
+
+
+def check_equivalence(cases: int, seed: int) -> None:
+    from app.services import extract_effect_namespace, query_analyzer, strip_effect_directive
+
+    rng = random.Random(seed)
+    keyword = query_analyzer.directive_keyword
+    for _ in range(cases):
+        message = _random_message(rng, keyword)
+        analyzed = query_analyzer.analyze(message)
+
+        expected_text, expected_namespace = extract_effect_namespace(_reference_normalize(message))
+        expected_text, expected_multi = strip_effect_directive(expected_text)
+        expected = (expected_text, expected_namespace, expected_multi)
+        actual = (analyzed.text, analyzed.namespace, analyzed.multi_effect)
+        if actual != expected:
+            raise SystemExit(f"{message!r}: analyzer {actual} != helpers {expected}")
+
+        wide = query_analyzer.analyze(_full_width(message))
+        if (wide.text, wide.namespace, wide.multi_effect, wide.cache_key) != (*actual, analyzed.cache_key):
+            raise SystemExit(f"{message!r}: full-width variant analyzes differently")
+
+        words = [rng.choice(_CONTENT) for _ in range(rng.randint(1, 6))]
+        plain = query_analyzer.analyze(" ".join(words))
+        whitespace = rng.choice(_WHITESPACE)
+        trailing = "".join(rng.choice(_TRAILING_PUNCTUATION) for _ in range(rng.randint(0, 3)))
+        spaced = query_analyzer.analyze(rng.choice(_WHITESPACE) + whitespace.join(words) + trailing)
+        if spaced.cache_key != plain.cache_key:
+            raise SystemExit(f"{words!r}: whitespace/trailing variant has key {spaced.cache_key} != {plain.cache_key}")
+
+        prefix = "".join(rng.choice(_CONTENT) for _ in range(rng.randint(0, 3)))
+        left, right = (template.format(prefix) for template in rng.choice(_DISTINCT_PAIRS))
+        if rng.random() < 0.5:
+            left, right = _full_width(left), _full_width(right)
+        if query_analyzer.analyze(left).cache_key == query_analyzer.analyze(right).cache_key:
+            raise SystemExit(f"{left!r} and {right!r} share a cache key")
+    print(f"equivalence: {cases} random messages OK (directive keyword {keyword!r})")
+
+
+def _compare(
+    runs: List[Tuple[str, Callable[[str], object]]], messages: List[str], iterations: int, repeat: int
+) -> List[float]:
+    # Rounds alternate between the variants and the best round of each counts, so a noisy
+    # neighbour slows both sides alike instead of deciding the comparison.
+    rounds: List[List[float]] = [[] for _ in runs]
+    for _ in range(max(1, repeat)):
+        for timings, (_, run) in zip(rounds, runs):
+            started = time.perf_counter()
+            for index in range(iterations):
+                run(messages[index % len(messages)])
+            timings.append((time.perf_counter() - started) / iterations * 1e6)
+    per_query = [min(timings) for timings in rounds]
+    for (label, _), microseconds in zip(runs, per_query):
+        print(f"{label:<38} {microseconds:7.2f} us/query")
+    return per_query
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", type=int, default=20000, help="random messages for the equivalence check")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger("app").setLevel(logging.ERROR)
+    from app.services import card_store, extract_effect_namespace, query_analyzer, strip_effect_directive
+
+    check_equivalence(args.cases, args.seed)
+
+    snapshot = card_store.snapshot
+    names = [snapshot.cards[card_id].get("name", "") for card_id in list(snapshot.cards)[:20]]
+    keyword = query_analyzer.directive_keyword
+    messages = [
+        "コスト2のフォロワーを教えて",
+        "相手リーダーにダメージを与えるカードは？",
+        f"{keyword}：相手のフォロワーを破壊する",
+        "effect_3 手札を1枚捨てる",
+        "ＥＦＦＥＣＴ＿２　ファンファーレ　カードを１枚引く",
+        *(f"{name}の効果は？" for name in names if name),
+    ]
+
+    def _parse_before(message: str) -> Tuple[str, str | None, bool]:
+        cleaned, namespace = extract_effect_namespace(_reference_normalize(message))
+        cleaned, multi_effect = strip_effect_directive(cleaned)
+        return cleaned, namespace, multi_effect
+
+    def _before(message: str) -> None:
+        cleaned, namespace, multi_effect = _parse_before(message)
+        if snapshot.lexical_index is not None and not (namespace or multi_effect):
+            snapshot.lexical_index.match_card_name(cleaned)
+
+    def _after(message: str) -> None:
+        query_analyzer.resolve_card_names(query_analyzer.analyze(message), snapshot)
+
+    print(f"messages={len(messages)} lexical_index={'on' if snapshot.lexical_index is not None else 'off'}")
+    parse_before_us, parse_after_us, before_us, after_us = _compare(
+        [
+            ("NFKC + helpers", _parse_before),
+            ("analyze (incl. cache key)", query_analyzer.analyze),
+            ("NFKC + helpers + name match", _before),
+            ("analyze + resolve_card_names", _after),
+        ],
+        messages,
+        args.iterations,
+        args.repeat,
+    )
+    print(f"speedup: parsing {parse_before_us / parse_after_us:.2f}x, with name matching {before_us / after_us:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""CPU time per /api/v1/chat response body: FastAPI's response_model path versus pre-encoded JSON.
+
+Run from ``backend/``::
+
+    python -m benchmarks.response_encoding --iterations 2000
+
+A ``ChatResponse`` carrying ``--cards`` card summaries from the loaded card data
+is encoded the way FastAPI does for ``response_model=ChatResponse`` (dump,
+validate, ``jsonable_encoder``, ``json.dumps``) and with
+``app.response_encoding.encode_chat_response``. Both bodies are decoded and
+compared before timing, so the script doubles as a wire-format check.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+
+def _sample_response(card_count: int):
+    from app.models import ChatResponse, ChatResponseMeta
+    from app.services import card_store
+
+    snapshot = card_store.snapshot
+    cards = [snapshot.summaries[card_id] for card_id in list(snapshot.summaries)[:card_count]]
+    meta = ChatResponseMeta(
+        used_context_count=len(cards),
+        matched_titles=[card.name for card in cards],
+        used_namespace="default",
+        raw_match_count=len(cards),
+        upstash_status_code=200,
+        cards=cards,
+        context_tokens=420,
+        history_tokens=0,
+        prompt_tokens=512,
+        session_id="benchmark-session",
+    )
+    return ChatResponse(answer="水タイプで序盤に使いやすいカードは〇〇です。" * 4, meta=meta), snapshot
+
+
+async def _fastapi_body(field, response) -> bytes:
+    content = await serialize_response(field=field, response_content=response, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--cards", type=int, default=5, help="card summaries per response (RAG_TOP_K)")
+    args = parser.parse_args()
+
+    logging.getLogger("app").setLevel(logging.ERROR)
+    from app.main import app
+    from app.response_encoding import encode_chat_response, orjson
+
+    route = next(route for route in app.routes if getattr(route, "path", None) == "/api/v1/chat")
+    response, snapshot = _sample_response(args.cards)
+
+    async def _run() -> None:
+        baseline = await _fastapi_body(route.response_field, response)
+        fast = encode_chat_response(response, snapshot)
+        if json.loads(baseline) != json.loads(fast):
+            raise SystemExit("pre-encoded body differs from the response_model body")
+        print(f"cards={len(response.meta.cards)} body={len(fast)} bytes encoder={'orjson' if orjson else 'json'}")
+
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            await _fastapi_body(route.response_field, response)
+        baseline_us = (time.perf_counter() - started) / args.iterations * 1e6
+
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            encode_chat_response(response, snapshot)
+        fast_us = (time.perf_counter() - started) / args.iterations * 1e6
+
+        print(f"response_model + json.dumps {baseline_us:8.1f} us/response")
+        print(f"pre-encoded                 {fast_us:8.1f} us/response ({baseline_us / fast_us:.1f}x)")
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
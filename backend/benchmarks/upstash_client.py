@@ -0,0 +1,107 @@
+"""Compare per-request httpx clients against the pooled Upstash client.
+
+Run from ``backend/``::
+
+    python -m benchmarks.upstash_client --requests 500 --concurrency 20
+
+The local Upstash ``/query/{namespace}`` mock from ``benchmarks.mocks`` is
+started on 127.0.0.1, so no credentials or network access are required.
+Every call sends a fresh random vector and the search cache and single-flight
+are switched off, so both sides make one upstream request per call.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+
+from .mocks import MockBehavior, MockConfig, MockServer, percentile
+
+
+async def _drive(call: Callable[[], Awaitable[None]], total: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(_one() for _ in range(total)))
+    return latencies
+
+
+def _report(label: str, latencies: List[float], elapsed: float, upstream: int) -> None:
+    print(
+        f"{label:<28} n={len(latencies):<5} "
+        f"p50={statistics.median(latencies):7.2f}ms "
+        f"p99={percentile(latencies, 99):7.2f}ms "
+        f"throughput={len(latencies) / elapsed:8.1f} req/s "
+        f"upstream={upstream}"
+    )
+
+
+def _upstream_requests(base_url: str) -> int:
+    return httpx.get(f"{base_url}/_mock/stats").json()["requests"].get("upstash", 0)
+
+
+async def _run(args: argparse.Namespace, base_url: str) -> None:
+    from app import services
+
+    headers = {"Authorization": "Bearer benchmark"}
+
+    def _vector() -> List[float]:
+        return [random.random() for _ in range(args.dimensions)]
+
+    async def per_request_client() -> None:
+        payload = {"topK": 5, "vector": _vector(), "includeVectors": False, "includeMetadata": True}
+        # Mirrors the previous implementation: a fresh client (and connection) per query.
+        async with httpx.AsyncClient(timeout=15) as client:
+            response = await client.post(f"{base_url}/query/effect_1", json=payload, headers=headers)
+            response.raise_for_status()
+            response.json()
+
+    async def pooled_client() -> None:
+        await services.search_similar_docs(_vector(), top_k=5, namespace="effect_1")
+
+    await services.start_http_clients()
+    try:
+        for label, call in (("before: AsyncClient per call", per_request_client), ("after: pooled client", pooled_client)):
+            await _drive(call, min(args.warmup, args.requests), args.concurrency)
+            before = _upstream_requests(base_url)
+            started = time.perf_counter()
+            latencies = await _drive(call, args.requests, args.concurrency)
+            elapsed = time.perf_counter() - started
+            _report(label, latencies, elapsed, _upstream_requests(base_url) - before)
+    finally:
+        await services.close_http_clients()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Injected server-side latency per query")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    with MockServer(MockConfig(upstash=MockBehavior(latency_ms=args.latency_ms))) as server:
+        os.environ["UPSTASH_VECTOR_URL"] = server.url
+        os.environ["UPSTASH_VECTOR_TOKEN"] = "benchmark"
+        # Measure the client, not the caches in front of it.
+        os.environ["SEARCH_CACHE_ENABLED"] = "false"
+        os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+        asyncio.run(_run(args, server.url))
+
+
+if __name__ == "__main__":
+    main()
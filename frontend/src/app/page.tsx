@@ -3,7 +3,7 @@
 import { FormEvent, KeyboardEvent, useEffect, useRef, useState } from "react";
 import { ChatMessage } from "@/components/ChatMessage";
 import { CardList } from "@/components/CardList";
-import { ChatMessagePayload, sendChatMessage } from "@/lib/api";
+import { ChatMessagePayload, sendChatMessageStream } from "@/lib/api";
 
 type Message = ChatMessagePayload & { id: string };
 
@@ -19,6 +19,9 @@ export default function HomePage() {
   const [isLoading, setIsLoading] = useState(false);
   const bottomRef = useRef<HTMLDivElement | null>(null);
   const isComposing = useRef(false);
+  // One conversation per page load; the backend issues this id with the first answer and keeps the
+  // history and last retrieval under it.
+  const sessionId = useRef<string | null>(null);
 
   useEffect(() => {
     bottomRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -40,23 +43,37 @@ export default function HomePage() {
     setInput("");
     setIsLoading(true);
 
+    const assistantId = crypto.randomUUID();
+    const updateAssistant = (update: (message: Message) => Message) => {
+      setMessages((prev: Message[]) => {
+        const exists = prev.some((message) => message.id === assistantId);
+        if (!exists) {
+          return [...prev, update({ id: assistantId, role: "assistant", content: "" })];
+        }
+        return prev.map((message) => (message.id === assistantId ? update(message) : message));
+      });
+    };
+
     try {
-      const historyPayload = nextMessages.map(({ role, content }) => ({ role, content }));
-      const response = await sendChatMessage(trimmed, historyPayload);
-      const assistantMessage: Message = {
-        id: crypto.randomUUID(),
-        role: "assistant",
+      // Earlier turns, without the welcome message, in case the backend no longer has the session.
+      const history = messages.filter((message) => message.id !== initialMessage.id);
+      const response = await sendChatMessageStream(trimmed, sessionId.current, history, {
+        onMeta: (meta) => {
+          sessionId.current = meta.session_id ?? sessionId.current;
+          updateAssistant((message) => ({ ...message, cards: meta.cards }));
+        },
+        onToken: (delta) => updateAssistant((message) => ({ ...message, content: message.content + delta })),
+      });
+      updateAssistant((message) => ({
+        ...message,
         content: response.answer || "回答を生成できませんでした。",
         cards: response.meta.cards,
-      };
-      setMessages((prev: Message[]) => [...prev, assistantMessage]);
+      }));
     } catch (error) {
-      const fallback: Message = {
-        id: crypto.randomUUID(),
-        role: "assistant",
+      updateAssistant((message) => ({
+        ...message,
         content: "現在回答を生成できません。時間をおいて再度お試しください。",
-      };
-      setMessages((prev: Message[]) => [...prev, fallback]);
+      }));
     } finally {
       setIsLoading(false);
     }
@@ -21,39 +21,152 @@ export type CardSummary = {
   image_after: string;
 };
 
+export type ChatResponseMeta = {
+  used_context_count: number;
+  cards?: CardSummary[];
+  session_id?: string | null;
+  follow_up?: "reuse" | "extend" | null;
+};
+
 export type ChatResponse = {
   answer: string;
-  meta: {
-    used_context_count: number;
-    cards?: CardSummary[];
-  };
+  meta: ChatResponseMeta;
+};
+
+export type ChatStreamHandlers = {
+  onMeta?: (meta: ChatResponseMeta) => void;
+  onToken?: (delta: string) => void;
 };
 
 const API_BASE_URL = (process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000").replace(/\/$/, "");
 
-export async function sendChatMessage(
+async function toApiError(response: Response): Promise<Error> {
+  let detail = response.statusText;
+  try {
+    const errorBody = await response.json();
+    detail = errorBody?.detail || detail;
+  } catch (error) {
+    // ignore JSON parse issues and fall back to status text
+  }
+  return new Error(`API error: ${detail}`);
+}
+
+// Same as the backend's HISTORY_CONTEXT_TURNS: older messages never reach the prompt.
+const HISTORY_MESSAGE_LIMIT = 5;
+
+// The backend keeps the conversation under the session id it issued, but that session can be gone (another
+// worker, a restart, sessions disabled), so the latest messages are sent along as a fallback.
+function chatRequestBody(message: string, sessionId: string | null, history: ChatMessagePayload[]): string {
+  return JSON.stringify({
+    message,
+    ...(sessionId ? { session_id: sessionId } : { start_session: true }),
+    history: history.slice(-HISTORY_MESSAGE_LIMIT).map(({ role, content }) => ({ role, content })),
+  });
+}
+
+// Without a session id, or when the backend no longer accepts it (403, e.g. after its secret changed), a new
+// session is started; its id comes back in meta.session_id.
+async function postChat(
+  endpoint: string,
+  headers: Record<string, string>,
   message: string,
+  sessionId: string | null,
   history: ChatMessagePayload[]
+): Promise<Response> {
+  const post = (id: string | null) =>
+    fetch(endpoint, { method: "POST", headers, body: chatRequestBody(message, id, history) });
+  const response = await post(sessionId);
+  if (response.status === 403 && sessionId) {
+    return post(null);
+  }
+  return response;
+}
+
+export async function sendChatMessage(
+  message: string,
+  sessionId: string | null,
+  history: ChatMessagePayload[] = []
 ): Promise<ChatResponse> {
   const endpoint = `${API_BASE_URL}/api/v1/chat`;
-  const response = await fetch(endpoint, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-    },
-    body: JSON.stringify({ message, history }),
-  });
+  const response = await postChat(endpoint, { "Content-Type": "application/json" }, message, sessionId, history);
 
   if (!response.ok) {
-    let detail = response.statusText;
-    try {
-      const errorBody = await response.json();
-      detail = errorBody?.detail || detail;
-    } catch (error) {
-      // ignore JSON parse issues and fall back to status text
-    }
-    throw new Error(`API error: ${detail}`);
+    throw await toApiError(response);
   }
 
   return response.json();
 }
+
+function parseSseEvent(block: string): { event: string; data: string } | null {
+  let event = "message";
+  const dataLines: string[] = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice("event:".length).trim();
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice("data:".length).trimStart());
+    }
+  }
+  if (dataLines.length === 0) return null;
+  return { event, data: dataLines.join("\n") };
+}
+
+export async function sendChatMessageStream(
+  message: string,
+  sessionId: string | null,
+  history: ChatMessagePayload[] = [],
+  handlers: ChatStreamHandlers = {}
+): Promise<ChatResponse> {
+  const endpoint = `${API_BASE_URL}/api/v1/chat/stream`;
+  const headers = { "Content-Type": "application/json", Accept: "text/event-stream" };
+  const response = await postChat(endpoint, headers, message, sessionId, history);
+
+  if (!response.ok || !response.body) {
+    throw await toApiError(response);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let meta: ChatResponseMeta = { used_context_count: 0 };
+  let answer = "";
+
+  const handleBlock = (block: string) => {
+    const parsed = parseSseEvent(block);
+    if (!parsed) return;
+    const payload = JSON.parse(parsed.data);
+    switch (parsed.event) {
+      case "meta":
+        meta = payload;
+        handlers.onMeta?.(payload);
+        break;
+      case "token":
+        answer += payload.delta;
+        handlers.onToken?.(payload.delta);
+        break;
+      case "done":
+        answer = payload.answer;
+        break;
+      case "error":
+        throw new Error(`API error: ${JSON.stringify(payload.detail)}`);
+    }
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, "\n");
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      handleBlock(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+  buffer += decoder.decode();
+  if (buffer.trim()) {
+    handleBlock(buffer);
+  }
+
+  return { answer, meta };
+}